@@ -0,0 +1,260 @@
+"""
+Webhook throughput and per-update latency benchmark.
+
+The recorded updates of `payloads/` are replayed through `MessengerCallback`,
+the messenger APIs are replaced by the local stub server. Run it from
+the project directory:
+
+    python -m benchmarks.run
+    python -m benchmarks.run --save-baseline
+"""
+import argparse
+import copy
+import hashlib
+import hmac
+import itertools
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.core.management import call_command  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import CaptureQueriesContext  # noqa: E402
+
+from bot_engine.message_log import message_log  # noqa: E402
+from bot_engine.messengers.viber import Viber  # noqa: E402
+from bot_engine.models import Account, Button, Menu, Messenger  # noqa: E402
+from bot_engine.settings import bot_api_settings  # noqa: E402
+
+from .stub import StubServer  # noqa: E402
+
+
+BASE_DIR = Path(__file__).resolve().parent
+PAYLOADS_DIR = BASE_DIR / 'payloads'
+BASELINE = BASE_DIR / 'baseline.json'
+
+SCENARIOS = ('text_echo', 'button_menu', 'new_user', 'service_events')
+PLATFORMS = ('telegram', 'viber')
+
+TELEGRAM_TOKEN = '123456:benchmark'
+VIBER_TOKEN = 'benchmark-viber-token'
+# The account of the known user scenarios
+TELEGRAM_USER = 5000001
+VIBER_USER = '01234567890A='
+
+
+class Replay:
+    """
+    Updates of one scenario with the new ids for every request,
+    otherwise the repeated updates are dropped as the redelivered ones
+    """
+
+    def __init__(self, platform: str, payloads: list, new_users: bool):
+        self.platform = platform
+        self.payloads = itertools.cycle(payloads)
+        self.new_users = new_users
+        self.counter = itertools.count(1)
+
+    def next(self) -> bytes:
+        number = next(self.counter)
+        update = copy.deepcopy(next(self.payloads))
+        if self.platform == 'telegram':
+            update['update_id'] += number * 10
+            message = update['message']
+            message['message_id'] += number * 10
+            if self.new_users:
+                message['from']['id'] = message['chat']['id'] = (
+                    message['from']['id'] + number)
+        else:
+            if 'message_token' in update:
+                update['message_token'] += number * 10
+            if self.new_users:
+                update['user']['id'] = f'{update["user"]["id"]}{number}'
+        return json.dumps(update).encode()
+
+
+def percentile(values: list, percent: float) -> float:
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(percent / 100 * len(values))) - 1)
+    return values[max(index, 0)]
+
+
+def setup_messengers() -> dict:
+    """
+    Messengers with the menu "Home" -> "Settings" -> "Home"
+    """
+    home = Menu.objects.create(title='Home')
+    settings_menu = Menu.objects.create(title='Settings',
+                                        message='Choose the option')
+    to_settings = Button.objects.create(title='Settings', text='Settings',
+                                        next_menu=settings_menu, handler='')
+    back = Button.objects.create(title='Back', text='Back',
+                                 next_menu=home, handler='')
+    home.buttons.add(to_settings)
+    settings_menu.buttons.add(back)
+
+    messengers = {
+        'telegram': Messenger.objects.create(
+            title='Telegram benchmark', api_type='telegram',
+            token=TELEGRAM_TOKEN, menu=home),
+        'viber': Messenger.objects.create(
+            title='Viber benchmark', api_type='viber',
+            token=VIBER_TOKEN, menu=home),
+    }
+    Account.objects.create(id=TELEGRAM_USER, username='bench',
+                           messenger=messengers['telegram'], menu=home)
+    Account.objects.create(id=VIBER_USER, username='bench',
+                           messenger=messengers['viber'], menu=home)
+    return messengers
+
+
+def signature_headers(messenger: Messenger, body: bytes) -> dict:
+    if messenger.api_type == 'telegram':
+        return {'HTTP_X_TELEGRAM_BOT_API_SECRET_TOKEN':
+                messenger.api.secret_token}
+    digest = hmac.new(VIBER_TOKEN.encode(), body, hashlib.sha256).hexdigest()
+    return {'HTTP_X_VIBER_CONTENT_SIGNATURE': digest}
+
+
+def run_scenario(client: Client, messenger: Messenger, replay: Replay,
+                 iterations: int, warmup: int) -> dict:
+    url = f'/bot/{messenger.token_hash()}/'
+    for _ in range(warmup):
+        body = replay.next()
+        client.post(url, body, content_type='application/json',
+                    **signature_headers(messenger, body))
+
+    latencies, queries = [], 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        body = replay.next()
+        headers = signature_headers(messenger, body)
+        with CaptureQueriesContext(connection) as captured:
+            request_started = time.perf_counter()
+            response = client.post(url, body,
+                                   content_type='application/json', **headers)
+            latencies.append(time.perf_counter() - request_started)
+        if response.status_code != 200:
+            raise RuntimeError(f'Webhook failed; Status={response.status_code};'
+                               f' Body={response.content[:200]};')
+        queries += len(captured)
+    elapsed = time.perf_counter() - started
+
+    return {
+        'updates_per_sec': round(iterations / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 3),
+        'queries': round(queries / iterations, 2),
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float,
+            tail_tolerance: float) -> list:
+    """
+    Regressions past the baseline: less throughput or higher p50 latency
+    by more than `tolerance`, higher p99 latency by more than
+    `tail_tolerance`, or more queries per update
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result['updates_per_sec'] < base['updates_per_sec'] * (1 - tolerance):
+            regressions.append(f'{name}: updates/sec {result["updates_per_sec"]}'
+                               f' < {base["updates_per_sec"]}')
+        if result['p50_ms'] > base['p50_ms'] * (1 + tolerance):
+            regressions.append(f'{name}: p50 {result["p50_ms"]} ms'
+                               f' > {base["p50_ms"]} ms')
+        if result['p99_ms'] > base['p99_ms'] * (1 + tail_tolerance):
+            regressions.append(f'{name}: p99 {result["p99_ms"]} ms'
+                               f' > {base["p99_ms"]} ms')
+        if result['queries'] > base['queries']:
+            regressions.append(f'{name}: queries/update {result["queries"]}'
+                               f' > {base["queries"]}')
+    return regressions
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--iterations', type=int, default=500,
+                        help='Updates per scenario.')
+    parser.add_argument('--warmup', type=int, default=50,
+                        help='Updates per scenario before the measurement.')
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS,
+                        help='Scenarios to run, all by default.')
+    parser.add_argument('--platform', action='append', choices=PLATFORMS,
+                        help='Messengers to run, all by default.')
+    parser.add_argument('--baseline', type=Path, default=BASELINE,
+                        help='Stored results to compare with.')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed throughput and p50 latency '
+                             'regression, share of the baseline.')
+    parser.add_argument('--tail-tolerance', type=float, default=1.0,
+                        help='Allowed p99 latency regression, the tail '
+                             'is noisy on the shared machines.')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Store the results as the new baseline.')
+    options = parser.parse_args(argv)
+
+    call_command('migrate', run_syncdb=True, verbosity=0)
+    stub = StubServer()
+    stub_url = stub.start()
+    bot_api_settings.TELEGRAM_API_URL = stub_url + '/bot{token}/{method}'
+    Viber.api_url = stub_url + '/pa'
+
+    messengers = setup_messengers()
+
+    client = Client()
+    results = {}
+    for platform in options.platform or PLATFORMS:
+        with open(PAYLOADS_DIR / f'{platform}.json') as payload_file:
+            payloads = json.load(payload_file)
+        for scenario in options.scenario or SCENARIOS:
+            if scenario not in payloads:
+                continue
+            replay = Replay(platform, payloads[scenario],
+                            new_users=scenario == 'new_user')
+            name = f'{platform}.{scenario}'
+            results[name] = result = run_scenario(
+                client, messengers[platform], replay,
+                options.iterations, options.warmup)
+            print(f'{name:<28} {result["updates_per_sec"]:>9} upd/s '
+                  f'p50 {result["p50_ms"]:>8} ms  p99 {result["p99_ms"]:>8} ms '
+                  f'queries {result["queries"]:>6}')
+    message_log.flush()
+    print(f'API calls: {stub.calls};')
+
+    if options.save_baseline:
+        with open(options.baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write('\n')
+        print(f'Baseline is saved; Path={options.baseline};')
+        return 0
+
+    if not options.baseline.exists():
+        print('Baseline not found, run with --save-baseline.')
+        return 0
+    with open(options.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    regressions = compare(results, baseline, options.tolerance,
+                          options.tail_tolerance)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,43 @@
+"""
+Django settings of the benchmark project, the database is a temporary
+SQLite file unless BENCHMARK_DB is set.
+"""
+import os
+import tempfile
+
+
+SECRET_KEY = 'benchmark'
+DEBUG = False
+ALLOWED_HOSTS = ['*']
+INSTALLED_APPS = [
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.sites',
+    'django.contrib.admin',
+    'rest_framework',
+    'bot_engine',
+]
+MIDDLEWARE = []
+ROOT_URLCONF = 'benchmarks.urls'
+SITE_ID = 1
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('BENCHMARK_DB') or os.path.join(
+            tempfile.mkdtemp(prefix='bot-engine-bench-'), 'db.sqlite3'),
+        # The message log is written by the background thread
+        'OPTIONS': {'timeout': 30},
+    },
+}
+TEMPLATES = [{
+    'BACKEND': 'django.template.backends.django.DjangoTemplates',
+    'APP_DIRS': True,
+}]
+USE_TZ = True
+
+REST_FRAMEWORK = {
+    # The outgoing calls go to the local stub, they are not throttled
+    'RATE_LIMITS': {'telegram': {}, 'viber': {}},
+}
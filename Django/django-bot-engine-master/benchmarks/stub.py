@@ -0,0 +1,77 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+__all__ = ('StubServer', )
+
+
+MESSAGE_RESULT = {'message_id': 1, 'date': 0,
+                  'chat': {'id': 1, 'type': 'private'}}
+TELEGRAM_RESULTS = {
+    'getChat': {'id': 1, 'type': 'private', 'first_name': 'Bench'},
+    'getChatMember': {'status': 'member',
+                      'user': {'id': 1, 'is_bot': False,
+                               'first_name': 'Bench'}},
+    'getUserProfilePhotos': {'total_count': 0, 'photos': []},
+    'setWebhook': True,
+    'deleteWebhook': True,
+}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Answers every call of Telegram Bot API and Viber REST API with success
+    """
+    protocol_version = 'HTTP/1.1'
+    # The headers and the body are written separately
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        self.server.calls += 1
+
+        if self.path.startswith('/bot'):
+            method = self.path.rsplit('/', 1)[-1].split('?')[0]
+            answer = {'ok': True,
+                      'result': TELEGRAM_RESULTS.get(method, MESSAGE_RESULT)}
+        elif self.path.endswith('/get_user_details'):
+            answer = {'status': 0, 'status_message': 'ok',
+                      'user': {'id': 'bench', 'name': 'Bench'}}
+        else:
+            answer = {'status': 0, 'status_message': 'ok',
+                      'message_token': 1}
+
+        data = json.dumps(answer).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    """
+    Local replacement of the messenger APIs, counts the calls
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.calls = 0
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_port}'
+
+    def start(self) -> str:
+        threading.Thread(target=self.serve_forever, name='bench-stub',
+                         daemon=True).start()
+        return self.url
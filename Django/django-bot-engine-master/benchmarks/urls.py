@@ -0,0 +1,7 @@
+from django.urls import include, path
+
+
+urlpatterns = [
+    path('bot/', include(('bot_engine.urls', 'bot_engine'),
+                         namespace='bot_api')),
+]
@@ -1,4 +1,8 @@
 import logging
+import sys
+from typing import Callable
+
+from django.utils.module_loading import autodiscover_modules, import_string
 
 # from .chatbots import EchoBot
 
@@ -9,15 +13,22 @@ __author__ = 'Aleksey Terentyev'
 __license__ = 'Apache 2.0'
 __copyright__ = 'Copyright 2019-2020 Aleksey Terentyev'
 
+default_app_config = 'bot_engine.apps.BotEngineConfig'
+
 log = logging.getLogger(__name__)
 
 
 class HandlersStorage:
     """
-
+    Process-wide registry of the handlers.
+    The handlers are registered by the dotted path used in the handler
+    fields of the models, the `bot_handlers` modules of the installed apps
+    are registered at the app start, other paths are imported once
+    on the first use.
     """
     _chatbot_classes = {}
     _menu_items = {}
+    _handlers = {}
 
     # def __init__(self):
     #     self._chatbot_classes['bot_engine.chatbots:EchoBot'] = EchoBot
@@ -42,6 +53,57 @@ class HandlersStorage:
         #     return func(*args, **kwargs)
         return func
 
+    def handler(self, func: Callable) -> Callable:
+        """
+        Register the handler by its dotted path
+        """
+        self.register(f'{func.__module__}.{func.__qualname__}', func)
+        return func
+
+    def register(self, path: str, handler: Callable):
+        self._handlers[path] = handler
+
+    def resolve(self, path: str) -> Callable:
+        """
+        Handler by the dotted path
+        :param path: dotted path, e.g. "bot_engine.bot_handlers.echo_handler"
+        :return: handler
+        :raise ImportError: the path can not be imported
+        """
+        try:
+            return self._handlers[path]
+        except KeyError:
+            handler = import_string(path)
+            self._handlers[path] = handler
+            return handler
+
+    def autodiscover(self, module_name: str = None):
+        """
+        Import the handler modules of the installed apps
+        and register their public callables
+        """
+        from django.apps import apps
+        from .settings import bot_api_settings
+
+        module_name = module_name or bot_api_settings.HANDLERS_MODULE
+        autodiscover_modules(module_name)
+        for app_config in apps.get_app_configs():
+            module = sys.modules.get(f'{app_config.name}.{module_name}')
+            if module is None:
+                continue
+            names = getattr(module, '__all__', None) or [
+                name for name, value in vars(module).items()
+                if not name.startswith('_') and callable(value)
+                and getattr(value, '__module__', None) == module.__name__]
+            for name in names:
+                self.register(f'{module.__name__}.{name}',
+                              getattr(module, name))
+        log.debug(f'Handlers are registered; Count={len(self._handlers)};')
+
+    @property
+    def handlers(self):
+        return self._handlers
+
     @property
     def chatbots(self):
         return self._chatbot_classes
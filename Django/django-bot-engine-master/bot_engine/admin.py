@@ -1,4 +1,5 @@
 import logging
+import threading
 
 from django import forms
 from django.contrib import admin
@@ -6,7 +7,11 @@ from django.forms.widgets import Select
 from django.template.defaultfilters import pluralize
 from django.utils.translation import gettext_lazy as _
 
-from .models import Messenger, Account, Menu, Button
+from .broadcast import BroadcastSender
+from .models import (
+    Messenger, Account, Broadcast, Menu, Button, MediaFile, MessageLog
+)
+from .routing import messenger_registry
 from .types import Message, MessageType
 
 
@@ -75,12 +80,12 @@ class MessengerAdmin(admin.ModelAdmin):
     list_display = ('title', 'api_type', 'menu', 'proxy', 'is_active')
     list_filter = ('api_type', 'menu', 'is_active', 'updated')
     search_fields = ('title', 'api_type', 'token', 'hash')
-    readonly_fields = ('is_active', 'hash')
+    readonly_fields = ('is_active', 'webhook_secret', 'hash')
     actions = ('enable_webhook', 'disable_webhook')
     fieldsets = (
         (None, {
-            'fields': ('title', 'api_type', 'is_active', 'handler',
-                       'welcome_text'),
+            'fields': ('title', 'api_type', 'is_active', 'webhook_secret',
+                       'handler', 'welcome_text'),
             'classes': ('extrapretty', 'wide'),
         }),
         (_('Authenticate'), {
@@ -101,6 +106,7 @@ class MessengerAdmin(admin.ModelAdmin):
             for messenger in queryset.all():
                 messenger.enable_webhook()
             rows_updated = queryset.update(is_active=True)
+            messenger_registry.clear()
             msg = _(f'{rows_updated} messenger{pluralize(rows_updated)} '
                     f'{pluralize(rows_updated, _("was,were"))} '
                     f'successfully enabled')
@@ -113,6 +119,7 @@ class MessengerAdmin(admin.ModelAdmin):
         for messenger in queryset.all():
             messenger.disable_webhook()
         rows_updated = queryset.update(is_active=False)
+        messenger_registry.clear()
         msg = _(f'{rows_updated} messenger{pluralize(rows_updated)} '
                 f'{pluralize(rows_updated, _("was,were"))} '
                 f'successfully disabled')
@@ -146,8 +153,9 @@ class AccountAdmin(admin.ModelAdmin):
 
     def send_ping(self, request, queryset):
         # TODO: implement checking subscription
-        queryset.all()[0].send_message(Message(message_type=MessageType.TEXT,
-                                               text='ping'))
+        for account in queryset.all():
+            account.send_message(Message(message_type=MessageType.TEXT,
+                                         text='ping'))
     send_ping.short_description = _('Check account')
 
 
@@ -238,3 +246,80 @@ class ButtonAdmin(admin.ModelAdmin):
 
     class Meta:
         model = Button
+
+
+@admin.register(Broadcast)
+class BroadcastAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'messenger', 'status',
+                    'sent', 'failed', 'unsubscribed', 'updated')
+    list_filter = ('messenger', 'status', 'updated', 'created')
+    search_fields = ('text', )
+    readonly_fields = ('status', 'last_account', 'sent', 'failed',
+                       'unsubscribed', 'updated', 'created')
+    raw_id_fields = ('media', )
+    actions = ('run_broadcast', )
+    fieldsets = (
+        (None, {
+            'fields': ('messenger', 'text', 'menu', 'media'),
+            'classes': ('extrapretty', 'wide'),
+        }),
+        (_('Progress'), {
+            'fields': ('status', 'last_account', 'sent', 'failed',
+                       'unsubscribed', 'updated', 'created'),
+            'classes': ('extrapretty', 'wide'),
+        }),
+    )
+
+    class Meta:
+        model = Broadcast
+
+    def run_broadcast(self, request, queryset):
+        started = 0
+        for broadcast in queryset.select_related('messenger', 'menu', 'media'):
+            # The stale running broadcasts are resumed
+            sender = BroadcastSender(broadcast)
+            if sender.claim():
+                threading.Thread(target=sender.run, kwargs={'claimed': True},
+                                 daemon=True).start()
+                started += 1
+        self.message_user(request, _('%(started)d of %(total)d broadcasts '
+                                     'started, the rest are running. Long '
+                                     'broadcasts are better run by the '
+                                     '"run_broadcast" management command.')
+                          % {'started': started, 'total': len(queryset)})
+    run_broadcast.short_description = _('Start or resume selected broadcasts')
+
+
+@admin.register(MessageLog)
+class MessageLogAdmin(admin.ModelAdmin):
+    list_display = ('created', 'messenger', 'account_id', 'direction',
+                    'message_type', 'status', 'text')
+    list_filter = ('messenger', 'direction', 'message_type', 'status',
+                   'created')
+    search_fields = ('account__id', 'message_id', 'text')
+    date_hierarchy = 'created'
+    show_full_result_count = False
+
+    class Meta:
+        model = MessageLog
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(MediaFile)
+class MediaFileAdmin(admin.ModelAdmin):
+    list_display = ('path', 'content_type', 'size', 'created')
+    search_fields = ('sha256', 'path', 'uploads__file_id',
+                     'uploads__file_unique_id')
+    readonly_fields = ('sha256', 'path', 'size', 'content_type', 'source',
+                       'created')
+
+    class Meta:
+        model = MediaFile
+
+    def has_add_permission(self, request):
+        return False
@@ -5,8 +5,11 @@ class BotEngineConfig(AppConfig):
     name = 'bot_engine'
     verbose_name = 'Django Bot Engine'
 
-    # def ready(self):
-    #     # ?
-    #     BOT_API_CLIENT_MODEL = ''
-    #     scan_apps_chatbots()
-    # self.module.autodiscover('bot_handlers')
+    def ready(self):
+        from . import bot_handler, checks, signals  # noqa: F401
+
+        bot_handler.autodiscover()
+
+        from .metrics import metrics
+        if metrics.enabled:
+            metrics.exporters()
@@ -2,7 +2,7 @@ from .models import Account
 from .types import Message
 
 
-__all__ = ('echo_handler', )
+__all__ = ('echo_handler', 'async_echo_handler')
 
 
 def echo_handler(message: Message, account: Account):
@@ -10,3 +10,10 @@ def echo_handler(message: Message, account: Account):
     Simple echo chat bot.
     """
     account.send_message(message)
+
+
+async def async_echo_handler(message: Message, account: Account):
+    """
+    Simple echo chat bot for the async dispatch.
+    """
+    await account.asend_message(message)
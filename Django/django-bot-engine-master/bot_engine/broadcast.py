@@ -0,0 +1,160 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Iterator, List
+
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .errors import MediaError, MessengerException, NotSubscribed
+from .keyboards import keyboard_cache
+from .media import media_store
+from .message_log import message_log
+from .models import Account, Broadcast
+from .settings import bot_api_settings
+from .throttling import Priority
+from .types import MessageType
+
+
+__all__ = ('BroadcastSender', )
+
+log = logging.getLogger(__name__)
+
+SENT, FAILED, UNSUBSCRIBED = 'sent', 'failed', 'unsubscribed'
+
+
+class BroadcastSender:
+    """
+    Sends one message to every active account of the messenger.
+    The accounts are streamed in keyset-paginated chunks ordered by id,
+    each chunk is sent by the pool of sender threads with the broadcast
+    priority of the connector scheduler, so the interactive replies
+    go ahead. After the chunk the unsubscribed accounts are
+    deactivated by one UPDATE and the progress is saved to the broadcast,
+    so the stopped broadcast can be resumed.
+    The broadcast is claimed by a conditional status update, the running
+    one is claimed again only when its checkpoints stopped for
+    `BROADCAST_STALE_TIMEOUT` seconds (the sender is gone).
+    The media of the broadcast is uploaded by the first send alone,
+    the rest of the accounts get it by the platform file id.
+    """
+
+    def __init__(self, broadcast: Broadcast, chunk_size: int = None,
+                 workers: int = None):
+        self.broadcast = broadcast
+        self.messenger = broadcast.messenger
+        self.chunk_size = chunk_size or bot_api_settings.BROADCAST_CHUNK_SIZE
+        self.workers = workers or bot_api_settings.BROADCAST_WORKERS
+
+    def claim(self) -> bool:
+        """
+        Mark the broadcast running if it is not run by another sender
+        :return: False if the broadcast is running
+        """
+        now = timezone.now()
+        stale = now - timedelta(
+            seconds=bot_api_settings.BROADCAST_STALE_TIMEOUT)
+        claimed = Broadcast.objects.filter(
+            ~Q(status=Broadcast.RUNNING) | Q(updated__lt=stale),
+            id=self.broadcast.id,
+        ).update(status=Broadcast.RUNNING, updated=now)
+        if claimed:
+            self.broadcast.status = Broadcast.RUNNING
+        return bool(claimed)
+
+    def run(self, claimed: bool = False) -> bool:
+        """
+        Send the broadcast
+        :param claimed: the broadcast is already claimed by `claim`
+        :return: False if the broadcast is run by another sender
+        """
+        if not claimed and not self.claim():
+            log.warning(f'Broadcast is already running; '
+                        f'Broadcast={self.broadcast!r};')
+            return False
+
+        # The keyboard is rendered once for all accounts
+        self._keyboard = keyboard_cache.get(self.messenger.api,
+                                            self.broadcast.menu_id)
+
+        media = self.broadcast.media
+        if media is not None:
+            self._media_type = media_store.media_type(media)
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for chunk in self._chunks():
+                    results = []
+                    if (media is not None
+                            and not media_store.file_id(self.messenger, media)):
+                        # The parallel sends would upload the file each
+                        results.append(self._send(chunk[0]))
+                    results.extend(executor.map(self._send,
+                                                chunk[len(results):]))
+                    self._checkpoint(chunk, results)
+        except BaseException:
+            self._set_status(Broadcast.PAUSED)
+            raise
+        self._set_status(Broadcast.DONE)
+        return True
+
+    def _chunks(self) -> Iterator[List[str]]:
+        last_id = self.broadcast.last_account
+        queryset = (Account.objects.select_related(None)
+                    .filter(messenger=self.messenger, is_active=True)
+                    .order_by('id'))
+        while True:
+            chunk = list(queryset.filter(id__gt=last_id)
+                         .values_list('id', flat=True)[:self.chunk_size]
+                         .iterator())
+            if not chunk:
+                break
+            yield chunk
+            last_id = chunk[-1]
+
+    def _send(self, account_id: str) -> str:
+        media = self.broadcast.media
+        try:
+            if media is None:
+                message_type = MessageType.TEXT
+                message_id = self.messenger.api.send_message(
+                    account_id, self.broadcast.text,
+                    keyboard=self._keyboard, priority=Priority.BROADCAST)
+            else:
+                message_type = self._media_type
+                message_id = media_store.send(
+                    self.messenger, account_id, media, self._media_type,
+                    self.broadcast.text, keyboard=self._keyboard,
+                    priority=Priority.BROADCAST)
+            message_log.log_outgoing(self.messenger, account_id,
+                                     self.broadcast.text, message_id,
+                                     message_type)
+        except NotSubscribed:
+            return UNSUBSCRIBED
+        except (MessengerException, MediaError) as err:
+            log.warning(f'Broadcast failed; Account={account_id}; '
+                        f'Error={err};')
+            return FAILED
+        return SENT
+
+    def _checkpoint(self, chunk: List[str], results: List[str]):
+        unsubscribed = [account_id for account_id, result
+                        in zip(chunk, results) if result == UNSUBSCRIBED]
+        if unsubscribed:
+            Account.objects.filter(id__in=unsubscribed).update(is_active=False)
+
+        Broadcast.objects.filter(id=self.broadcast.id).update(
+            last_account=chunk[-1],
+            sent=F('sent') + results.count(SENT),
+            failed=F('failed') + results.count(FAILED),
+            unsubscribed=F('unsubscribed') + len(unsubscribed),
+            # The heartbeat of the claim
+            updated=timezone.now())
+        self.broadcast.last_account = chunk[-1]
+        log.debug(f'Broadcast checkpoint; Broadcast={self.broadcast!r}; '
+                  f'Account={chunk[-1]};')
+
+    def _set_status(self, status: str):
+        Broadcast.objects.filter(id=self.broadcast.id).update(
+            status=status, updated=timezone.now())
+        self.broadcast.status = status
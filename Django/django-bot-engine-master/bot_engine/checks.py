@@ -0,0 +1,40 @@
+from django.core.checks import Tags, Warning, register
+from django.db import DatabaseError
+
+from . import bot_handler
+
+
+@register(Tags.database)
+def check_handlers(app_configs=None, databases=None, **kwargs):
+    """
+    Every handler stored in the database must be importable.
+    The check runs only when the databases are requested,
+    e.g. by `check --database default` and `migrate`.
+    """
+    from .models import Button, Menu, Messenger
+
+    if not databases:
+        return []
+
+    errors = []
+    for model in (Messenger, Menu, Button):
+        try:
+            paths = set()
+            for alias in databases:
+                paths.update(model.objects.using(alias).exclude(handler='')
+                             .values_list('handler', flat=True))
+        except DatabaseError:
+            # The tables are not created yet
+            return []
+
+        for path in sorted(paths):
+            try:
+                bot_handler.resolve(path)
+            except ImportError as err:
+                errors.append(Warning(
+                    f'{model.__name__} handler "{path}" can not be imported.',
+                    hint=str(err),
+                    obj=model,
+                    id='bot_engine.W001',
+                ))
+    return errors
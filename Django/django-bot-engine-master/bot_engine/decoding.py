@@ -0,0 +1,92 @@
+import json
+import logging
+from typing import Any, Callable, Union
+
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpRequest
+from rest_framework.request import Request
+
+from .settings import bot_api_settings
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
+
+
+__all__ = ('decode_body', 'get_decoder', 'LazyJson')
+
+log = logging.getLogger(__name__)
+
+_decoders = {
+    'json': json.loads,
+}
+if orjson is not None:
+    _decoders['orjson'] = orjson.loads
+if simdjson is not None:
+    _decoders['simdjson'] = simdjson.loads
+
+_decoder = None
+
+
+def get_decoder() -> Callable[[bytes], Any]:
+    """
+    JSON decoder of the webhook bodies set by `JSON_DECODER`,
+    by default the fastest installed one: orjson, simdjson, json.
+    Every decoder accepts the raw bytes.
+    """
+    global _decoder
+
+    if _decoder is None:
+        name = bot_api_settings.JSON_DECODER
+        if not name:
+            name = next(name for name in ('orjson', 'simdjson', 'json')
+                        if name in _decoders)
+        elif name not in _decoders:
+            raise ImproperlyConfigured(f'JSON decoder "{name}" '
+                                       f'is not installed.')
+        _decoder = _decoders[name]
+        log.debug(f'Webhook JSON decoder; Decoder={name};')
+    return _decoder
+
+
+def decode_body(request: Union[Request, HttpRequest]) -> Any:
+    """
+    Decoded JSON body of the webhook request.
+    The body is decoded once, the result is kept on the Django request,
+    so the view, the verification and the connector share it.
+    :param request: Rest framework or Django request object
+    :return: decoded data
+    :raise ValueError: the body is not valid JSON
+    """
+    http_request = getattr(request, '_request', request)
+    try:
+        return http_request.bot_payload
+    except AttributeError:
+        pass
+
+    payload = get_decoder()(http_request.body)
+    http_request.bot_payload = payload
+    return payload
+
+
+class LazyJson:
+    """
+    Serializes the data for the log message only when it is emitted,
+    pass it as the argument: `log.debug('Data=%s;', LazyJson(data))`
+    """
+    __slots__ = ('data', )
+
+    def __init__(self, data: Any):
+        self.data = data
+
+    def __str__(self):
+        try:
+            return json.dumps(self.data, ensure_ascii=False, default=str)
+        except (TypeError, ValueError):
+            return repr(self.data)
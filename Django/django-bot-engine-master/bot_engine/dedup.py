@@ -0,0 +1,150 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from hashlib import md5
+from typing import Tuple
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+
+from .settings import bot_api_settings
+from .types import Message
+
+
+__all__ = ('UpdateDeduplicator', 'deduplicator')
+
+log = logging.getLogger(__name__)
+
+
+class UpdateDeduplicator:
+    """
+    Idempotency window of the incoming updates.
+    The update redelivered by IM service is recognized by the messenger,
+    type, sender and id of the message during `DEDUP_TTL` seconds.
+    The keys are kept in the process LRU, the cache of `DEDUP_CACHE` alias
+    (if set) shares the window between the processes.
+    The key of the update failed to process is forgotten, so the retry
+    of IM service is let through.
+    """
+
+    def __init__(self, max_size: int = None):
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._seen = OrderedDict()
+
+    @property
+    def max_size(self) -> int:
+        return self._max_size or bot_api_settings.DEDUP_MAX_SIZE
+
+    @staticmethod
+    def key(messenger: 'Messenger', message: Message) -> Tuple:
+        return (messenger.id, message.type.value, message.user_id,
+                str(message.id))
+
+    def is_duplicate(self, messenger: 'Messenger', message: Message) -> bool:
+        """
+        Remember the update and check if it was already seen
+        :param messenger: Messenger object
+        :param message: parsed message
+        :return: True if the update should be dropped
+        """
+        ttl = bot_api_settings.DEDUP_TTL
+        if not ttl or message.id is None:
+            return False
+
+        key = self.key(messenger, message)
+        if self._check_local(key, ttl):
+            return True
+        return self._check_shared(key, ttl)
+
+    async def ais_duplicate(self, messenger: 'Messenger',
+                            message: Message) -> bool:
+        """
+        Async variant of `is_duplicate`
+        """
+        ttl = bot_api_settings.DEDUP_TTL
+        if not ttl or message.id is None:
+            return False
+
+        key = self.key(messenger, message)
+        if self._check_local(key, ttl):
+            return True
+        if not bot_api_settings.DEDUP_CACHE:
+            return False
+        return await sync_to_async(self._check_shared)(key, ttl)
+
+    def forget(self, messenger: 'Messenger', message: Message):
+        """
+        Forget the update, its redelivery is processed again
+        :param messenger: Messenger object
+        :param message: parsed message
+        """
+        if message.id is None:
+            return
+
+        key = self.key(messenger, message)
+        with self._lock:
+            self._seen.pop(key, None)
+        self._forget_shared(key)
+
+    async def aforget(self, messenger: 'Messenger', message: Message):
+        """
+        Async variant of `forget`
+        """
+        if message.id is None:
+            return
+
+        key = self.key(messenger, message)
+        with self._lock:
+            self._seen.pop(key, None)
+        if bot_api_settings.DEDUP_CACHE:
+            await sync_to_async(self._forget_shared)(key)
+
+    def clear(self):
+        with self._lock:
+            self._seen.clear()
+
+    def _check_local(self, key: Tuple, ttl: float) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            expires = self._seen.get(key)
+            if expires is not None and expires > now:
+                self._seen.move_to_end(key)
+                return True
+            self._seen[key] = now + ttl
+            self._seen.move_to_end(key)
+            while len(self._seen) > self.max_size:
+                self._seen.popitem(last=False)
+        return False
+
+    @staticmethod
+    def _check_shared(key: Tuple, ttl: float) -> bool:
+        alias = bot_api_settings.DEDUP_CACHE
+        if not alias:
+            return False
+
+        try:
+            # `add` is atomic, only the first process stores the key
+            return not caches[alias].add(_cache_key(key), 1, timeout=ttl)
+        except Exception as err:
+            log.warning(f'Dedup cache error; Error={err};')
+            return False
+
+    @staticmethod
+    def _forget_shared(key: Tuple):
+        alias = bot_api_settings.DEDUP_CACHE
+        if not alias:
+            return
+
+        try:
+            caches[alias].delete(_cache_key(key))
+        except Exception as err:
+            log.warning(f'Dedup cache error; Error={err};')
+
+
+def _cache_key(key: Tuple) -> str:
+    return 'bot_engine:dedup:' + md5(repr(key).encode()).hexdigest()
+
+
+deduplicator = UpdateDeduplicator()
@@ -0,0 +1,298 @@
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Hashable, List, Optional
+
+from django.db import close_old_connections, connections
+
+from .metrics import metrics
+from .settings import bot_api_settings
+from .types import Message
+
+
+__all__ = ('DispatchMode', 'DispatchPool', 'KeyedExecutor', 'dispatch_pool')
+
+log = logging.getLogger(__name__)
+
+
+class DispatchMode:
+    SYNC = 'sync'
+    THREAD = 'thread'
+    PROCESS = 'process'
+
+
+def _init_process():
+    """
+    Initializer of the dispatch worker processes.
+    """
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+    # Connections inherited from the parent process must not be shared
+    connections.close_all()
+
+
+def _process_dispatch(im_hash: str, message: Message):
+    """
+    Dispatch the message in the worker process.
+    """
+    from .routing import messenger_registry
+
+    _dispatch(messenger_registry.get(im_hash), message)
+
+
+def _dispatch(messenger, message: Message, done: Callable = None):
+    close_old_connections()
+    try:
+        messenger.handle_message(message)
+    except Exception as err:
+        log.exception(f'Dispatch error; Message={message}; Error={err};')
+    finally:
+        close_old_connections()
+        if done is not None:
+            done()
+
+
+class KeyedExecutor:
+    """
+    Runs the tasks of one key strictly in order
+    and the tasks of different keys in parallel.
+    Every key has its own bounded queue, a key with queued tasks is taken
+    by one worker thread at a time and goes back to the end of the line
+    after each task, so a busy key does not hold other keys.
+    """
+
+    def __init__(self, workers: int, max_pending: int, max_per_key: int,
+                 name: str = 'bot-engine-keyed'):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_per_key = max_per_key
+        self.name = name
+        self._cond = threading.Condition()
+        # Key -> queued tasks, the key is in `_ready` or taken by a worker
+        self._queues: Dict[Hashable, deque] = {}
+        self._ready = deque()
+        self._pending = 0
+        self._closed = False
+        self._threads: List[threading.Thread] = []
+        # Metrics
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def start(self):
+        for num in range(self.workers):
+            thread = threading.Thread(target=self._work,
+                                      name=f'{self.name}-{num}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, key: Hashable, func: Callable, *args,
+               timeout: float = 0) -> bool:
+        """
+        Queue the task of the key
+        :param key: tasks of the same key run in order
+        :param func: task
+        :param timeout: seconds to wait for the place in the full queue
+        :return: False if the queue is full
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while (self._pending >= self.max_pending
+                   or len(self._queues.get(key, ())) >= self.max_per_key):
+                remaining = deadline - time.monotonic()
+                if self._closed or remaining <= 0:
+                    self.rejected += 1
+                    return False
+                self._cond.wait(remaining)
+
+            tasks = self._queues.get(key)
+            if tasks is None:
+                tasks = self._queues[key] = deque()
+                self._ready.append(key)
+            tasks.append((time.monotonic(), func, args))
+            self._pending += 1
+            self.submitted += 1
+            self._cond.notify_all()
+        return True
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Queue depth and wait time metrics
+        """
+        with self._cond:
+            started = self.submitted - self._pending
+            return {
+                'depth': self._pending,
+                'keys': len(self._queues),
+                'submitted': self.submitted,
+                'rejected': self.rejected,
+                'completed': self.completed,
+                'wait_avg': self.wait_total / started if started else 0.0,
+                'wait_max': self.wait_max,
+            }
+
+    def shutdown(self, wait: bool = True):
+        """
+        Stop the workers after running the queued tasks
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+        self._threads = []
+
+    def _work(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._ready or self._closed)
+                if not self._ready:
+                    return
+                key = self._ready.popleft()
+                queued, func, args = self._queues[key].popleft()
+                self._pending -= 1
+                wait = time.monotonic() - queued
+                self.wait_total += wait
+                self.wait_max = max(self.wait_max, wait)
+                self._cond.notify_all()
+
+            try:
+                func(*args)
+            except Exception as err:
+                log.exception(f'Task error; Key={key}; Error={err};')
+
+            with self._cond:
+                self.completed += 1
+                if self._queues[key]:
+                    self._ready.append(key)
+                else:
+                    del self._queues[key]
+
+
+class DispatchPool:
+    """
+    Background pool for webhook updates.
+    The webhook answers at once, the updates are processed by the workers.
+    The updates of one account are processed strictly in order (within
+    one process), the updates of different accounts in parallel,
+    by the threads or by the worker processes.
+    """
+
+    def __init__(self, mode: str = None, workers: int = None,
+                 queue_size: int = None):
+        self._mode = mode
+        self._workers = workers
+        self._queue_size = queue_size
+        self._lock = threading.Lock()
+        self._executor: Optional[KeyedExecutor] = None
+        self._process_executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def mode(self) -> str:
+        return self._mode or bot_api_settings.DISPATCH_MODE
+
+    @property
+    def workers(self) -> int:
+        return self._workers or bot_api_settings.DISPATCH_WORKERS
+
+    @property
+    def queue_size(self) -> int:
+        return self._queue_size or bot_api_settings.DISPATCH_QUEUE_SIZE
+
+    @property
+    def is_enabled(self) -> bool:
+        return self.mode != DispatchMode.SYNC
+
+    def submit(self, messenger, message: Message, timeout: float = 0,
+               done: Callable[[], None] = None) -> bool:
+        """
+        Put the update to the queue of the account.
+        :param messenger: Messenger object
+        :param message: new incoming massage object
+        :param timeout: seconds to wait for the place in the full queue
+        :param done: called after the dispatch, in the pool thread
+        :return: False if the queue is full
+        """
+        if self._executor is None:
+            self.start()
+
+        key = (messenger.id, message.user_id)
+        if self._process_executor is None:
+            accepted = self._executor.submit(key, _dispatch, messenger,
+                                             message, done, timeout=timeout)
+        else:
+            accepted = self._executor.submit(key, self._process_call,
+                                             messenger.hash, message, done,
+                                             timeout=timeout)
+        if not accepted:
+            log.warning(f'Dispatch queue is full; Message={message};')
+        return accepted
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Queue depth and wait time metrics of the pool
+        """
+        return self._executor.stats() if self._executor else {}
+
+    def _gauges(self) -> Dict[str, float]:
+        stats = self.stats()
+        if not stats:
+            return {}
+        return {
+            'queue_depth': stats['depth'],
+            'wait_avg_seconds': stats['wait_avg'],
+            'wait_max_seconds': stats['wait_max'],
+            'rejected': stats['rejected'],
+        }
+
+    def start(self):
+        with self._lock:
+            if self._executor is not None:
+                return
+            if self.mode not in (DispatchMode.THREAD, DispatchMode.PROCESS):
+                raise ValueError(f'Unknown dispatch mode: {self.mode}')
+
+            if self.mode == DispatchMode.PROCESS:
+                self._process_executor = ProcessPoolExecutor(
+                    max_workers=self.workers, initializer=_init_process)
+            executor = KeyedExecutor(
+                self.workers, self.queue_size,
+                bot_api_settings.DISPATCH_ACCOUNT_QUEUE_SIZE,
+                name='bot-engine-dispatch')
+            executor.start()
+            self._executor = executor
+            metrics.add_collector('bot_engine_dispatch', self._gauges)
+            atexit.register(self.shutdown)
+
+    def shutdown(self, wait: bool = True):
+        """
+        Stop the workers after processing the queued updates.
+        """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+            if self._process_executor is not None:
+                self._process_executor.shutdown(wait=wait)
+            self._executor, self._process_executor = None, None
+
+    def _process_call(self, im_hash: str, message: Message,
+                      done: Callable = None):
+        # The thread of the key waits for the worker process
+        try:
+            self._process_executor.submit(_process_dispatch,
+                                          im_hash, message).result()
+        finally:
+            if done is not None:
+                done()
+
+
+dispatch_pool = DispatchPool()
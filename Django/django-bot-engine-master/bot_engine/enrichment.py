@@ -0,0 +1,176 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Dict, List, Tuple
+
+from django.db import close_old_connections
+
+from .media import media_downloader
+from .settings import bot_api_settings
+
+
+__all__ = ('ProfileEnricher', 'profile_enricher')
+
+log = logging.getLogger(__name__)
+
+
+class ProfileEnricher:
+    """
+    Deferred fetching of the account profiles from the messenger APIs.
+    The dispatch only puts the account to the queue, the background
+    worker fetches the profiles of the batch and writes back only
+    the changed profile fields, one `bulk_update` per set of fields.
+    The activity of the account is left to the dispatch, the fetched info
+    is merged into the stored one (e.g. the avatar set meanwhile).
+    The fetch of the same account is never queued twice, the failed
+    fetches are not repeated during `ENRICHMENT_RETRY_DELAY` seconds.
+    """
+
+    def __init__(self, batch_size: int = None, interval: float = None):
+        self._batch_size = batch_size
+        self._interval = interval
+        self._cond = threading.Condition()
+        # (messenger id, account id) -> messenger, queued and in-flight
+        self._pending: Dict[Tuple[int, str], 'Messenger'] = OrderedDict()
+        self._in_flight = set()
+        self._failed: Dict[Tuple[int, str], float] = {}
+        self._thread = None
+
+    @property
+    def batch_size(self) -> int:
+        return self._batch_size or bot_api_settings.ENRICHMENT_BATCH_SIZE
+
+    @property
+    def interval(self) -> float:
+        return self._interval or bot_api_settings.ENRICHMENT_INTERVAL
+
+    def enqueue(self, messenger: 'Messenger', account_id: str) -> bool:
+        """
+        Queue the profile fetch of the account.
+        :param messenger: Messenger object of the account
+        :param account_id: account id
+        :return: False if the fetch is already queued or recently failed
+        """
+        key = (messenger.id, account_id)
+        with self._cond:
+            if key in self._pending or key in self._in_flight:
+                return False
+            if self._failed.get(key, 0) > time.monotonic():
+                return False
+
+            self._pending[key] = messenger
+            # The first account starts the interval, the full batch ends it
+            if len(self._pending) in (1, self.batch_size):
+                self._cond.notify()
+            self._start()
+        return True
+
+    def flush(self):
+        """
+        Fetch and save all queued profiles in the current thread.
+        """
+        while self._process(self._take()):
+            pass
+
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._work, name='bot-engine-enrichment', daemon=True)
+            self._thread.start()
+
+    def _take(self) -> List[Tuple[Tuple[int, str], 'Messenger']]:
+        with self._cond:
+            batch = []
+            while self._pending and len(batch) < self.batch_size:
+                key, messenger = self._pending.popitem(last=False)
+                self._in_flight.add(key)
+                batch.append((key, messenger))
+            return batch
+
+    def _work(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self._pending) > 0)
+                if len(self._pending) < self.batch_size:
+                    # Wait a bit more for the batch
+                    self._cond.wait(self.interval)
+            close_old_connections()
+            try:
+                self._process(self._take())
+            except Exception as err:
+                log.exception(f'Profile enrichment error; Error={err};')
+            finally:
+                close_old_connections()
+
+    def _process(self, batch: List[Tuple[Tuple[int, str], 'Messenger']]
+                 ) -> bool:
+        if not batch:
+            return False
+
+        profiles, failed, avatars = {}, [], []
+        try:
+            for key, messenger in batch:
+                try:
+                    user_info = messenger.api.get_user_info(key[1])
+                except Exception as err:
+                    log.warning(f'Profile fetch failed; Account={key[1]}; '
+                                f'Error={err};')
+                    failed.append(key)
+                    continue
+                # The ids of the stored accounts are strings
+                profiles[str(key[1])] = user_info
+                avatars.append((messenger, key[1], user_info))
+
+            if profiles:
+                self._save(profiles)
+            # The avatars are set over the written profiles
+            for messenger, account_id, user_info in avatars:
+                media_downloader.enqueue_avatar(messenger, account_id,
+                                                user_info)
+        finally:
+            with self._cond:
+                retry_at = (time.monotonic()
+                            + bot_api_settings.ENRICHMENT_RETRY_DELAY)
+                for key in failed:
+                    self._failed[key] = retry_at
+                for key, _ in batch:
+                    self._in_flight.discard(key)
+                # Forget old failures
+                now = time.monotonic()
+                self._failed = {key: till for key, till
+                                in self._failed.items() if till > now}
+        return True
+
+    @staticmethod
+    def _save(profiles: Dict[str, dict]) -> int:
+        """
+        Write the changed fields of the fetched profiles
+        :param profiles: account id -> `get_user_info` result
+        :return: number of the updated accounts
+        """
+        from .models import Account
+
+        groups = defaultdict(list)
+        stored = Account.objects.filter(id__in=profiles).values_list(
+            'id', 'username', 'info')
+        for account_id, username, info in stored:
+            user_info = profiles[account_id]
+            account = Account(id=account_id)
+            changed = []
+            if user_info.get('username') != username:
+                account.username = user_info.get('username')
+                changed.append('username')
+            new_info = dict(info or {}, **(user_info.get('info') or {}))
+            if new_info != info:
+                account.info = new_info
+                changed.append('info')
+            if changed:
+                groups[tuple(changed)].append(account)
+
+        for fields, group in groups.items():
+            Account.objects.bulk_update(group, fields)
+        return sum(len(group) for group in groups.values())
+
+
+profile_enricher = ProfileEnricher()
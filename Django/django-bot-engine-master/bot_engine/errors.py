@@ -11,7 +11,28 @@ class MessengerException(BotApiError):
     """
 
 
+class RetryAfter(MessengerException):
+    """
+    API rate limit exceeded
+    """
+    def __init__(self, *args, retry_after: float = None):
+        super().__init__(*args)
+        self.retry_after = retry_after
+
+
 class NotSubscribed(BotApiError):
     """
     Account not subscribed
     """
+
+
+class StateConflict(BotApiError):
+    """
+    Conversation state was changed by another worker after it was read
+    """
+
+
+class MediaError(BotApiError):
+    """
+    Media file can not be downloaded or stored
+    """
@@ -0,0 +1,69 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+from .menu_graph import menu_graph
+
+
+__all__ = ('KeyboardCache', 'keyboard_cache')
+
+
+class KeyboardCache:
+    """
+    Keyboards of the menus rendered once per connector into the wire format
+    of the messenger (`BaseMessenger.render_keyboard`).
+    The key includes the menu update time, the menu graph version and
+    the staff/admin visibility of the buttons, so the changed menus
+    are rendered again.
+    """
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+
+    @staticmethod
+    def visibility(user) -> Tuple[bool, bool]:
+        if user is None:
+            return False, False
+        return user.is_staff, user.is_superuser
+
+    def get(self, api: 'BaseMessenger', menu_id: Optional[int],
+            user=None) -> Any:
+        """
+        Rendered keyboard of the menu
+        :param api: messenger connector
+        :param menu_id: menu id
+        :param user: django user of the account, defines visible buttons
+        :return: keyboard object or None
+        """
+        graph = menu_graph.get()
+        menu = graph.menu(menu_id)
+        if menu is None:
+            return None
+
+        visibility = self.visibility(user)
+        key = (api.__class__.__name__, menu.id, menu.updated,
+               graph.version, visibility)
+        try:
+            with self._lock:
+                self._items.move_to_end(key)
+                return self._items[key]
+        except KeyError:
+            pass
+
+        is_staff, is_admin = visibility
+        buttons = [button for button in graph.keyboard_buttons(menu.id)
+                   if button.is_active
+                   and (is_staff or not button.for_staff)
+                   and (is_admin or not button.for_admin)]
+        keyboard = api.render_keyboard(buttons)
+
+        with self._lock:
+            self._items[key] = keyboard
+            if len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+        return keyboard
+
+
+keyboard_cache = KeyboardCache()
@@ -0,0 +1,140 @@
+import logging
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from ...dispatcher import DispatchMode, DispatchPool
+from ...errors import MessengerException
+from ...messengers import MessengerType
+from ...models import Messenger
+from ...settings import bot_api_settings
+
+
+log = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ('Receive the updates of Telegram messengers by long polling '
+            '(getUpdates) instead of the webhooks.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('messenger_ids', nargs='*', type=int,
+                            help='Messengers to poll, all Telegram '
+                                 'messengers by default.')
+        parser.add_argument('--mode', default=DispatchMode.THREAD,
+                            choices=(DispatchMode.THREAD, DispatchMode.PROCESS),
+                            help='Dispatch workers type.')
+        parser.add_argument('--workers', type=int,
+                            help='Number of the dispatch workers.')
+        parser.add_argument('--delete-webhook', action='store_true',
+                            help='Disable the webhooks before polling, '
+                                 'Telegram does not send updates both ways.')
+
+    def handle(self, *args, **options):
+        queryset = Messenger.objects.filter(
+            api_type=MessengerType.TELEGRAM.value)
+        if options['messenger_ids']:
+            queryset = queryset.filter(id__in=options['messenger_ids'])
+        messengers = list(queryset)
+        if not messengers:
+            raise CommandError('Telegram messengers not found.')
+
+        for messenger in messengers:
+            # The process workers resolve the messenger by the token hash,
+            # it is empty until the webhook is enabled
+            messenger.token_hash()
+            if options['delete_webhook']:
+                messenger.disable_webhook()
+
+        # The updates of one chat go to one worker in order
+        self.pool = DispatchPool(options['mode'], options['workers'])
+        self.stop = threading.Event()
+        threads = [threading.Thread(target=self.poll, args=(messenger, ),
+                                    name=f'bot-engine-poll-{messenger.id}',
+                                    daemon=True)
+                   for messenger in messengers]
+        for thread in threads:
+            thread.start()
+        self.stdout.write(f'Polling: {len(threads)};')
+
+        try:
+            while any(thread.is_alive() for thread in threads):
+                time.sleep(1)
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping...')
+        finally:
+            self.stop.set()
+            for thread in threads:
+                thread.join()
+            self.pool.shutdown()
+
+    def poll(self, messenger: Messenger):
+        api = messenger.api
+        offset = messenger.update_offset
+        while not self.stop.is_set():
+            try:
+                updates = api.get_updates(
+                    offset, timeout=bot_api_settings.POLLING_TIMEOUT)
+            except MessengerException as err:
+                log.warning(f'Polling error; Messenger={messenger!r}; '
+                            f'Error={err};')
+                self.stop.wait(5)
+                continue
+
+            next_offset = offset
+            batch = _Batch()
+            for update in updates:
+                try:
+                    message = api.parse_update(update)
+                except MessengerException:
+                    log.debug(f'Update is skipped; '
+                              f'Update={update.get("update_id")};')
+                else:
+                    if not self.submit(messenger, message, batch):
+                        break
+                next_offset = update['update_id'] + 1
+
+            # The offset is saved after the dispatch, the updates lost
+            # by a restart are received again
+            batch.wait()
+            if next_offset != offset:
+                offset = next_offset
+                close_old_connections()
+                Messenger.objects.filter(id=messenger.id).update(
+                    update_offset=offset)
+
+    def submit(self, messenger: Messenger, message, batch: '_Batch') -> bool:
+        # The full queues hold the polling
+        batch.add()
+        while not self.pool.submit(messenger, message, timeout=1,
+                                   done=batch.done):
+            if self.stop.is_set():
+                batch.done()
+                return False
+        return True
+
+
+class _Batch:
+    """
+    Counter of the submitted updates not dispatched yet
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._pending = 0
+
+    def add(self):
+        with self._cond:
+            self._pending += 1
+
+    def done(self):
+        with self._cond:
+            self._pending -= 1
+            if not self._pending:
+                self._cond.notify_all()
+
+    def wait(self):
+        with self._cond:
+            self._cond.wait_for(lambda: not self._pending)
@@ -0,0 +1,43 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ...models import MessageLog
+
+
+class Command(BaseCommand):
+    help = ('Delete the message log older than the given number of months, '
+            'month by month.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months', type=int, default=6,
+                            help='Number of the recent months to keep.')
+        parser.add_argument('--chunk-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        start = timezone.now().replace(day=1, hour=0, minute=0, second=0,
+                                       microsecond=0)
+        for _ in range(options['months'] - 1):
+            start = (start - timedelta(days=1)).replace(day=1)
+
+        total = 0
+        oldest = MessageLog.objects.order_by('created').first()
+        while oldest and oldest.created < start:
+            # Monthly ranges over the "created" index, in short transactions
+            month_start = oldest.created.replace(day=1, hour=0, minute=0,
+                                                 second=0, microsecond=0)
+            month_end = min((month_start + timedelta(days=32)).replace(day=1),
+                            start)
+            queryset = MessageLog.objects.filter(created__gte=month_start,
+                                                 created__lt=month_end)
+            while True:
+                ids = list(queryset.values_list('id', flat=True)
+                           [:options['chunk_size']])
+                if not ids:
+                    break
+                total += MessageLog.objects.filter(id__in=ids).delete()[0]
+            self.stdout.write(f'Pruned: {month_start:%Y-%m};')
+            oldest = MessageLog.objects.order_by('created').first()
+
+        self.stdout.write(f'Deleted: {total};')
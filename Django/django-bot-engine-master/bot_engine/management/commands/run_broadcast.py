@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...models import Broadcast
+
+
+class Command(BaseCommand):
+    help = 'Start or resume the broadcast.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('broadcast_id', type=int)
+
+    def handle(self, *args, **options):
+        try:
+            broadcast = (Broadcast.objects.select_related('messenger', 'menu', 'media')
+                         .get(id=options['broadcast_id']))
+        except Broadcast.DoesNotExist:
+            raise CommandError('Broadcast not found.')
+
+        if not broadcast.run():
+            raise CommandError('Broadcast is already running.')
+        broadcast.refresh_from_db()
+        self.stdout.write(f'Sent: {broadcast.sent}; '
+                          f'Failed: {broadcast.failed}; '
+                          f'Unsubscribed: {broadcast.unsubscribed};')
@@ -0,0 +1,408 @@
+import hashlib
+import logging
+import mimetypes
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+from django.contrib.sites.models import Site
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+
+from .errors import MediaError, MessengerException
+from .settings import bot_api_settings
+from .types import MessageType
+
+
+__all__ = ('MediaDownloader', 'MediaStore', 'media_downloader', 'media_store')
+
+log = logging.getLogger(__name__)
+
+
+def redact(error: Union[Exception, str], secret: Optional[str]) -> str:
+    """
+    Error text without the secret, the platform file urls hold the token
+    """
+    text = str(error)
+    return text.replace(secret, '***') if secret else text
+
+
+class MediaStore:
+    """
+    Content-addressed store of the media files.
+    The file is named by the SHA-256 of its content, so the same content
+    is stored once whatever the source. The downloads are streamed
+    to a temporary file in `MEDIA_CHUNK_SIZE` chunks and hashed on the way,
+    the whole file is never held in memory.
+    The platform file ids of the stored file are kept in `MediaUpload`,
+    the file is uploaded to the messenger once and then sent by the id.
+    """
+
+    def __init__(self, storage=None, max_size: int = 10000):
+        self._storage = storage
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        # (messenger id, media id) -> platform file id
+        self._file_ids = OrderedDict()
+
+    @property
+    def storage(self):
+        return self._storage or default_storage
+
+    @staticmethod
+    def file_name(sha256: str, extension: str = '') -> str:
+        return (f'{bot_api_settings.MEDIA_DIR}/{sha256[:2]}/'
+                f'{sha256}{extension}')
+
+    def save_chunks(self, chunks: Iterable[bytes], extension: str = '',
+                    content_type: str = '', source: str = '') -> 'MediaFile':
+        """
+        Store the content given by the chunks
+        :param chunks: content of the file
+        :param extension: file name extension, e.g. ".jpg"
+        :param content_type: MIME type of the content
+        :param source: url of the content
+        :return: MediaFile object, the existing one for the known content
+        :raise MediaError: the file is larger than `MEDIA_MAX_SIZE`
+        """
+        from .models import MediaFile
+
+        max_size = bot_api_settings.MEDIA_MAX_SIZE
+        digest = hashlib.sha256()
+        size = 0
+        with tempfile.TemporaryFile() as temp_file:
+            for chunk in chunks:
+                size += len(chunk)
+                if max_size and size > max_size:
+                    raise MediaError(f'Media file is too large; '
+                                     f'MaxSize={max_size};')
+                digest.update(chunk)
+                temp_file.write(chunk)
+
+            sha256 = digest.hexdigest()
+            media = MediaFile.objects.filter(sha256=sha256).first()
+            if media is not None:
+                return media
+
+            name = self.file_name(sha256, extension)
+            if not self.storage.exists(name):
+                temp_file.seek(0)
+                name = self.storage.save(name, File(temp_file))
+
+        media, _ = MediaFile.objects.get_or_create(
+            sha256=sha256, defaults={'path': name, 'size': size,
+                                     'content_type': content_type,
+                                     'source': source})
+        return media
+
+    def save_bytes(self, data: bytes, extension: str = '',
+                   content_type: str = '') -> 'MediaFile':
+        return self.save_chunks((data, ), extension, content_type)
+
+    def save_path(self, path: str) -> 'MediaFile':
+        """
+        Store the local file
+        """
+        chunk_size = bot_api_settings.MEDIA_CHUNK_SIZE
+        content_type = mimetypes.guess_type(path)[0] or ''
+        with open(path, 'rb') as file:
+            return self.save_chunks(iter(lambda: file.read(chunk_size), b''),
+                                    os.path.splitext(path)[1], content_type)
+
+    def download(self, url: str, proxy: str = None, source: str = None,
+                 secret: str = None) -> 'MediaFile':
+        """
+        Stream the file from the url to the store
+        :param url: file url
+        :param proxy: proxy uri of the messenger
+        :param source: stored source of the file, the url by default,
+            the platform file urls with the bot token are not stored
+        :param secret: text hidden in the error, e.g. the bot token
+        :return: MediaFile object
+        :raise MediaError: the download failed
+        """
+        # The connectors use the store
+        from .messengers.http import get_session, http_timeout
+
+        try:
+            with get_session(proxy).get(url, stream=True,
+                                        timeout=http_timeout()) as response:
+                response.raise_for_status()
+                content_type = (response.headers.get('Content-Type', '')
+                                .split(';')[0].strip())
+                extension = (os.path.splitext(urlsplit(url).path)[1]
+                             or mimetypes.guess_extension(content_type)
+                             or '')
+                return self.save_chunks(
+                    response.iter_content(bot_api_settings.MEDIA_CHUNK_SIZE),
+                    extension, content_type,
+                    url[:1024] if source is None else source)
+        except MediaError:
+            raise
+        except Exception as err:
+            raise MediaError(f'Media download failed; '
+                             f'Error={redact(err, secret)};') from err
+
+    def resolve(self, media: Union['MediaFile', bytes, str]) -> 'MediaFile':
+        """
+        Stored file of the media given by the local path, the url
+        or the content. The url is downloaded once.
+        """
+        from .models import MediaFile
+
+        if isinstance(media, MediaFile):
+            return media
+        if isinstance(media, (bytes, bytearray)):
+            return self.save_bytes(bytes(media))
+        if media.startswith(('http://', 'https://')):
+            stored = MediaFile.objects.filter(source=media[:1024]).first()
+            return stored or self.download(media)
+        return self.save_path(media)
+
+    @staticmethod
+    def media_type(media: 'MediaFile') -> MessageType:
+        if media.content_type.startswith('image/'):
+            return MessageType.PICTURE
+        if media.content_type.startswith('video/'):
+            return MessageType.VIDEO
+        return MessageType.FILE
+
+    def open(self, media: 'MediaFile') -> File:
+        return self.storage.open(media.path, 'rb')
+
+    def url(self, media: 'MediaFile') -> str:
+        """
+        Absolute url of the stored file
+        """
+        url = self.storage.url(media.path)
+        if url.startswith('/'):
+            url = f'https://{Site.objects.get_current().domain}{url}'
+        return url
+
+    @staticmethod
+    def find(file_unique_id: str) -> Optional['MediaFile']:
+        """
+        Stored file of the platform unique file id, Telegram keeps
+        the unique id of the file the same for all bots
+        """
+        from .models import MediaUpload
+
+        if not file_unique_id:
+            return None
+        upload = (MediaUpload.objects.select_related('media')
+                  .filter(file_unique_id=file_unique_id).first())
+        return upload.media if upload else None
+
+    def remember(self, messenger: 'Messenger', media: 'MediaFile',
+                 file_id: str, file_unique_id: str = '') -> 'MediaUpload':
+        """
+        Keep the platform file id of the stored file,
+        the file is sent by this id next time
+        """
+        from .models import MediaUpload
+
+        upload, _ = MediaUpload.objects.update_or_create(
+            messenger=messenger, media=media,
+            defaults={'file_id': file_id, 'file_unique_id': file_unique_id})
+        self._cache_file_id((messenger.id, media.id), file_id)
+        return upload
+
+    def file_id(self, messenger: 'Messenger', media: 'MediaFile'
+                ) -> Optional[str]:
+        """
+        Platform file id of the file uploaded to the messenger before
+        """
+        from .models import MediaUpload
+
+        key = (messenger.id, media.id)
+        with self._lock:
+            if key in self._file_ids:
+                self._file_ids.move_to_end(key)
+                return self._file_ids[key]
+
+        file_id = (MediaUpload.objects.filter(messenger=messenger, media=media)
+                   .values_list('file_id', flat=True).first())
+        self._cache_file_id(key, file_id)
+        return file_id
+
+    def forget(self, messenger: 'Messenger', media: 'MediaFile'):
+        """
+        Drop the platform file id rejected by the messenger
+        """
+        from .models import MediaUpload
+
+        MediaUpload.objects.filter(messenger=messenger, media=media).delete()
+        self._cache_file_id((messenger.id, media.id), None)
+
+    def _cache_file_id(self, key: Tuple[int, int], file_id: Optional[str]):
+        with self._lock:
+            self._file_ids[key] = file_id
+            self._file_ids.move_to_end(key)
+            while len(self._file_ids) > self.max_size:
+                self._file_ids.popitem(last=False)
+
+    def send(self, messenger: 'Messenger', receiver: str, media: 'MediaFile',
+             media_type: MessageType = None, caption: str = '',
+             **kwargs) -> str:
+        """
+        Send the stored file by the connector of the messenger.
+        The file uploaded before is sent by its platform file id,
+        the file id returned by the first upload is kept.
+        :param kwargs: `keyboard` and `priority` of the connector
+        :return: message id
+        """
+        api = messenger.api
+        media_type = media_type or self.media_type(media)
+        file_id = self.file_id(messenger, media)
+        if file_id:
+            try:
+                message_id, _, _ = api.send_media(
+                    receiver, media, media_type, file_id=file_id,
+                    caption=caption, **kwargs)
+                return message_id
+            except MessengerException as err:
+                # NotSubscribed and RetryAfter are not about the file
+                if type(err) is not MessengerException:
+                    raise
+                log.warning(f'File id is rejected, the file is uploaded; '
+                            f'Media={media.sha256}; Error={err};')
+                self.forget(messenger, media)
+
+        message_id, file_id, file_unique_id = api.send_media(
+            receiver, media, media_type, caption=caption, **kwargs)
+        if file_id:
+            self.remember(messenger, media, file_id, file_unique_id or '')
+        return message_id
+
+
+media_store = MediaStore()
+
+
+class MediaDownloader:
+    """
+    Background downloads of the platform files, e.g. the account avatars,
+    they are kept off the dispatch and the profile fetch.
+    The file of the same unique id is not downloaded again, the file
+    known to the store is not downloaded at all.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        # (messenger id, file unique id or file id, account id) -> job
+        self._pending: Dict[Tuple[int, str, Optional[str]], Tuple] = (
+            OrderedDict())
+        self._thread = None
+
+    def enqueue(self, messenger: 'Messenger', file_id: str,
+                file_unique_id: str = '', account_id: str = None) -> bool:
+        """
+        Queue the download of the platform file
+        :param messenger: Messenger object, its connector resolves the file
+        :param file_id: platform file id
+        :param file_unique_id: platform unique file id
+        :param account_id: the file is set as the avatar of the account
+        :return: False if the file is already queued
+        """
+        key = (messenger.id, file_unique_id or file_id, account_id)
+        with self._cond:
+            if key in self._pending:
+                return False
+            self._pending[key] = (messenger, file_id, file_unique_id,
+                                  account_id)
+            self._cond.notify()
+            self._start()
+        return True
+
+    def enqueue_avatar(self, messenger: 'Messenger', account_id: str,
+                       user_info: dict) -> bool:
+        """
+        Queue the avatar download of the profile fetched by
+        `get_user_info`, the call must follow the profile write
+        """
+        avatar_file = user_info.get('avatar_file')
+        if not avatar_file:
+            return False
+        return self.enqueue(messenger, avatar_file['file_id'],
+                            avatar_file.get('file_unique_id', ''),
+                            account_id)
+
+    def flush(self):
+        """
+        Download all queued files in the current thread.
+        """
+        while self._process(self._take()):
+            pass
+
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._work, name='bot-engine-media', daemon=True)
+            self._thread.start()
+
+    def _take(self) -> List[Tuple]:
+        with self._cond:
+            jobs = list(self._pending.values())
+            self._pending.clear()
+            return jobs
+
+    def _work(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self._pending) > 0)
+            close_old_connections()
+            try:
+                self._process(self._take())
+            except Exception as err:
+                log.exception(f'Media download error; Error={err};')
+            finally:
+                close_old_connections()
+
+    def _process(self, jobs: List[Tuple]) -> bool:
+        for messenger, file_id, file_unique_id, account_id in jobs:
+            started = time.monotonic()
+            try:
+                media = self.fetch(messenger, file_id, file_unique_id)
+            except Exception as err:
+                log.warning(f'Media download failed; File={file_id}; '
+                            f'Error={redact(err, messenger.token)};')
+                continue
+            log.debug(f'Media is fetched; File={file_id}; '
+                      f'Media={media.sha256}; '
+                      f'Time={time.monotonic() - started:.3f};')
+            if account_id is not None:
+                self._set_avatar(account_id, media_store.url(media))
+        return bool(jobs)
+
+    @staticmethod
+    def fetch(messenger: 'Messenger', file_id: str,
+              file_unique_id: str = '') -> 'MediaFile':
+        """
+        Stored file of the platform file, downloaded if it is not known
+        """
+        media = media_store.find(file_unique_id)
+        if media is None:
+            api = messenger.api
+            media = media_store.download(api.file_download_url(file_id),
+                                         api.proxy_url, source='',
+                                         secret=api.token)
+        media_store.remember(messenger, media, file_id, file_unique_id)
+        return media
+
+    @staticmethod
+    def _set_avatar(account_id: str, url: str):
+        from .models import Account
+
+        info = (Account.objects.filter(id=account_id)
+                .values_list('info', flat=True).first())
+        if info is None:
+            return
+        info = dict(info or {}, avatar=url)
+        Account.objects.filter(id=account_id).update(info=info)
+
+
+media_downloader = MediaDownloader()
@@ -0,0 +1,185 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from types import MappingProxyType
+from typing import Optional, Tuple
+
+from asgiref.sync import sync_to_async
+
+from .settings import bot_api_settings
+
+
+__all__ = ('MenuGraph', 'menu_graph')
+
+log = logging.getLogger(__name__)
+
+
+class MenuGraph:
+    """
+    Immutable in-memory snapshot of the Menu/Button tree.
+    Buttons are indexed by `command` and by `text` per menu and globally,
+    their `next_menu` is bound to the menu objects of the snapshot,
+    so button resolution, next menu lookup and keyboard rendering
+    do not touch the database.
+    """
+
+    def __init__(self, menus: list, buttons: list, links: list):
+        """
+        :param menus: all Menu objects
+        :param buttons: all Button objects
+        :param links: (menu id, button id) pairs of `Menu.buttons`
+        """
+        self.version = time.monotonic()
+        self._menus = MappingProxyType({menu.id: menu for menu in menus})
+        by_id = {button.id: button for button in buttons}
+        for button in buttons:
+            # Sets the related object cache of the foreign key
+            button.next_menu = self._menus.get(button.next_menu_id)
+
+        menu_buttons = defaultdict(list)
+        for menu_id, button_id in links:
+            menu_buttons[menu_id].append(by_id[button_id])
+        self._buttons = MappingProxyType({
+            menu_id: tuple(items) for menu_id, items in menu_buttons.items()})
+
+        self._keyboards = MappingProxyType({
+            (menu_id, is_inline): tuple(button for button in items
+                                        if button.is_inline == is_inline)
+            for menu_id, items in self._buttons.items()
+            for is_inline in (False, True)})
+
+        self._index = MappingProxyType({
+            menu_id: self._build_index(items)
+            for menu_id, items in self._buttons.items()})
+        self._global_index = self._build_index(buttons)
+
+    @classmethod
+    def build(cls) -> 'MenuGraph':
+        from .models import Button, Menu
+
+        return cls(list(Menu.objects.all()),
+                   list(Button.objects.all()),
+                   list(Menu.buttons.through.objects.order_by('id')
+                        .values_list('menu_id', 'button_id')))
+
+    @staticmethod
+    def _build_index(buttons) -> MappingProxyType:
+        index = defaultdict(list)
+        for button in buttons:
+            index[button.command].append(button)
+            if button.text != button.command:
+                index[button.text].append(button)
+        return MappingProxyType({key: tuple(items)
+                                 for key, items in index.items()})
+
+    def menu(self, menu_id: Optional[int]) -> Optional['Menu']:
+        return self._menus.get(menu_id)
+
+    def buttons(self, menu_id: Optional[int]) -> Tuple['Button', ...]:
+        """
+        Buttons of the menu
+        """
+        return self._buttons.get(menu_id, ())
+
+    def keyboard_buttons(self, menu_id: Optional[int],
+                         is_inline: bool = False) -> Tuple['Button', ...]:
+        """
+        Keyboard or inline buttons of the menu
+        """
+        return self._keyboards.get((menu_id, is_inline), ())
+
+    def find_buttons(self, text: str, menu_id: Optional[int] = None,
+                     global_fallback: bool = True) -> Tuple['Button', ...]:
+        """
+        Buttons with the command or the text, the buttons of the menu
+        are looked up first, then all buttons
+        """
+        if menu_id is not None:
+            buttons = self._index.get(menu_id, {}).get(text)
+            if buttons or not global_fallback:
+                return buttons or ()
+        return self._global_index.get(text, ())
+
+
+class MenuGraphHolder:
+    """
+    Keeps the current graph, the graph is rebuilt on the first access
+    after the invalidation and replaced at once.
+    Other processes are not notified, so the graph also expires after
+    ``MENU_GRAPH_TTL`` seconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._graph: Optional[MenuGraph] = None
+        self._expires = 0
+        self._generation = 0
+
+    def peek(self) -> Optional[MenuGraph]:
+        """
+        The current graph or None if it should be rebuilt.
+        """
+        graph = self._graph
+        if graph is not None and self._expires > time.monotonic():
+            return graph
+        return None
+
+    def get(self) -> MenuGraph:
+        graph = self.peek()
+        if graph is not None:
+            return graph
+
+        with self._lock:
+            graph = self.peek()
+            if graph is None:
+                generation = self._generation
+                graph = MenuGraph.build()
+                self._graph = graph
+                # Keep the graph expired if it was invalidated during the build
+                if generation == self._generation:
+                    self._expires = (time.monotonic()
+                                     + bot_api_settings.MENU_GRAPH_TTL)
+                log.debug(f'Menu graph is built; Version={graph.version};')
+        return graph
+
+    async def aget(self) -> MenuGraph:
+        graph = self.peek()
+        if graph is None:
+            graph = await sync_to_async(self.get)()
+        return graph
+
+    def get_menu(self, menu_id: int) -> Tuple[MenuGraph, Optional['Menu']]:
+        """
+        The graph and its menu, the graph is rebuilt once
+        if it is older than the menu.
+        :param menu_id: menu id
+        :return: graph and menu or None if the menu is deleted
+        """
+        graph = self.get()
+        menu = graph.menu(menu_id)
+        if menu is None:
+            self.invalidate()
+            graph = self.get()
+            menu = graph.menu(menu_id)
+            if menu is None:
+                log.warning(f'Menu is not found; Menu={menu_id};')
+        return graph, menu
+
+    async def aget_menu(self, menu_id: int
+                        ) -> Tuple[MenuGraph, Optional['Menu']]:
+        """
+        Async variant of `get_menu`
+        """
+        graph = self.peek()
+        menu = graph.menu(menu_id) if graph is not None else None
+        if menu is None:
+            graph, menu = await sync_to_async(self.get_menu)(menu_id)
+        return graph, menu
+
+    def invalidate(self):
+        self._generation += 1
+        self._expires = 0
+
+
+menu_graph = MenuGraphHolder()
@@ -0,0 +1,156 @@
+import atexit
+import logging
+import threading
+from collections import deque
+from typing import List, Optional
+
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .settings import bot_api_settings
+from .types import Message, MessageType
+
+
+__all__ = ('MessageLogWriter', 'message_log')
+
+log = logging.getLogger(__name__)
+
+
+class MessageLogWriter:
+    """
+    Write-behind buffer of the message log.
+    Incoming and outgoing messages are collected in memory and written
+    by the background worker with one `bulk_create` per batch, when
+    `MESSAGE_LOG_BATCH_SIZE` entries are gathered or every
+    `MESSAGE_LOG_INTERVAL` seconds.
+    The buffer is bounded by `MESSAGE_LOG_BUFFER` entries, if the database
+    falls behind the oldest entries are dropped, the webhooks never wait
+    for the log.
+    """
+
+    def __init__(self, batch_size: int = None, interval: float = None,
+                 max_size: int = None):
+        self._batch_size = batch_size
+        self._interval = interval
+        self._max_size = max_size
+        self._cond = threading.Condition()
+        self._buffer = deque()
+        self._thread = None
+        self._at_exit = False
+        self.dropped = 0
+
+    @property
+    def batch_size(self) -> int:
+        return self._batch_size or bot_api_settings.MESSAGE_LOG_BATCH_SIZE
+
+    @property
+    def interval(self) -> float:
+        return self._interval or bot_api_settings.MESSAGE_LOG_INTERVAL
+
+    @property
+    def max_size(self) -> int:
+        return self._max_size or bot_api_settings.MESSAGE_LOG_BUFFER
+
+    def log_incoming(self, messenger: 'Messenger', message: Message):
+        """
+        Log the message received from IM service
+        :param messenger: Messenger object
+        :param message: parsed message
+        """
+        self._put(messenger.id, message.user_id, 'in', message.type,
+                  message.id, message.text)
+
+    def log_outgoing(self, messenger: 'Messenger', account_id: str,
+                     text: Optional[str], message_id: str = None,
+                     message_type: MessageType = MessageType.TEXT):
+        """
+        Log the message sent to IM service
+        :param messenger: Messenger object
+        :param account_id: receiver id
+        :param text: message text
+        :param message_id: message id given by IM service
+        :param message_type: message type
+        """
+        self._put(messenger.id, account_id, 'out', message_type,
+                  message_id, text)
+
+    def flush(self):
+        """
+        Write all buffered entries in the current thread.
+        """
+        while self._write(self._take()):
+            pass
+
+    def _put(self, messenger_id: int, account_id: Optional[str],
+             direction: str, message_type: MessageType,
+             message_id: Optional[str], text: Optional[str]):
+        if not bot_api_settings.SAVE_MESSAGES:
+            return
+
+        entry = (messenger_id, account_id, direction, message_type.value,
+                 '' if message_id is None else str(message_id),
+                 text or '', timezone.now(),
+                 # The receipts update the status of the sent messages
+                 'sent' if direction == 'out' else '')
+        with self._cond:
+            if len(self._buffer) >= self.max_size:
+                self._buffer.popleft()
+                self.dropped += 1
+                if self.dropped % self.batch_size == 1:
+                    log.warning(f'Message log buffer is full; '
+                                f'Dropped={self.dropped};')
+            self._buffer.append(entry)
+            # The first entry starts the interval, the full batch ends it
+            if len(self._buffer) in (1, self.batch_size):
+                self._cond.notify()
+            self._start()
+
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._work, name='bot-engine-message-log', daemon=True)
+            self._thread.start()
+            # The thread is restarted in the forked process,
+            # the exit handler is inherited
+            if not self._at_exit:
+                atexit.register(self.flush)
+                self._at_exit = True
+
+    def _take(self) -> List[tuple]:
+        with self._cond:
+            size = min(len(self._buffer), self.batch_size)
+            return [self._buffer.popleft() for _ in range(size)]
+
+    def _work(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self._buffer) > 0)
+                if len(self._buffer) < self.batch_size:
+                    # Wait a bit more for the batch
+                    self._cond.wait(self.interval)
+            close_old_connections()
+            try:
+                self._write(self._take())
+            except Exception as err:
+                log.exception(f'Message log error; Error={err};')
+            finally:
+                close_old_connections()
+
+    def _write(self, batch: List[tuple]) -> bool:
+        if not batch:
+            return False
+
+        from .models import MessageLog
+
+        MessageLog.objects.bulk_create([
+            MessageLog(messenger_id=messenger_id, account_id=account_id,
+                       direction=direction, message_type=message_type,
+                       message_id=message_id, text=text, created=created,
+                       status=status)
+            for (messenger_id, account_id, direction, message_type,
+                 message_id, text, created, status) in batch
+        ])
+        return True
+
+
+message_log = MessageLogWriter()
@@ -1,20 +1,31 @@
 from typing import Any, Dict, List, Optional, Tuple
 
+from asgiref.sync import sync_to_async
 from rest_framework.request import Request
 
-from ..types import Message
+from ..settings import bot_api_settings
+from ..throttling import OutboundScheduler
+from ..types import Message, MessageType
 
 
 class BaseMessenger:
     """
     Base class for IM connector
     """
+    # Outgoing messages limits: {'bot': (rate, burst), 'chat': (rate, burst)}
+    rate_limits = {}
 
     def __init__(self, token: str, **kwargs):
         self.token = token
-        self.proxy_addr = self._proxy(kwargs.get('proxy'))
+        self.proxy_url = kwargs.get('proxy') or None
+        self.proxy_addr = self._proxy(self.proxy_url)
         self.name = kwargs.get('name')
         self.avatar_url = kwargs.get('avatar')
+        api_name = self.__class__.__name__.lower()
+        self.scheduler = OutboundScheduler.for_bot(
+            self.__class__, token,
+            bot_api_settings.RATE_LIMITS.get(api_name, self.rate_limits),
+            api_name)
 
     def enable_webhook(self, url: str, **kwargs):
         """
@@ -40,12 +51,26 @@ class BaseMessenger:
         """
         raise NotImplementedError('`get_user_info()` must be implemented.')
 
+    def verify_request(self, request: Request) -> bool:
+        """
+        Check that the webhook request is sent by IM service,
+        it is called before the body is parsed
+        """
+        return True
+
     def parse_message(self, request: Request) -> Message:
         """
         Parse incoming message
         """
         raise NotImplementedError('`_parse_message()` must be implemented.')
 
+    def file_download_url(self, file_id: str) -> str:
+        """
+        Download url of the platform file,
+        the media of the messages are referenced by the urls by default
+        """
+        return file_id
+
     def preprocess_message(self, message, account) -> tuple:
         """
         Preprocess message data
@@ -58,15 +83,70 @@ class BaseMessenger:
                      inline_button_list: list = None, **kwargs) -> str:
         """
         Send message method
+        Implementations pass the API call through `self.scheduler`,
+        `kwargs['priority']` is the `throttling.Priority` of the message
         """
         raise NotImplementedError('`send_message()` must be implemented.')
 
+    def send_media(self, receiver: str, media: 'MediaFile',
+                   media_type: MessageType, file_id: str = None,
+                   caption: str = '', button_list: list = None,
+                   **kwargs) -> Tuple[str, Optional[str], Optional[str]]:
+        """
+        Send the picture, video or file of the media store.
+        The platform file id of the previous upload is sent instead
+        of the file if given. `media_store.send` keeps the file ids.
+        :param receiver: account id
+        :param media: stored file
+        :param media_type: PICTURE, VIDEO or FILE
+        :param file_id: platform file id of the previous upload
+        :param caption: text of the message
+        :return: (message id, file id, file unique id), the file ids are
+            None if the platform does not return them
+        """
+        raise NotImplementedError('`send_media()` must be implemented.')
+
+    def render_keyboard(self, button_list: list) -> Any:
+        """
+        Render buttons into the keyboard in the wire format of IM service,
+        it can be passed to `send_message` as `keyboard` argument
+        """
+        raise NotImplementedError('`render_keyboard()` must be implemented.')
+
     def welcome_message(self, text: str) -> Dict[str, str]:
         """
         Return welcome message object method
         """
         raise NotImplementedError('`welcome_message()` must be implemented.')
 
+    ##########################################################
+    # Async variants, connectors override them with native  #
+    # implementations over the pooled async HTTP client      #
+    ##########################################################
+
+    async def aenable_webhook(self, url: str, **kwargs):
+        return await sync_to_async(self.enable_webhook,
+                                   thread_sensitive=False)(url, **kwargs)
+
+    async def adisable_webhook(self):
+        return await sync_to_async(self.disable_webhook,
+                                   thread_sensitive=False)()
+
+    async def aget_account_info(self) -> Dict[str, Any]:
+        return await sync_to_async(self.get_account_info,
+                                   thread_sensitive=False)()
+
+    async def aget_user_info(self, user_id: str, **kwargs) -> Dict[str, Any]:
+        return await sync_to_async(self.get_user_info,
+                                   thread_sensitive=False)(user_id, **kwargs)
+
+    async def asend_message(self, receiver: str, message: Message,
+                            button_list: list = None,
+                            inline_button_list: list = None, **kwargs) -> str:
+        return await sync_to_async(self.send_message, thread_sensitive=False)(
+            receiver, message, button_list=button_list,
+            inline_button_list=inline_button_list, **kwargs)
+
     @staticmethod
     def _proxy(proxy_url: Optional[str]) -> Optional[Dict[str, str]]:
         if proxy_url:
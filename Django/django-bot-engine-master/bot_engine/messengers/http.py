@@ -0,0 +1,99 @@
+import asyncio
+import threading
+import weakref
+from importlib.util import find_spec
+from typing import Dict, Optional, Tuple
+
+import requests
+from django.core.exceptions import ImproperlyConfigured
+from requests.adapters import HTTPAdapter
+
+from ..settings import bot_api_settings
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+__all__ = ('get_session', 'get_async_client', 'http_timeout')
+
+_lock = threading.Lock()
+_sessions: Dict[Optional[str], requests.Session] = {}
+# Event loop -> {proxy: client}, the clients of the closed loops
+# are dropped, e.g. the loops of `async_to_sync` under WSGI
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def http_timeout() -> Tuple[float, float]:
+    """
+    (connect, read) timeouts of the requests to the messenger APIs
+    """
+    return (bot_api_settings.HTTP_CONNECT_TIMEOUT,
+            bot_api_settings.HTTP_TIMEOUT)
+
+
+def get_session(proxy: Optional[str] = None) -> requests.Session:
+    """
+    Pooled sync HTTP session of the proxy.
+    The session is shared by all connectors and threads with the same proxy,
+    the connections are kept alive in the per-host pools, so the TLS
+    handshake with the platform API is not repeated for every call.
+    The proxy is set on the session, not globally, so the connectors
+    with different proxies do not affect each other.
+    :param proxy: proxy uri
+    :return: requests.Session object
+    """
+    proxy = proxy or None
+    session = _sessions.get(proxy)
+    if session is None:
+        with _lock:
+            session = _sessions.get(proxy)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=bot_api_settings.HTTP_POOL_HOSTS,
+                    pool_maxsize=bot_api_settings.HTTP_POOL_SIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                if proxy:
+                    session.proxies = {'https': proxy, 'http': proxy}
+                _sessions[proxy] = session
+    return session
+
+
+def get_async_client(proxy: Optional[str] = None) -> 'httpx.AsyncClient':
+    """
+    Pooled async HTTP client of the running event loop.
+    The client is shared by all connectors with the same proxy,
+    so the connections to the platform APIs are kept alive between calls.
+    The client is bound to the loop, it is dropped with the loop.
+    :param proxy: proxy uri
+    :return: httpx.AsyncClient object
+    """
+    if httpx is None:
+        raise ImproperlyConfigured('The async dispatch requires httpx, '
+                                   'install "django-bot-engine[async]".')
+
+    loop = asyncio.get_running_loop()
+    proxy = proxy or None
+    client = _async_clients.get(loop, {}).get(proxy)
+    if client is None or client.is_closed:
+        with _lock:
+            # The closed loops may be still referenced by their clients
+            for closed in [item for item in list(_async_clients.keys())
+                           if item.is_closed()]:
+                del _async_clients[closed]
+            connect, read = http_timeout()
+            client = httpx.AsyncClient(
+                proxy=proxy,
+                # HTTP/2 multiplexes the calls over one connection per host
+                http2=bot_api_settings.HTTP2 and find_spec('h2') is not None,
+                timeout=httpx.Timeout(read, connect=connect),
+                limits=httpx.Limits(
+                    max_connections=bot_api_settings.HTTP_POOL_SIZE,
+                    max_keepalive_connections=bot_api_settings.HTTP_POOL_SIZE,
+                    keepalive_expiry=bot_api_settings.HTTP_KEEPALIVE,
+                ))
+            _async_clients.setdefault(loop, {})[proxy] = client
+    return client
@@ -1,35 +1,78 @@
-import json
+import hashlib
+import hmac
 import logging
-from typing import Any, Dict, List, Tuple
+import re
+from typing import Any, Dict, List, Optional, Tuple
 
-from django.conf import settings
-from django.contrib.sites.models import Site
 from rest_framework.request import Request
 # TODO: Independently implement or find a project with a more permissive license
 from telebot import TeleBot, apihelper, types
 
 from .base_messenger import BaseMessenger
-from ..errors import MessengerException
+from .http import get_async_client, get_session, http_timeout
+from ..decoding import LazyJson, decode_body, get_decoder
+from ..errors import MessengerException, NotSubscribed, RetryAfter
+from ..media import media_store
+from ..menu_graph import menu_graph
+from ..settings import bot_api_settings
 from ..types import MessageType, Message
 
 
 log = logging.getLogger(__name__)
 
+# Bot token -> proxy uri of the connector
+_proxies: Dict[str, Optional[str]] = {}
+_token_re = re.compile(r'/bot([^/]+)/')
+
+
+def _send_request(method: str, url: str, params: dict = None,
+                  files: dict = None, timeout: tuple = None, **kwargs):
+    """
+    Request sender of pyTelegramBotAPI, it replaces the global proxy
+    and the per-thread sessions of the library with the pooled session
+    of the bot proxy.
+    """
+    match = _token_re.search(url)
+    proxy = _proxies.get(match.group(1)) if match else None
+    connect, read = http_timeout()
+    if timeout:
+        # The read timeout of getUpdates includes the long polling time
+        read = max(read, timeout[1])
+    return get_session(proxy).request(method, url, params=params,
+                                      files=files, timeout=(connect, read))
+
 
 class Telegram(BaseMessenger):
     """
     IM connector for Telegram Bot API
     """
+    api_url = 'https://api.telegram.org/bot{token}/{method}'
+    file_url = 'https://api.telegram.org/file/bot{token}/{path}'
+    # https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this
+    rate_limits = {'bot': (30, 30), 'chat': (1, 3)}
 
     def __init__(self, token: str, **kwargs):
         super().__init__(token, **kwargs)
 
+        # Local Bot API server or the fake one of the tests
+        if bot_api_settings.TELEGRAM_API_URL:
+            self.api_url = bot_api_settings.TELEGRAM_API_URL
+            apihelper.API_URL = self.api_url.format(token='{0}',
+                                                    method='{1}')
+        if bot_api_settings.TELEGRAM_FILE_URL:
+            self.file_url = bot_api_settings.TELEGRAM_FILE_URL
+
         self.bot = TeleBot(token=token)
-        if self.proxy_addr:
-            apihelper.proxy = self.proxy_addr
+        _proxies[token] = self.proxy_url
+        apihelper.CUSTOM_REQUEST_SENDER = _send_request
+        # Secret token of the webhook, Telegram sends it in the header
+        # once the webhook is registered with it
+        self.require_secret = bool(kwargs.get('require_secret'))
+        self.secret_token = hmac.new(token.encode(), b'webhook',
+                                     hashlib.sha256).hexdigest()
 
     def enable_webhook(self, url: str, **kwargs):
-        return self.bot.set_webhook(url=url)
+        return self.bot.set_webhook(url=url, secret_token=self.secret_token)
 
     def disable_webhook(self):
         return self.bot.remove_webhook()
@@ -51,14 +94,17 @@ class Telegram(BaseMessenger):
 
     def get_user_info(self, user_id: str, **kwargs) -> Dict[str, Any]:
         photo_url = None
-        data = self.bot.get_chat_member(kwargs.get('chat_id'), user_id)
+        # The private chat id is the user id
+        data = self.bot.get_chat_member(kwargs.get('chat_id', user_id),
+                                        user_id).user
         # {
         #     'id': 0123,
         #     'first_name': 'name',
         #     'last_name': 'name',
         #     'username': 'name'
         # }
-        photos = self.bot.get_user_profile_photos(user_id)
+        avatar_file = None
+        photos = self.bot.get_user_profile_photos(user_id, limit=1)
         # {
         #     'total_count': 123,
         #     'photos': [{
@@ -68,62 +114,214 @@ class Telegram(BaseMessenger):
         #         'file_size': 123,
         #     }]
         # }
-        if photos.get('total_count') > 0:
-            photo_url = self.save_file(photos.get('photos')[0].get('id'))
+        if photos.total_count > 0:
+            # The sizes of the photo are sorted, take the biggest one
+            photo = photos.photos[0][-1]
+            file_unique_id = getattr(photo, 'file_unique_id', '') or ''
+            media = media_store.find(file_unique_id)
+            if media is not None:
+                photo_url = media_store.url(media)
+            else:
+                # The avatar is downloaded by `media_downloader`
+                avatar_file = {'file_id': photo.file_id,
+                               'file_unique_id': file_unique_id}
 
         user_info = {
-            'id': data.get('id'),
-            'username': data.get('username'),
+            'id': data.id,
+            'username': data.username,
             'info': {
                 'avatar': photo_url,
-                'first_name': data.get('first_name'),
-                'last_name': data.get('last_name'),
+                'first_name': data.first_name,
+                'last_name': data.last_name,
             }
         }
+        if avatar_file:
+            user_info['avatar_file'] = avatar_file
         return user_info
 
+    def verify_request(self, request: Request) -> bool:
+        secret = request.META.get('HTTP_X_TELEGRAM_BOT_API_SECRET_TOKEN')
+        if (secret is None and not self.require_secret
+                and not bot_api_settings.TELEGRAM_REQUIRE_SECRET):
+            # The webhooks set before the secret token do not send it
+            if not getattr(self, '_secret_warned', False):
+                self._secret_warned = True
+                log.warning(f'Webhook without secret token, enable '
+                            f'the webhook again; Bot={self.name};')
+            return True
+        return hmac.compare_digest((secret or '').encode(),
+                                   self.secret_token.encode())
+
     def parse_message(self, request: Request) -> Message:
-        log.debug('Data={};'.format(request.body.decode('utf-8')))
         try:
-            json_string = request.body.decode('utf-8')
-            update = json.loads(json_string)
-            message = Message(
-                message_type=MessageType.TEXT,
-                message_id=update.get('message', {}).get('message_id', ''),
-                user_id=update.get('message', {}).get('from', {}).get('id', ''),
-                text=update.get('message').get('text', ''),
-                timestamp=update.get('message').get('date', ''), )
-            return message
+            update = decode_body(request)
+        except ValueError as err:
+            raise MessengerException(err)
+        return self.parse_update(update)
+
+    def parse_update(self, update: dict) -> Message:
+        """
+        Message from the decoded update of Telegram Bot API,
+        it is received by the webhook or by `get_updates`
+        """
+        log.debug('Data=%s;', LazyJson(update))
+        try:
+            data = update['message']
+            return Message(MessageType.TEXT,
+                           data.get('message_id', ''),
+                           data.get('from', {}).get('id', ''),
+                           data.get('date', ''),
+                           data.get('text', ''))
+        except Exception as err:
+            raise MessengerException(err)
+
+    def get_updates(self, offset: int = None, timeout: int = 30,
+                    limit: int = 100) -> List[dict]:
+        """
+        Long polling of the updates, the webhook must be disabled
+        :param offset: id of the first update to return
+        :param timeout: seconds to wait for the updates
+        :param limit: max number of the updates
+        :return: decoded updates
+        """
+        params = {'timeout': timeout, 'limit': limit}
+        if offset:
+            params['offset'] = offset
+
+        connect, read = http_timeout()
+        try:
+            response = get_session(self.proxy_url).get(
+                self.api_url.format(token=self.token, method='getUpdates'),
+                params=params, timeout=(connect, read + timeout))
+            data = get_decoder()(response.content)
         except Exception as err:
             raise MessengerException(err)
 
+        if not data.get('ok'):
+            self._raise_error(data)
+        return data.get('result')
+
     def preprocess_message(self, message: Message, account) -> tuple:
         """
         Preprocess message data
         Need for Telegram API for check - message is button?
         """
-        if message.type == MessageType.TEXT:
-            for button in account.menu.buttons.all():
-                if message.text == button.text:
-                    message.type = MessageType.BUTTON
+        if message.type == MessageType.TEXT and account.menu_id:
+            if menu_graph.get().find_buttons(message.text, account.menu_id,
+                                             global_fallback=False):
+                message = message.replace(message_type=MessageType.BUTTON)
         return message, account
 
     def send_message(self, receiver: str, message: Message,
                      button_list: list = None, **kwargs) -> str:
+        kb = kwargs.get('keyboard') or self.render_keyboard(button_list)
+        return self.scheduler.call(
+            receiver,
+            lambda: self._request(self.bot.send_message, chat_id=receiver,
+                                  text=message, reply_markup=kb).message_id,
+            kwargs.get('priority'))
+
+    def send_media(self, receiver: str, media: 'MediaFile',
+                   media_type: MessageType, file_id: str = None,
+                   caption: str = '', button_list: list = None,
+                   **kwargs) -> Tuple[str, Optional[str], Optional[str]]:
+        kb = kwargs.get('keyboard') or self.render_keyboard(button_list)
+        send = {
+            MessageType.PICTURE: self.bot.send_photo,
+            MessageType.VIDEO: self.bot.send_video,
+        }.get(media_type, self.bot.send_document)
+
+        def call():
+            if file_id:
+                return self._request(send, receiver, file_id,
+                                     caption=caption or None, reply_markup=kb)
+            # The file is opened again by the retries
+            with media_store.open(media) as file:
+                return self._request(send, receiver, file,
+                                     caption=caption or None, reply_markup=kb)
+
+        result = self.scheduler.call(receiver, call, kwargs.get('priority'))
+        # The sizes of the photo are sorted, the biggest one is the original
+        sent = (result.photo[-1] if result.photo
+                else result.video or result.document)
+        if sent is None:
+            return result.message_id, None, None
+        return (result.message_id, sent.file_id,
+                getattr(sent, 'file_unique_id', None))
+
+    async def asend_message(self, receiver: str, message: Message,
+                            button_list: list = None, **kwargs) -> str:
+        kb = kwargs.get('keyboard') or self.render_keyboard(button_list)
+        payload = {'chat_id': receiver, 'text': message}
+        if kb:
+            payload['reply_markup'] = kb
+
+        result = await self.scheduler.acall(
+            receiver, lambda: self._arequest('sendMessage', payload),
+            kwargs.get('priority'))
+        return result.get('message_id')
+
+    @staticmethod
+    def _request(method, *args, **kwargs) -> Any:
+        try:
+            return method(*args, **kwargs)
+        except apihelper.ApiTelegramException as err:
+            Telegram._raise_error(err.result_json)
+
+    async def _arequest(self, method: str, payload: dict) -> Any:
+        url = self.api_url.format(token=self.token, method=method)
+        try:
+            # Form encoding, the reply markup is already JSON string
+            response = await get_async_client(self.proxy_url).post(
+                url, data=payload)
+            data = response.json()
+        except Exception as err:
+            raise MessengerException(err)
+
+        if not data.get('ok'):
+            self._raise_error(data)
+        return data.get('result')
+
+    @staticmethod
+    def _raise_error(data: dict):
+        error = (f'Error code: {data.get("error_code")}. '
+                 f'Description: {data.get("description")}')
+        # The bot was blocked by the user or the user is deactivated
+        if data.get('error_code') == 403:
+            raise NotSubscribed(error)
+        elif data.get('error_code') == 429:
+            raise RetryAfter(error, retry_after=(
+                data.get('parameters') or {}).get('retry_after'))
+        raise MessengerException(error)
+
+    def render_keyboard(self, button_list: list) -> Optional[str]:
+        kb = self._get_keyboard(button_list)
+        return kb.to_json() if kb else None
+
+    @staticmethod
+    def _get_keyboard(buttons: list):
+        if not buttons:
+            return None
+
         kb = types.ReplyKeyboardMarkup(row_width=3)
-        for btn in button_list:
+        for btn in buttons:
             kb.add(types.KeyboardButton(btn.text))
-        return self.bot.send_message(chat_id=receiver, text=message,
-                                     reply_markup=kb)
+        return kb
+
+    def file_download_url(self, file_id: str) -> str:
+        file_info = self.bot.get_file(file_id)
+        return self.file_url.format(token=self.token,
+                                    path=file_info.file_path)
 
     def save_file(self, file_id: str) -> str:
-        file_name = f'{file_id}.png'
-        domain = Site.objects.get_current().domain
-        file_url = f'https://{domain}{settings.MEDIA_URL}tg/{file_name}'
-        file = self.bot.get_file(file_id)
-        with open(f'{settings.MEDIA_ROOT}tg/{file_name}', 'wb') as fd:
-            fd.write(file)
-        return file_url
+        """
+        Download the file to the media store
+        :return: url of the stored file
+        """
+        media = media_store.download(self.file_download_url(file_id),
+                                     self.proxy_url, source='',
+                                     secret=self.token)
+        return media_store.url(media)
 
     # getMe
     # sendMessage
@@ -1,5 +1,8 @@
+import hashlib
+import hmac
 import logging
-from typing import Any, Dict, List
+import os
+from typing import Any, Dict, List, Optional, Tuple
 
 from django.utils import timezone
 from rest_framework.request import Request
@@ -8,16 +11,12 @@ from viberbot.api.bot_configuration import BotConfiguration
 from viberbot.api.messages import (
     FileMessage, KeyboardMessage, PictureMessage, TextMessage, VideoMessage
 )
-from viberbot.api.viber_requests.viber_request import ViberRequest
-from viberbot.api.viber_requests import (
-    ViberMessageRequest, ViberConversationStartedRequest,
-    ViberSubscribedRequest, ViberUnsubscribedRequest,
-    ViberDeliveredRequest, ViberSeenRequest, ViberFailedRequest,
-    create_request
-)
 
 from .base_messenger import BaseMessenger
-from ..errors import MessengerException, NotSubscribed
+from .http import get_async_client, get_session, http_timeout
+from ..decoding import LazyJson, decode_body
+from ..errors import MessengerException, NotSubscribed, RetryAfter
+from ..media import media_store
 from ..types import Message, MessageType
 
 
@@ -28,6 +27,9 @@ class Viber(BaseMessenger):
     """
     IM connector for Viber REST API
     """
+    api_url = 'https://chatapi.viber.com/pa'
+    # Viber does not publish the bot limits, these are conservative
+    rate_limits = {'bot': (20, 40), 'chat': (2, 5)}
 
     def __init__(self, token: str, **kwargs):
         super().__init__(token, **kwargs)
@@ -37,6 +39,9 @@ class Viber(BaseMessenger):
             name=kwargs.get('name'),
             avatar=kwargs.get('avatar'),
         ))
+        self._token_key = token.encode()
+        # viberbot posts every call with a new connection
+        self.bot._request_sender.post_request = self._post_request
 
     def enable_webhook(self, url: str, **kwargs):
         return self.bot.set_webhook(url=url)
@@ -102,7 +107,15 @@ class Viber(BaseMessenger):
         #       "device_type":"iPhone9,4"
         #    }
         # }
-        data = self.bot.get_user_details(user_id).get('user')
+        data = self.bot.get_user_details(user_id)
+        return self._user_info(data)
+
+    async def aget_user_info(self, user_id: str, **kwargs) -> Dict[str, Any]:
+        result = await self._arequest('get_user_details', {'id': user_id})
+        return self._user_info(result.get('user'))
+
+    @staticmethod
+    def _user_info(data: dict) -> Dict[str, Any]:
         user_info = {
             'id': data.get('id'),
             'username': data.get('name'),
@@ -118,130 +131,163 @@ class Viber(BaseMessenger):
         }
         return user_info
 
-    def parse_message(self, request: Request) -> Message:
-        # NOTE: There is no way to get the body
-        #       after processing the request in DRF.
-        # # Verify signature
-        # sign = request.META.get('HTTP_X_VIBER_CONTENT_SIGNATURE')
-        # if not self.bot.verify_signature(request.body, sign):
-        #     raise IMApiException(f'Viber message not verified; '
-        #                          f'Data={request.data}; Sign={sign};')
-
-        # Parse message data in to viber types
-        vb_request = create_request(request.data)
+    def verify_request(self, request: Request) -> bool:
+        sign = request.META.get('HTTP_X_VIBER_CONTENT_SIGNATURE', '')
+        expected = hmac.new(self._token_key, request.body,
+                            hashlib.sha256).hexdigest()
+        return hmac.compare_digest(sign.encode(), expected.encode())
 
+    def parse_message(self, request: Request) -> Message:
+        data = None
         try:
-            return self._get_message(vb_request)
+            data = decode_body(request)
+            log.debug('Data=%s;', LazyJson(data))
+            return self._get_message(data)
         except Exception as err:
             # TODO: remove this after development
-            log.exception(f'Parse message error; Message={vb_request}; '
+            log.exception(f'Parse message error; Message={data}; '
                           f'Error={err};')
             return Message(MessageType.UNDEFINED)
 
-    @staticmethod
-    def _get_message(vb_request: ViberRequest) -> Message:
-        if isinstance(vb_request, ViberMessageRequest):
-            if isinstance(vb_request.message, TextMessage):
-                return Message(
-                    message_type=MessageType.TEXT,
-                    message_id=vb_request.message_token,
-                    user_id=vb_request.sender.id,
-                    text=vb_request.message.text,
-                    timestamp=vb_request.timestamp)
-            elif isinstance(vb_request.message, PictureMessage):
-                return Message(
-                    message_type=MessageType.PICTURE,
-                    message_id=vb_request.message_token,
-                    user_id=vb_request.sender.id,
-                    image_url=vb_request.message.media,
-                    timestamp=vb_request.timestamp)
-            elif isinstance(vb_request.message, VideoMessage):
-                return Message(
-                    message_type=MessageType.PICTURE,
-                    message_id=vb_request.message_token,
-                    user_id=vb_request.sender.id,
-                    video_url=vb_request.message.media,
-                    size=vb_request.message.size,
-                    timestamp=vb_request.timestamp)
-            else:
-                return Message(
-                    message_type=MessageType.TEXT,
-                    message_id=vb_request.message_token,
-                    user_id=vb_request.sender.id,
-                    text=vb_request.message,
-                    timestamp=vb_request.timestamp)
-        elif isinstance(vb_request, ViberConversationStartedRequest):
-            return Message(
-                message_type=MessageType.START,
-                message_id=vb_request.message_token,
-                user_id=vb_request.user.id,
-                user_name=vb_request.user.name,
-                timestamp=vb_request.timestamp,
-                context=vb_request.context)
-        elif isinstance(vb_request, ViberSubscribedRequest):
-            return Message(
-                message_type=MessageType.SUBSCRIBED,
-                user_id=vb_request.user.id,
-                user_name=vb_request.user.name,
-                timestamp=vb_request.timestamp)
-        elif isinstance(vb_request, ViberUnsubscribedRequest):
-            return Message(
-                message_type=MessageType.UNSUBSCRIBED,
-                user_id=vb_request.user_id,
-                timestamp=vb_request.timestamp)
-        elif isinstance(vb_request, ViberDeliveredRequest):
-            return Message(
-                message_type=MessageType.DELIVERED,
-                message_id=vb_request.meesage_token,
-                user_id=vb_request.user_id,
-                timestamp=vb_request.timestamp)
-        elif isinstance(vb_request, ViberSeenRequest):
-            return Message(
-                message_type=MessageType.SEEN,
-                message_id=vb_request.meesage_token,
-                user_id=vb_request.user_id,
-                timestamp=vb_request.timestamp)
-        elif isinstance(vb_request, ViberFailedRequest):
-            log.warning(f'Client failed receiving message; Error={vb_request}')
-            return Message(
-                message_type=MessageType.FAILED,
-                message_id=vb_request.meesage_token,
-                user_id=vb_request.user_id,
-                error=vb_request.desc)
-        elif vb_request.event_type == 'webhook':
-            return Message(
-                message_type=MessageType.WEBHOOK,
-                timestamp=vb_request.timestamp)
+    # Viber message type -> (message type, field of the media url)
+    message_types = {
+        'text': (MessageType.TEXT, None),
+        'picture': (MessageType.PICTURE, 'image_url'),
+        'video': (MessageType.VIDEO, 'video_url'),
+        'file': (MessageType.FILE, 'file_url'),
+        'sticker': (MessageType.STICKER, None),
+        'contact': (MessageType.CONTACT, None),
+        'url': (MessageType.URL, None),
+        'location': (MessageType.LOCATION, None),
+        'rich_media': (MessageType.RICHMEDIA, None),
+    }
+
+    @classmethod
+    def _get_message(cls, data: dict) -> Message:
+        """
+        Message from the decoded callback data of Viber REST API
+        https://developers.viber.com/docs/api/rest-bot-api/#callbacks
+        """
+        event = data.get('event')
+        if event == 'message':
+            vb_message = data['message']
+            message_type, media_field = cls.message_types.get(
+                vb_message.get('type'), (MessageType.TEXT, None))
+            extra = {}
+            if media_field:
+                extra[media_field] = vb_message.get('media')
+                if 'size' in vb_message:
+                    extra['size'] = vb_message['size']
+            return Message(message_type,
+                           data.get('message_token'),
+                           data['sender']['id'],
+                           data.get('timestamp'),
+                           vb_message.get('text'),
+                           user_name=data['sender'].get('name'),
+                           **extra)
+        elif event == 'conversation_started':
+            return Message(MessageType.START,
+                           data.get('message_token'),
+                           data['user']['id'],
+                           data.get('timestamp'),
+                           user_name=data['user'].get('name'),
+                           context=data.get('context'))
+        elif event == 'subscribed':
+            return Message(MessageType.SUBSCRIBED,
+                           user_id=data['user']['id'],
+                           timestamp=data.get('timestamp'),
+                           user_name=data['user'].get('name'))
+        elif event == 'unsubscribed':
+            return Message(MessageType.UNSUBSCRIBED,
+                           user_id=data.get('user_id'),
+                           timestamp=data.get('timestamp'))
+        elif event == 'delivered':
+            return Message(MessageType.DELIVERED,
+                           data.get('message_token'),
+                           data.get('user_id'),
+                           data.get('timestamp'))
+        elif event == 'seen':
+            return Message(MessageType.SEEN,
+                           data.get('message_token'),
+                           data.get('user_id'),
+                           data.get('timestamp'))
+        elif event == 'failed':
+            log.warning(f'Client failed receiving message; Error={data}')
+            return Message(MessageType.FAILED,
+                           data.get('message_token'),
+                           data.get('user_id'),
+                           data.get('timestamp'),
+                           error=data.get('desc'))
+        elif event == 'webhook':
+            return Message(MessageType.WEBHOOK,
+                           timestamp=data.get('timestamp'))
         else:
-            log.warning(f'VRequest Type={type(vb_request)}; '
-                        f'Object={vb_request};')
-            return Message(
-                message_type=MessageType.UNDEFINED,
-                timestamp=vb_request.timestamp,
-                event_type=vb_request.event_type)
-            # raise IMApiException('Failed parse message; '
-            #                      'Request object={}'.format(viber_request))
+            log.warning(f'VRequest Type={event}; Object={data};')
+            return Message(MessageType.UNDEFINED,
+                           timestamp=data.get('timestamp'),
+                           event_type=event)
 
     def send_message(self, receiver: str, message: str,
                      button_list: list = None, **kwargs) -> str:
-        kb = self._get_keyboard(button_list) if button_list else None
+        kb = kwargs.get('keyboard') or self._get_keyboard(button_list)
+
+        if message:
+            vb_message = TextMessage(text=message, keyboard=kb)
+        else:
+            vb_message = KeyboardMessage(keyboard=kb)
+
+        return self.scheduler.call(
+            receiver, lambda: self._send_messages(receiver, [vb_message]),
+            kwargs.get('priority'))
+
+    async def asend_message(self, receiver: str, message: str,
+                            button_list: list = None, **kwargs) -> str:
+        kb = kwargs.get('keyboard') or self._get_keyboard(button_list)
 
         if message:
             vb_message = TextMessage(text=message, keyboard=kb)
         else:
             vb_message = KeyboardMessage(keyboard=kb)
 
+        payload = vb_message.to_dict()
+        payload.update(receiver=receiver,
+                       sender={'name': self.name, 'avatar': self.avatar_url})
+        result = await self.scheduler.acall(
+            receiver, lambda: self._arequest('send_message', payload),
+            kwargs.get('priority'))
+        return result.get('message_token')
+
+    def _post_request(self, endpoint: str, payload: str) -> dict:
+        headers = {'User-Agent': self.bot._request_sender._user_agent}
+        response = get_session(self.proxy_url).post(
+            f'{self.api_url}/{endpoint}', data=payload, headers=headers,
+            timeout=http_timeout())
+        response.raise_for_status()
+        return response.json()
+
+    async def _arequest(self, endpoint: str, payload: dict) -> dict:
+        payload['auth_token'] = self.token
         try:
-            return self.bot.send_messages(receiver, [vb_message])[0]
+            response = await get_async_client(self.proxy_url).post(
+                f'{self.api_url}/{endpoint}', json=payload)
+            data = response.json()
         except Exception as err:
-            if str(err) == 'failed with status: 6, message: notSubscribed':
-                raise NotSubscribed(err)
             raise MessengerException(err)
 
+        if data.get('status') == 6:
+            raise NotSubscribed(data.get('status_message'))
+        elif data.get('status') == 12:
+            raise RetryAfter(data.get('status_message'))
+        elif data.get('status') != 0:
+            raise MessengerException(f'failed with status: '
+                                     f'{data.get("status")}, message: '
+                                     f'{data.get("status_message")}')
+        return data
+
     def send_file(self, receiver: str, file_url: str,
                   file_size: int, file_name: str, file_type: str = None,
                   button_list: list = None, **kwargs) -> str:
-        kb = self._get_keyboard(button_list) if button_list else None
+        kb = kwargs.get('keyboard') or self._get_keyboard(button_list)
 
         if file_type == 'image':
             message = PictureMessage(media=file_url, keyboard=kb)
@@ -251,11 +297,44 @@ class Viber(BaseMessenger):
             message = FileMessage(media=file_url, size=file_size,
                                   file_name=file_name, keyboard=kb)
 
+        return self.scheduler.call(
+            receiver, lambda: self._send_messages(receiver, [message]),
+            kwargs.get('priority'))
+
+    def send_media(self, receiver: str, media: 'MediaFile',
+                   media_type: MessageType, file_id: str = None,
+                   caption: str = '', button_list: list = None,
+                   **kwargs) -> Tuple[str, Optional[str], Optional[str]]:
+        # Viber downloads the media by the url, there are no file ids
+        kb = kwargs.get('keyboard') or self._get_keyboard(button_list)
+        url = media_store.url(media)
+        if media_type == MessageType.PICTURE:
+            messages = [PictureMessage(media=url, text=caption or None,
+                                       keyboard=kb)]
+        elif media_type == MessageType.VIDEO:
+            messages = [VideoMessage(media=url, size=media.size,
+                                     text=caption or None, keyboard=kb)]
+        else:
+            # The file message has no text, the caption follows it
+            messages = [FileMessage(media=url, size=media.size,
+                                    file_name=os.path.basename(media.path),
+                                    keyboard=None if caption else kb)]
+            if caption:
+                messages.append(TextMessage(text=caption, keyboard=kb))
+
+        message_token = self.scheduler.call(
+            receiver, lambda: self._send_messages(receiver, messages),
+            kwargs.get('priority'))
+        return message_token, None, None
+
+    def _send_messages(self, receiver: str, messages: list) -> str:
         try:
-            return self.bot.send_messages(receiver, [message])[0]
+            return self.bot.send_messages(receiver, messages)[0]
         except Exception as err:
             if str(err) == 'failed with status: 6, message: notSubscribed':
                 raise NotSubscribed(err)
+            elif str(err).startswith('failed with status: 12,'):
+                raise RetryAfter(err)
             raise MessengerException(err)
 
     def welcome_message(self, text: str) -> Dict[str, str]:
@@ -268,6 +347,9 @@ class Viber(BaseMessenger):
             "text": text
         }
 
+    def render_keyboard(self, button_list: list) -> Dict[str, Any]:
+        return self._get_keyboard(button_list)
+
     @staticmethod
     def _get_keyboard(buttons: list):
         if not buttons:
@@ -0,0 +1,356 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import (
+    AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+)
+
+from asgiref.sync import sync_to_async
+from django.db import connection
+
+from .settings import bot_api_settings
+
+
+__all__ = ('Metrics', 'MetricsExporter', 'LoggingExporter',
+           'PrometheusExporter', 'metrics')
+
+log = logging.getLogger(__name__)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# Seconds
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+# Query counter of the current update, it follows the update
+# to the threads of `sync_to_async`
+_queries: ContextVar[Optional[List[int]]] = ContextVar(
+    'bot_engine_queries', default=None)
+
+
+def _count_query(execute, sql, params, many, context):
+    counter = _queries.get()
+    if counter is not None:
+        counter[0] += 1
+    return execute(sql, params, many, context)
+
+
+def _install_counter():
+    """
+    Add the query counter to the connection of the current thread once
+    """
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _StageTimer:
+    __slots__ = ('metrics', 'labels', 'start', 'message_type')
+
+    def __init__(self, metrics: 'Metrics', labels: dict):
+        self.metrics = metrics
+        self.labels = labels
+        self.message_type = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.message_type is not None:
+            self.labels['type'] = self.message_type.value
+        self.metrics.observe('bot_engine_stage_seconds',
+                             time.perf_counter() - self.start, **self.labels)
+
+
+class _NullTimer:
+    """
+    Timer of the disabled metrics, it does nothing
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_null_timer = _NullTimer()
+
+
+class Metrics:
+    """
+    Timings and counters of the dispatch pipeline, in the process memory.
+    Stage timings are the histogram `bot_engine_stage_seconds` labeled by
+    stage, messenger and message type. When `METRICS_ENABLED` is off,
+    the hooks return at once.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._collectors: Dict[str, Callable[[], Dict[str, float]]] = {}
+        self._exporters: Optional[List['MetricsExporter']] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bot_api_settings.METRICS_ENABLED
+
+    @staticmethod
+    def _labels(labels: dict) -> Labels:
+        return tuple(sorted((key, str(value)) for key, value
+                            in labels.items()))
+
+    def stage(self, stage: str, messenger_id: int = None,
+              message: 'Message' = None):
+        """
+        Timer of the pipeline stage, `with metrics.stage('parse', ...) as t`,
+        the message type can be set later by `t.message_type`
+        """
+        if not self.enabled:
+            return _null_timer
+        labels = {'stage': stage,
+                  'messenger': '' if messenger_id is None else messenger_id,
+                  'type': message.type.value if message else ''}
+        return _StageTimer(self, labels)
+
+    def observe(self, name: str, value: float,
+                buckets: Tuple[float, ...] = TIME_BUCKETS, **labels):
+        if not self.enabled:
+            return
+        key = (name, self._labels(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = (name, self._labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    @contextmanager
+    def count_queries(self, messenger_id: int, message: 'Message'
+                      ) -> Iterator[None]:
+        """
+        Count the database queries of the current thread inside the block
+        """
+        if not self.enabled:
+            yield
+            return
+
+        _install_counter()
+        counter = [0]
+        token = _queries.set(counter)
+        try:
+            yield
+        finally:
+            _queries.reset(token)
+        self.observe('bot_engine_queries_per_update', counter[0],
+                     COUNT_BUCKETS, messenger=messenger_id,
+                     type=message.type.value)
+
+    @asynccontextmanager
+    async def acount_queries(self, messenger_id: int, message: 'Message'
+                             ) -> AsyncIterator[None]:
+        """
+        Async variant of `count_queries`, the queries are counted in
+        the thread of `sync_to_async` where the ORM calls run
+        """
+        if not self.enabled:
+            yield
+            return
+
+        await sync_to_async(_install_counter)()
+        counter = [0]
+        token = _queries.set(counter)
+        try:
+            yield
+        finally:
+            _queries.reset(token)
+        self.observe('bot_engine_queries_per_update', counter[0],
+                     COUNT_BUCKETS, messenger=messenger_id,
+                     type=message.type.value)
+
+    def add_collector(self, prefix: str,
+                      collect: Callable[[], Dict[str, float]]):
+        """
+        Source of the gauges, they are read at the export.
+        A collector of the same prefix is replaced.
+        :param prefix: gauge name prefix, the gauge is `{prefix}_{name}`
+        :param collect: returns the gauge values by name
+        """
+        with self._lock:
+            self._collectors[prefix] = collect
+
+    def gauges(self) -> Dict[Tuple[str, Labels], float]:
+        if not self.enabled:
+            return {}
+        with self._lock:
+            collectors = list(self._collectors.items())
+        gauges = {}
+        for prefix, collect in collectors:
+            for name, value in collect().items():
+                gauges[(f'{prefix}_{name}', ())] = value
+        return gauges
+
+    def snapshot(self) -> Tuple[Dict[Tuple[str, Labels], Histogram],
+                                Dict[Tuple[str, Labels], float]]:
+        with self._lock:
+            histograms = {}
+            for key, histogram in self._histograms.items():
+                copy = histograms[key] = Histogram(histogram.buckets)
+                copy.counts = list(histogram.counts)
+                copy.sum, copy.count = histogram.sum, histogram.count
+            return histograms, dict(self._counters)
+
+    def exporters(self) -> List['MetricsExporter']:
+        """
+        Exporters of the classes set in `METRICS_EXPORTERS`,
+        they are created and started once
+        """
+        if self._exporters is None:
+            with self._lock:
+                if self._exporters is None:
+                    exporters = [cls(self) for cls
+                                 in bot_api_settings.METRICS_EXPORTERS or ()]
+                    for exporter in exporters:
+                        exporter.start()
+                    self._exporters = exporters
+        return self._exporters
+
+    def exporter(self, exporter_class: type) -> Optional['MetricsExporter']:
+        for exporter in self.exporters():
+            if isinstance(exporter, exporter_class):
+                return exporter
+        return None
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+metrics = Metrics()
+
+
+class MetricsExporter:
+    """
+    Base class of the metrics exporters set in `METRICS_EXPORTERS`
+    """
+
+    def __init__(self, registry: Metrics):
+        self.metrics = registry
+
+    def start(self):
+        """
+        Called once when the exporters are created
+        """
+
+
+class PrometheusExporter(MetricsExporter):
+    """
+    Prometheus text format, served by `metrics_view`
+    """
+
+    @staticmethod
+    def _format_labels(labels: Labels, extra: Tuple = ()) -> str:
+        items = labels + extra
+        if not items:
+            return ''
+        return '{%s}' % ','.join(
+            '%s="%s"' % (key, value.replace('\\', '\\\\').replace('"', '\\"'))
+            for key, value in items)
+
+    def render(self) -> str:
+        histograms, counters = self.metrics.snapshot()
+        lines, typed = [], set()
+        for (name, labels), value in sorted(counters.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} counter')
+            lines.append(f'{name}{self._format_labels(labels)} {value}')
+
+        for (name, labels), value in sorted(self.metrics.gauges().items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name}{self._format_labels(labels)} {value}')
+
+        for (name, labels), histogram in sorted(histograms.items(),
+                                                key=lambda item: item[0]):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} histogram')
+            cumulative = 0
+            bounds = [str(bound) for bound in histogram.buckets] + ['+Inf']
+            for bound, count in zip(bounds, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket'
+                             f'{self._format_labels(labels, (("le", bound),))}'
+                             f' {cumulative}')
+            lines.append(f'{name}_sum{self._format_labels(labels)} '
+                         f'{histogram.sum}')
+            lines.append(f'{name}_count{self._format_labels(labels)} '
+                         f'{histogram.count}')
+        lines.append('')
+        return '\n'.join(lines)
+
+
+class LoggingExporter(MetricsExporter):
+    """
+    Logs the mean stage timings, the counters and the gauges
+    every `METRICS_LOG_INTERVAL` seconds
+    """
+
+    def start(self):
+        thread = threading.Thread(target=self._work,
+                                  name='bot-engine-metrics', daemon=True)
+        thread.start()
+
+    def _work(self):
+        while True:
+            time.sleep(bot_api_settings.METRICS_LOG_INTERVAL)
+            try:
+                self.export()
+            except Exception as err:
+                log.exception(f'Metrics export error; Error={err};')
+
+    def export(self):
+        histograms, counters = self.metrics.snapshot()
+        for (name, labels), histogram in sorted(histograms.items(),
+                                                key=lambda item: item[0]):
+            if histogram.count:
+                log.info(f'Metric={name}; Labels={dict(labels)}; '
+                         f'Count={histogram.count}; '
+                         f'Mean={histogram.sum / histogram.count:.6f};')
+        gauges = self.metrics.gauges()
+        for (name, labels), value in sorted({**counters, **gauges}.items()):
+            log.info(f'Metric={name}; Labels={dict(labels)}; Value={value};')
+
@@ -1,26 +1,42 @@
 from __future__ import annotations
+import asyncio
 import logging
+from contextvars import ContextVar
 from hashlib import md5
-from typing import Any, Callable, List, Optional, Type
+from typing import Any, Callable, List, Optional, Type, Union
 from uuid import uuid4
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib.postgres.fields import JSONField
 from django.contrib.sites.models import Site
+from django.core.exceptions import FieldDoesNotExist
 from django.db import models
-from django.db.models import Q
 from django.urls import reverse
-from django.utils.module_loading import import_string
+from django.utils import timezone
+from django.utils.functional import cached_property
 from django.utils.text import slugify
 from django.utils.translation import gettext_lazy as _
 from rest_framework.request import Request
 
-from .errors import MessengerException, NotSubscribed
+from . import bot_handler
+from .dedup import deduplicator
+from .enrichment import profile_enricher
+from .errors import MediaError, MessengerException, NotSubscribed, StateConflict
+from .keyboards import keyboard_cache
+from .media import media_downloader, media_store
+from .menu_graph import menu_graph
+from .message_log import message_log
 from .messengers import BaseMessenger, MessengerType
+from .metrics import metrics
+from .service import service_router
+from .settings import bot_api_settings
+from .state import ConversationState
 from .types import Message, MessageType
 
 
-__all__ = ('Account', 'Button', 'Menu', 'Messenger')
+__all__ = ('Account', 'Broadcast', 'Button', 'MediaFile', 'MediaUpload', 'Menu',
+           'MessageLog', 'Messenger')
 
 log = logging.getLogger(__name__)
 BASE_HANDLER = 'bot_engine.bot_handlers.echo_handler'
@@ -28,6 +44,65 @@ BUTTON_HANDLER = 'bot_engine.bot_handlers.echo_handler'
 ECHO_HANDLER = 'bot_engine.bot_handlers.echo_handler'
 
 
+async def arun_handler(handler: Callable, message: Message, account: Account):
+    """
+    Await the handler declared as `async def` natively,
+    the synchronous handler is run in a thread.
+    """
+    with metrics.stage('handler', account.messenger_id, message):
+        if asyncio.iscoroutinefunction(handler):
+            return await handler(message, account)
+        return await sync_to_async(handler)(message, account)
+
+
+_deferred_updates: ContextVar[Optional[dict]] = ContextVar(
+    'bot_engine_deferred_updates', default=None)
+
+
+class DeferredUpdates:
+    """
+    Coalesces `Account.update` calls made inside the block
+    into one UPDATE of the changed fields per account, flushed on exit.
+    Works as `with` and `async with` block.
+    """
+
+    def __enter__(self):
+        self._pending = {}
+        self._token = _deferred_updates.set(self._pending)
+        return self
+
+    def __exit__(self, *exc_info):
+        _deferred_updates.reset(self._token)
+        self.flush()
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, *exc_info):
+        _deferred_updates.reset(self._token)
+        await sync_to_async(self.flush)()
+
+    def flush(self):
+        """
+        :raise StateConflict: the conversation state can not be written,
+            the update should be dispatched again
+        """
+        conflict = None
+        for obj, fields in self._pending.values():
+            if fields is not None:
+                obj.save(update_fields=fields)
+                continue
+            # Conversation state
+            try:
+                obj.flush()
+            except StateConflict as err:
+                log.warning(err)
+                conflict = err
+        self._pending.clear()
+        if conflict is not None:
+            raise conflict
+
+
 # class DynamicHandlerMixin:
 #     """
 #     This mixin allows you to call the function declared in
@@ -104,11 +179,20 @@ class Messenger(models.Model):
     hash = models.CharField(
         _('token hash'), max_length=256,
         default='', editable=False)
+    update_offset = models.BigIntegerField(
+        _('update offset'),
+        default=0, editable=False,
+        help_text=_('Next update id of the long polling.'))
     is_active = models.BooleanField(
         _('active'),
         default=False, editable=False,
         help_text=_('This flag changes when the webhook on the messenger API '
                     'server is activated/deactivated.'))
+    webhook_secret = models.BooleanField(
+        _('webhook secret'),
+        default=False, editable=False,
+        help_text=_('The webhook is registered with the secret token, '
+                    'the requests without it are rejected.'))
     updated = models.DateTimeField(
         _('updated'), auto_now=True)
     created = models.DateTimeField(
@@ -143,43 +227,132 @@ class Messenger(models.Model):
         :param request: Rest framework request object
         :return: Answer data (optional)
         """
-        message = self.api.parse_message(request)
+        with metrics.stage('parse', self.id) as timer:
+            message = self.api.parse_message(request)
+            timer.message_type = message.type
+        return self.handle_message(message)
+
+    def handle_message(self, message: Message) -> Optional[Any]:
+        """
+        Process the parsed message of current messenger account
+        :param message: new incoming massage object
+        :return: Answer data (optional)
+        """
+        if message.is_receipt:
+            # The receipts are aggregated, they are not logged
+            return self.handle_service_message(message)
+
+        if deduplicator.is_duplicate(self, message):
+            log.debug(f'Duplicate update is dropped; Message={message};')
+            return None
+
+        message_log.log_incoming(self, message)
+        try:
+            if message.is_service:
+                return self.handle_service_message(message)
+
+            with metrics.count_queries(self.id, message), DeferredUpdates():
+                return self._handle_message(message)
+        except Exception:
+            # The retry of the failed update is not a duplicate
+            deduplicator.forget(self, message)
+            raise
+
+    def handle_service_message(self, message: Message) -> Optional[Any]:
+        """
+        Route the service message to the handlers of `service_router`,
+        the account is not loaded unless a handler needs it
+        :param message: service message object
+        :return: Answer data (optional)
+        """
+        with metrics.stage('service', self.id, message):
+            return service_router.route(self, message)
+
+    async def ahandle_service_message(self, message: Message
+                                      ) -> Optional[Any]:
+        """
+        Async variant of `handle_service_message`
+        """
+        with metrics.stage('service', self.id, message):
+            return await service_router.aroute(self, message)
 
-        if message.user_id:
-            account, created = (Account.objects.select_related('menu', 'user')
-                                .get_or_create(id=message.user_id,
-                                               defaults={'messenger': self,
-                                                         'menu': self.menu, }))
-            if created or not account.info:
+    def get_account(self, message: Message) -> Account:
+        """
+        Account of the message sender, it is created by the first message
+        and its profile is fetched from the messenger API
+        :param message: message with the user id
+        :return: Account object
+        """
+        with metrics.stage('account', self.id, message):
+            account, created = (
+                Account.objects.select_related('menu', 'user')
+                .get_or_create(id=message.user_id,
+                               defaults=self._account_defaults()))
+        # The replies use the connector of the routed messenger
+        account.messenger = self
+        if created or not account.info:
+            if bot_api_settings.DEFER_PROFILE_ENRICHMENT:
+                profile_enricher.enqueue(self, account.id)
+            else:
                 try:
-                    user_info = self.api.get_user_info(message.user_id)
+                    with metrics.stage('profile', self.id, message):
+                        user_info = self.api.get_user_info(message.user_id)
                     account.update(username=user_info.get('username'),
                                    info=user_info.get('info'),
                                    is_active=True)
+                    media_downloader.enqueue_avatar(self, account.id,
+                                                    user_info)
                 except MessengerException as err:
                     log.exception(err)
-        else:
-            account = None
+        return account
 
-        log.debug(f'\nMessage={message};\nAccount={account};')
+    async def aget_account(self, message: Message) -> Account:
+        """
+        Async variant of `get_account`
+        """
+        with metrics.stage('account', self.id, message):
+            account, created = await sync_to_async(
+                Account.objects.select_related('menu', 'user').get_or_create
+            )(id=message.user_id, defaults=self._account_defaults())
+        account.messenger = self
+        if created or not account.info:
+            if bot_api_settings.DEFER_PROFILE_ENRICHMENT:
+                profile_enricher.enqueue(self, account.id)
+            else:
+                try:
+                    with metrics.stage('profile', self.id, message):
+                        user_info = await self.api.aget_user_info(
+                            message.user_id)
+                    await sync_to_async(account.update)(
+                        username=user_info.get('username'),
+                        info=user_info.get('info'),
+                        is_active=True)
+                    media_downloader.enqueue_avatar(self, account.id,
+                                                    user_info)
+                except MessengerException as err:
+                    log.exception(err)
+        return account
 
-        if message.is_service:
-            if (message.type == MessageType.START and account
-                    and self.welcome_text):
-                return self.api.welcome_message(self.welcome_text)
-            elif message.type == MessageType.UNSUBSCRIBED and account:
-                account.update(is_active=False)
-            # TODO: make service handler
-            # self.process_service_message(message, account)
-            return None
+    def _handle_message(self, message: Message) -> Optional[Any]:
+        account = self.get_account(message) if message.user_id else None
 
-        message, account = self.api.preprocess_message(message, account)
+        log.debug(f'\nMessage={message};\nAccount={account};')
+
+        with metrics.stage('preprocess', self.id, message):
+            message, account = self.api.preprocess_message(message, account)
 
         if account.menu:
             account.menu.process_message(message, account)
         else:
             self.process_message(message, account)
 
+    def _account_defaults(self) -> dict:
+        defaults = {'messenger': self, 'menu': self.menu}
+        if bot_api_settings.DEFER_PROFILE_ENRICHMENT:
+            # The account is active until the messenger API says otherwise
+            defaults['is_active'] = True
+        return defaults
+
     def process_message(self, message: Message, account: Account):
         """
         Process the message with a bound handler.
@@ -188,18 +361,86 @@ class Messenger(models.Model):
         :return: None
         """
         if self.handler:
-            self.run_handler(message, account)
+            with metrics.stage('handler', self.id, message):
+                self.run_handler(message, account)
+
+    async def adispatch(self, request: Request) -> Optional[Any]:
+        """
+        Async entry point for current messenger account
+        :param request: Rest framework request object
+        :return: Answer data (optional)
+        """
+        with metrics.stage('parse', self.id) as timer:
+            message = self.api.parse_message(request)
+            timer.message_type = message.type
+        return await self.ahandle_message(message)
+
+    async def ahandle_message(self, message: Message) -> Optional[Any]:
+        """
+        Async variant of `handle_message`
+        :param message: new incoming massage object
+        :return: Answer data (optional)
+        """
+        if message.is_receipt:
+            return await self.ahandle_service_message(message)
+
+        if await deduplicator.ais_duplicate(self, message):
+            log.debug(f'Duplicate update is dropped; Message={message};')
+            return None
+
+        message_log.log_incoming(self, message)
+        try:
+            if message.is_service:
+                return await self.ahandle_service_message(message)
+
+            async with metrics.acount_queries(self.id, message), \
+                    DeferredUpdates():
+                return await self._ahandle_message(message)
+        except Exception:
+            await deduplicator.aforget(self, message)
+            raise
+
+    async def _ahandle_message(self, message: Message) -> Optional[Any]:
+        account = (await self.aget_account(message) if message.user_id
+                   else None)
+
+        log.debug(f'\nMessage={message};\nAccount={account};')
+
+        with metrics.stage('preprocess', self.id, message):
+            message, account = await sync_to_async(
+                self.api.preprocess_message)(message, account)
+
+        if account.menu:
+            await account.menu.aprocess_message(message, account)
+        else:
+            await self.aprocess_message(message, account)
+
+    async def aprocess_message(self, message: Message, account: Account):
+        """
+        Async variant of `process_message`
+        :param message: new incoming massage object
+        :param account: message sender object
+        :return: None
+        """
+        if self.handler:
+            await arun_handler(self.run_handler, message, account)
 
     @property
     def run_handler(self) -> Callable:
-        if not hasattr(self, '_handler'):
-            self._handler = import_string(self.handler)
-        return self._handler
+        return bot_handler.resolve(self.handler)
 
     def enable_webhook(self):
         domain = Site.objects.get_current().domain
-        url = reverse('bot_api:webhook', kwargs={'hash': self.token_hash()})
-        return self.api.enable_webhook(url=f'https://{domain}{url}')
+        view_name = ('bot_api:async_webhook' if bot_api_settings.WEBHOOK_ASYNC
+                     else 'bot_api:webhook')
+        url = reverse(view_name, kwargs={'hash': self.token_hash()})
+        result = self.api.enable_webhook(url=f'https://{domain}{url}')
+        # The registered webhook sends the secret token from now on
+        if not self.webhook_secret:
+            self.webhook_secret = True
+            Messenger.objects.filter(id=self.id).update(webhook_secret=True)
+        self.api.require_secret = True
+        return result
 
     def disable_webhook(self):
         return self.api.disable_webhook()
@@ -211,7 +452,8 @@ class Messenger(models.Model):
             url = self.logo
             self._api = self._api_class(
                 self.token, proxy=self.proxy, name=self.title,
-                avatar=f'https://{domain}{url}'
+                avatar=f'https://{domain}{url}',
+                require_secret=self.webhook_secret
             )
         return self._api
 
@@ -244,6 +486,9 @@ class Account(models.Model):
     context = JSONField(
         _('context'),
         default=dict, blank=True)
+    context_version = models.PositiveIntegerField(
+        _('context version'),
+        default=0, editable=False)
 
     messenger = models.ForeignKey(
         'Messenger', models.SET_NULL,
@@ -282,10 +527,48 @@ class Account(models.Model):
         return f'<Account ({self.messenger}:{self.id})>'
 
     def update(self, **kwargs):
+        """
+        Save only the changed fields, nothing is written if no field
+        is changed. Inside the `DeferredUpdates` block the write is
+        postponed to the end of the block.
+        """
+        changed = set()
         for key, value in kwargs.items():
-            if hasattr(self, key):
+            if not hasattr(self, key):
+                continue
+            try:
+                field = self._meta.get_field(key)
+            except FieldDoesNotExist:
                 setattr(self, key, value)
-        self.save()
+                continue
+
+            if field.is_relation:
+                old, new = getattr(self, field.attname), getattr(value, 'pk',
+                                                                 value)
+            else:
+                old, new = getattr(self, key), value
+            # The mutable JSON value could be changed in place
+            if old != new or (old is new and isinstance(new, (dict, list))):
+                changed.add(field.name)
+            setattr(self, key, value)
+
+        if not changed:
+            return
+        changed.add('updated')
+
+        pending = _deferred_updates.get()
+        if pending is None:
+            self.save(update_fields=changed)
+        else:
+            _, fields = pending.setdefault(id(self), (self, set()))
+            fields.update(changed)
+
+    @cached_property
+    def state(self) -> ConversationState:
+        """
+        Conversation state stored in the context
+        """
+        return ConversationState(self)
 
     @property
     def avatar(self) -> str:
@@ -293,20 +576,86 @@ class Account(models.Model):
 
     def send_message(self, message: Message, buttons: List[Button] = None,
                      i_buttons: List[Button] = None):
-        if self.menu:
-            buttons = buttons or self.menu.buttons.filter(is_inline=False).all()
-            i_buttons = (i_buttons or
-                         self.menu.buttons.filter(is_inline=True).all())
-
-        btn_list = buttons or None
-        ibtn_list = i_buttons or None
+        api = self.messenger.api
+        if buttons:
+            keyboard = api.render_keyboard(buttons)
+        else:
+            keyboard = keyboard_cache.get(api, self.menu_id, self.user)
 
         # TODO: make Massage parameter and handle him in api objects
         try:
-            self.messenger.api.send_message(self.id, message.text,
-                                            button_list=btn_list)
+            with metrics.stage('send', self.messenger_id, message):
+                message_id = api.send_message(self.id, message.text,
+                                              keyboard=keyboard)
+            message_log.log_outgoing(self.messenger, self.id, message.text,
+                                     message_id, message.type)
         except NotSubscribed:
-            self.is_active = False
+            self.update(is_active=False)
+            log.warning(f'Account {self.username}:{self.id} is not subscribed.')
+        except MessengerException as err:
+            log.exception(err)
+
+    def send_media(self, media: Union['MediaFile', bytes, str],
+                   caption: str = '', media_type: MessageType = None,
+                   buttons: List[Button] = None):
+        """
+        Send the picture, video or file.
+        The media is uploaded to the messenger once, the later sends
+        of the same content use the platform file id.
+        :param media: MediaFile object, local path, url or content
+        :param caption: text of the message
+        :param media_type: PICTURE, VIDEO or FILE, by the content type if None
+        :param buttons: keyboard buttons, the current menu by default
+        """
+        api = self.messenger.api
+        if buttons:
+            keyboard = api.render_keyboard(buttons)
+        else:
+            keyboard = keyboard_cache.get(api, self.menu_id, self.user)
+
+        try:
+            media = media_store.resolve(media)
+            media_type = media_type or media_store.media_type(media)
+            with metrics.stage('send', self.messenger_id):
+                message_id = media_store.send(self.messenger, self.id, media,
+                                              media_type, caption,
+                                              keyboard=keyboard)
+            message_log.log_outgoing(self.messenger, self.id, caption,
+                                     message_id, media_type)
+        except NotSubscribed:
+            self.update(is_active=False)
+            log.warning(f'Account {self.username}:{self.id} is not subscribed.')
+        except (MessengerException, MediaError) as err:
+            log.exception(err)
+
+    async def asend_media(self, media: Union['MediaFile', bytes, str],
+                          caption: str = '', media_type: MessageType = None,
+                          buttons: List[Button] = None):
+        """
+        Async variant of `send_media`, the upload runs in the thread
+        """
+        await menu_graph.aget()
+        await sync_to_async(self.send_media)(media, caption, media_type,
+                                             buttons)
+
+    async def asend_message(self, message: Message,
+                            buttons: List[Button] = None,
+                            i_buttons: List[Button] = None):
+        api = self.messenger.api
+        if buttons:
+            keyboard = api.render_keyboard(buttons)
+        else:
+            await menu_graph.aget()
+            keyboard = keyboard_cache.get(api, self.menu_id, self.user)
+
+        try:
+            with metrics.stage('send', self.messenger_id, message):
+                message_id = await api.asend_message(self.id, message.text,
+                                                     keyboard=keyboard)
+            message_log.log_outgoing(self.messenger, self.id, message.text,
+                                     message_id, message.type)
+        except NotSubscribed:
+            await sync_to_async(self.update)(is_active=False)
             log.warning(f'Account {self.username}:{self.id} is not subscribed.')
         except MessengerException as err:
             log.exception(err)
@@ -352,7 +701,7 @@ class Menu(models.Model):
         return f'<Menu ({self.title}:{self.id})>'
 
     def json_buttons(self) -> List[dict]:
-        return [item.to_dict() for item in self.buttons.all()]
+        return [item.to_dict() for item in menu_graph.get().buttons(self.id)]
 
     def process_message(self, message: Message, account: Account):
         """
@@ -362,11 +711,8 @@ class Menu(models.Model):
         :return: None
         """
         if message.is_button:
-            buttons = self.buttons.filter(Q(command=message.text) |
-                                          Q(text=message.text)).all()
-            if len(buttons) == 0:
-                buttons = Button.objects.filter(Q(command=message.text) |
-                                                Q(text=message.text)).all()
+            with metrics.stage('menu', account.messenger_id, message):
+                buttons = menu_graph.get().find_buttons(message.text, self.id)
 
             if buttons:
                 buttons[0].process_button(message, account)
@@ -376,13 +722,34 @@ class Menu(models.Model):
                             ' This can lead to unplanned behavior.'
                             ' We recommend making the buttons unique.')
         else:
-            self.run_handler(message, account)
+            with metrics.stage('handler', account.messenger_id, message):
+                self.run_handler(message, account)
+
+    async def aprocess_message(self, message: Message, account: Account):
+        """
+        Async variant of `process_message`
+        :param message: new incoming massage object
+        :param account: message sender object
+        :return: None
+        """
+        if message.is_button:
+            with metrics.stage('menu', account.messenger_id, message):
+                graph = await menu_graph.aget()
+                buttons = graph.find_buttons(message.text, self.id)
+
+            if buttons:
+                await buttons[0].aprocess_button(message, account)
+
+            if not buttons or len(buttons) > 1:
+                log.warning('The number of buttons found is different from one.'
+                            ' This can lead to unplanned behavior.'
+                            ' We recommend making the buttons unique.')
+        else:
+            await arun_handler(self.run_handler, message, account)
 
     @property
     def run_handler(self) -> Callable:
-        if not hasattr(self, '_handler'):
-            self._handler = import_string(self.handler)
-        return self._handler
+        return bot_handler.resolve(self.handler)
 
 
 class Button(models.Model):
@@ -455,24 +822,52 @@ class Button(models.Model):
         if self.message:
             account.send_message(Message.text(self.message))
 
-        if self.next_menu:
-            account.update(menu=self.next_menu)
+        next_menu = None
+        if self.next_menu_id:
+            # The menu is missing only if the graph is older than the button
+            graph, next_menu = menu_graph.get_menu(self.next_menu_id)
+        if next_menu:
+            account.update(menu=next_menu)
 
-            btn_list = self.next_menu.buttons.all() or None
-            if self.next_menu.message:
-                msg_text = self.next_menu.message
-                account.send_message(Message.text(msg_text), buttons=btn_list)
+            # The keyboard of the new account menu is attached
+            if next_menu.message:
+                account.send_message(Message.text(next_menu.message))
             else:
-                account.send_message(Message.keyboard(btn_list))
+                account.send_message(
+                    Message.keyboard(list(graph.buttons(next_menu.id))))
 
         if self.handler:
-            self.run_handler(message, account)
+            with metrics.stage('handler', account.messenger_id, message):
+                self.run_handler(message, account)
+
+    async def aprocess_button(self, message: Message, account: Account):
+        """
+        Async variant of `process_button`
+        :param message: new incoming massage object
+        :param account: message sender object
+        :return: None
+        """
+        if self.message:
+            await account.asend_message(Message.text(self.message))
+
+        next_menu = None
+        if self.next_menu_id:
+            graph, next_menu = await menu_graph.aget_menu(self.next_menu_id)
+        if next_menu:
+            await sync_to_async(account.update)(menu=next_menu)
+
+            if next_menu.message:
+                await account.asend_message(Message.text(next_menu.message))
+            else:
+                await account.asend_message(
+                    Message.keyboard(list(graph.buttons(next_menu.id))))
+
+        if self.handler:
+            await arun_handler(self.run_handler, message, account)
 
     @property
     def run_handler(self) -> Callable:
-        if not hasattr(self, '_handler'):
-            self._handler = import_string(self.handler)
-        return self._handler
+        return bot_handler.resolve(self.handler)
 
     def save(self, *args, **kwargs):
         if not self.command:
@@ -490,3 +885,190 @@ class Button(models.Model):
             'command': self.command,
             'size': (2, 1)
         }
+
+
+class Broadcast(models.Model):
+    NEW = 'new'
+    RUNNING = 'running'
+    PAUSED = 'paused'
+    DONE = 'done'
+    STATUS_CHOICES = (
+        (NEW, _('New')),
+        (RUNNING, _('Running')),
+        (PAUSED, _('Paused')),
+        (DONE, _('Done')),
+    )
+
+    messenger = models.ForeignKey(
+        'Messenger', models.CASCADE,
+        verbose_name=_('messenger'), related_name='broadcasts')
+    text = models.CharField(
+        _('text'), max_length=1024,
+        help_text=_('The text of the message sent to all active accounts.'))
+    menu = models.ForeignKey(
+        'Menu', models.SET_NULL,
+        verbose_name=_('keyboard menu'), related_name='broadcasts',
+        null=True, blank=True,
+        help_text=_('The buttons of this menu are attached to the message.'))
+    media = models.ForeignKey(
+        'MediaFile', models.PROTECT,
+        verbose_name=_('media file'), related_name='broadcasts',
+        null=True, blank=True,
+        help_text=_('The picture, video or file sent with the text '
+                    'as the caption. It is uploaded once.'))
+
+    status = models.CharField(
+        _('status'), max_length=16,
+        choices=STATUS_CHOICES, default=NEW, editable=False)
+    last_account = models.CharField(
+        _('last account id'), max_length=256,
+        default='', blank=True, editable=False,
+        help_text=_('Checkpoint. The broadcast is resumed after this account.'))
+    sent = models.PositiveIntegerField(
+        _('sent'), default=0, editable=False)
+    failed = models.PositiveIntegerField(
+        _('failed'), default=0, editable=False)
+    unsubscribed = models.PositiveIntegerField(
+        _('unsubscribed'), default=0, editable=False)
+    updated = models.DateTimeField(
+        _('updated'), auto_now=True)
+    created = models.DateTimeField(
+        _('created'), auto_now_add=True)
+
+    class Meta:
+        verbose_name = _('broadcast')
+        verbose_name_plural = _('broadcasts')
+
+    def __str__(self):
+        return f'{self.text[:32]} ({self.messenger})'
+
+    def __repr__(self):
+        return f'<Broadcast ({self.messenger}:{self.id})>'
+
+    def run(self) -> bool:
+        """
+        Send the message to all active accounts of the messenger.
+        The stopped broadcast is resumed from the last checkpoint.
+        :return: False if the broadcast is run by another sender
+        """
+        from .broadcast import BroadcastSender
+
+        return BroadcastSender(self).run()
+
+
+class MessageLog(models.Model):
+    INCOMING = 'in'
+    OUTGOING = 'out'
+    DIRECTION_CHOICES = (
+        (INCOMING, _('Incoming')),
+        (OUTGOING, _('Outgoing')),
+    )
+    SENT = 'sent'
+    DELIVERED = 'delivered'
+    SEEN = 'seen'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (SENT, _('Sent')),
+        (DELIVERED, _('Delivered')),
+        (SEEN, _('Seen')),
+        (FAILED, _('Failed')),
+    )
+
+    messenger = models.ForeignKey(
+        'Messenger', models.CASCADE,
+        verbose_name=_('messenger'), related_name='message_logs')
+    # Without constraint, the log is written before the account is committed
+    account = models.ForeignKey(
+        'Account', models.DO_NOTHING,
+        verbose_name=_('account'), related_name='message_logs',
+        db_constraint=False, null=True, blank=True)
+    direction = models.CharField(
+        _('direction'), max_length=3, choices=DIRECTION_CHOICES)
+    message_type = models.CharField(
+        _('message type'), max_length=16, choices=MessageType.choices())
+    message_id = models.CharField(
+        _('message id'), max_length=256, blank=True)
+    text = models.TextField(
+        _('text'), blank=True)
+    status = models.CharField(
+        _('status'), max_length=16,
+        choices=STATUS_CHOICES, blank=True,
+        help_text=_('Delivery status of the outgoing message.'))
+    created = models.DateTimeField(
+        _('created'), default=timezone.now, db_index=True)
+
+    class Meta:
+        verbose_name = _('message log')
+        verbose_name_plural = _('message logs')
+        indexes = [
+            models.Index(fields=['messenger', 'created']),
+            # The receipts are matched by the message id
+            models.Index(fields=['messenger', 'message_id']),
+        ]
+
+    def __str__(self):
+        return f'{self.direction} {self.message_type} ({self.account_id})'
+
+    def __repr__(self):
+        return f'<MessageLog ({self.messenger_id}:{self.id})>'
+
+
+class MediaFile(models.Model):
+    sha256 = models.CharField(
+        _('SHA-256'), max_length=64, unique=True)
+    path = models.CharField(
+        _('path'), max_length=512,
+        help_text=_('File name in the default storage.'))
+    size = models.BigIntegerField(
+        _('size'), default=0)
+    content_type = models.CharField(
+        _('content type'), max_length=128, blank=True)
+    source = models.CharField(
+        _('source url'), max_length=1024,
+        blank=True, db_index=True,
+        help_text=_('The file downloaded from this url is sent by the url.'))
+    created = models.DateTimeField(
+        _('created'), auto_now_add=True)
+
+    class Meta:
+        verbose_name = _('media file')
+        verbose_name_plural = _('media files')
+
+    def __str__(self):
+        return self.path
+
+    def __repr__(self):
+        return f'<MediaFile ({self.sha256[:12]}:{self.id})>'
+
+    @property
+    def url(self) -> str:
+        return media_store.url(self)
+
+
+class MediaUpload(models.Model):
+    messenger = models.ForeignKey(
+        'Messenger', models.CASCADE,
+        verbose_name=_('messenger'), related_name='media_uploads')
+    media = models.ForeignKey(
+        'MediaFile', models.CASCADE,
+        verbose_name=_('media file'), related_name='uploads')
+    file_id = models.CharField(
+        _('file id'), max_length=512,
+        help_text=_('Platform id of the file, the file is sent by it.'))
+    file_unique_id = models.CharField(
+        _('file unique id'), max_length=128,
+        blank=True, db_index=True,
+        help_text=_('The same for all bots (Telegram).'))
+    created = models.DateTimeField(
+        _('created'), auto_now_add=True)
+
+    class Meta:
+        verbose_name = _('media upload')
+        verbose_name_plural = _('media uploads')
+        unique_together = ('messenger', 'media')
+
+    def __str__(self):
+        return self.file_id
+
+    def __repr__(self):
+        return f'<MediaUpload ({self.messenger_id}:{self.media_id})>'
@@ -0,0 +1,155 @@
+import atexit
+import logging
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Dict, Tuple
+
+from django.db import close_old_connections
+
+from .message_log import message_log
+from .settings import bot_api_settings
+from .types import Message, MessageType
+
+
+__all__ = ('ReceiptAggregator', 'receipt_aggregator')
+
+log = logging.getLogger(__name__)
+
+# Receipt type -> (status, statuses it replaces)
+RECEIPT_STATUSES = {
+    MessageType.DELIVERED: ('delivered', ('sent', )),
+    MessageType.FAILED: ('failed', ('sent', )),
+    MessageType.SEEN: ('seen', ('sent', 'delivered')),
+}
+_RANKS = {MessageType.DELIVERED: 1, MessageType.FAILED: 1,
+          MessageType.SEEN: 2}
+
+
+class ReceiptAggregator:
+    """
+    Delivery receipts of the sent messages folded into `MessageLog.status`.
+    The webhook only puts the receipt to the memory, the receipts of one
+    message are folded to the latest status (seen over delivered), and
+    the background worker writes them every `RECEIPTS_INTERVAL` seconds
+    with one UPDATE per messenger, status and `RECEIPTS_BATCH_SIZE`
+    messages. The buffer is bounded by `RECEIPTS_BUFFER` messages,
+    the oldest receipts are dropped.
+    """
+
+    def __init__(self, batch_size: int = None, interval: float = None,
+                 max_size: int = None):
+        self._batch_size = batch_size
+        self._interval = interval
+        self._max_size = max_size
+        self._cond = threading.Condition()
+        # (messenger id, message id) -> receipt type
+        self._pending: Dict[Tuple[int, str], MessageType] = OrderedDict()
+        self._thread = None
+        self._at_exit = False
+        self.dropped = 0
+
+    @property
+    def batch_size(self) -> int:
+        return self._batch_size or bot_api_settings.RECEIPTS_BATCH_SIZE
+
+    @property
+    def interval(self) -> float:
+        return self._interval or bot_api_settings.RECEIPTS_INTERVAL
+
+    @property
+    def max_size(self) -> int:
+        return self._max_size or bot_api_settings.RECEIPTS_BUFFER
+
+    def add(self, messenger: 'Messenger', message: Message) -> bool:
+        """
+        Put the receipt to the buffer
+        :param messenger: Messenger object
+        :param message: DELIVERED, SEEN or FAILED message
+        :return: False if the receipt does not change the status
+        """
+        if message.type not in RECEIPT_STATUSES or not message.id:
+            return False
+
+        key = (messenger.id, str(message.id))
+        with self._cond:
+            current = self._pending.get(key)
+            if current is not None:
+                if _RANKS[current] >= _RANKS[message.type]:
+                    return False
+            elif len(self._pending) >= self.max_size:
+                self._pending.popitem(last=False)
+                self.dropped += 1
+                if self.dropped % self.batch_size == 1:
+                    log.warning(f'Receipts buffer is full; '
+                                f'Dropped={self.dropped};')
+            self._pending[key] = message.type
+            if len(self._pending) == 1:
+                # Wake the worker, it writes the receipts after the interval
+                self._cond.notify()
+            self._start()
+        return True
+
+    def flush(self):
+        """
+        Write all buffered receipts in the current thread.
+        """
+        self._write(self._take())
+
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._work, name='bot-engine-receipts', daemon=True)
+            self._thread.start()
+            # The thread is restarted in the forked process,
+            # the exit handler is inherited
+            if not self._at_exit:
+                atexit.register(self.flush)
+                self._at_exit = True
+
+    def _take(self) -> Dict[Tuple[int, str], MessageType]:
+        with self._cond:
+            pending, self._pending = self._pending, OrderedDict()
+            return pending
+
+    def _work(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self._pending) > 0)
+                self._cond.wait(self.interval)
+            close_old_connections()
+            try:
+                self._write(self._take())
+            except Exception as err:
+                log.exception(f'Receipts error; Error={err};')
+            finally:
+                close_old_connections()
+
+    def _write(self, pending: Dict[Tuple[int, str], MessageType]) -> int:
+        if not pending:
+            return 0
+
+        from .models import MessageLog
+
+        # The sent messages may be still in the log buffer
+        message_log.flush()
+
+        groups = defaultdict(list)
+        for (messenger_id, message_id), receipt_type in pending.items():
+            groups[(messenger_id, receipt_type)].append(message_id)
+
+        updated = 0
+        for (messenger_id, receipt_type), message_ids in groups.items():
+            status, previous = RECEIPT_STATUSES[receipt_type]
+            for start in range(0, len(message_ids), self.batch_size):
+                updated += MessageLog.objects.filter(
+                    messenger_id=messenger_id,
+                    direction=MessageLog.OUTGOING,
+                    message_id__in=message_ids[start:start + self.batch_size],
+                    status__in=previous,
+                ).update(status=status)
+        log.debug(f'Receipts are written; Receipts={len(pending)}; '
+                  f'Updated={updated};')
+        return updated
+
+
+receipt_aggregator = ReceiptAggregator()
@@ -0,0 +1,97 @@
+import logging
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from .settings import bot_api_settings
+
+
+__all__ = ('MessengerRegistry', 'messenger_registry')
+
+log = logging.getLogger(__name__)
+
+
+class MessengerRegistry:
+    """
+    Process-wide registry of webhook hash -> warm Messenger object.
+    The cached Messenger keeps its connector (``Messenger.api``) between
+    requests, so the webhook hot path does no SQL for routing and reuses
+    one connector per bot.
+    Entries are invalidated by the model signals and by the admin actions.
+    Other processes are not notified, so every entry also expires after
+    ``MESSENGER_CACHE_TTL`` seconds.
+    """
+
+    def __init__(self, ttl: int = None):
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[float, 'Messenger']] = {}
+
+    @property
+    def ttl(self) -> int:
+        if self._ttl is None:
+            return bot_api_settings.MESSENGER_CACHE_TTL
+        return self._ttl
+
+    def get(self, im_hash: str) -> 'Messenger':
+        """
+        Get the messenger by the webhook hash.
+        :param im_hash: webhook hash of the messenger token
+        :return: cached Messenger object
+        :raise Messenger.DoesNotExist: unknown hash
+        """
+        messenger = self.peek(im_hash)
+        if messenger is not None:
+            return messenger
+
+        from .models import Messenger
+
+        messenger = (Messenger.objects.select_related('menu')
+                     .get(hash=im_hash))
+        # Build the connector once, outside of the request handlers
+        messenger.api
+        with self._lock:
+            self._entries[im_hash] = (time.monotonic() + (self.ttl or 0),
+                                      messenger)
+        log.debug(f'Messenger cached; Hash={im_hash}; Messenger={messenger};')
+        return messenger
+
+    def peek(self, im_hash: str) -> Optional['Messenger']:
+        """
+        Get the cached messenger without touching the database.
+        :param im_hash: webhook hash of the messenger token
+        :return: cached Messenger object or None
+        """
+        entry = self._entries.get(im_hash)
+        if entry and (not self.ttl or entry[0] > time.monotonic()):
+            return entry[1]
+        return None
+
+    def invalidate(self, im_hash: Optional[str] = None):
+        """
+        Drop the cached messenger.
+        :param im_hash: webhook hash, all messengers will be dropped if empty
+        :return: None
+        """
+        with self._lock:
+            if im_hash is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(im_hash, None)
+
+    def discard(self, messenger: 'Messenger'):
+        """
+        Drop all entries of the messenger (the token hash may have changed).
+        :param messenger: Messenger object
+        :return: None
+        """
+        with self._lock:
+            for im_hash, (_, cached) in list(self._entries.items()):
+                if cached.pk == messenger.pk or im_hash == messenger.hash:
+                    del self._entries[im_hash]
+
+    def clear(self):
+        self.invalidate()
+
+
+messenger_registry = MessengerRegistry()
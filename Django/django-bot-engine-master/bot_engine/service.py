@@ -0,0 +1,122 @@
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional
+
+from asgiref.sync import async_to_sync, sync_to_async
+
+from .receipts import receipt_aggregator
+from .types import Message, MessageType
+
+
+__all__ = ('ServiceRouter', 'service_router')
+
+log = logging.getLogger(__name__)
+
+
+class ServiceRouter:
+    """
+    Handlers of the service messages by the message type.
+    The service messages are routed before the account lookup,
+    a handler touches the database only if the event needs it.
+    The handler is `handler(messenger, message)`, it may be a coroutine
+    function, the first answer of the handlers is the answer to the webhook.
+    The handlers are registered by the `bot_handlers` modules:
+
+        @service_router.register(MessageType.SEEN)
+        def seen_handler(messenger, message):
+            ...
+    """
+
+    def __init__(self):
+        self._handlers: Dict[MessageType, List[Callable]] = defaultdict(list)
+
+    def register(self, message_type: MessageType, handler: Callable = None):
+        """
+        Add the handler of the message type, can be used as decorator
+        """
+        if handler is None:
+            return lambda func: self.register(message_type, func)
+
+        if handler not in self._handlers[message_type]:
+            self._handlers[message_type].append(handler)
+        return handler
+
+    def unregister(self, message_type: MessageType, handler: Callable):
+        try:
+            self._handlers[message_type].remove(handler)
+        except ValueError:
+            pass
+
+    def handlers(self, message_type: MessageType) -> List[Callable]:
+        return list(self._handlers.get(message_type, ()))
+
+    def route(self, messenger: 'Messenger', message: Message
+              ) -> Optional[Any]:
+        """
+        Run the handlers of the service message
+        :return: Answer data (optional)
+        """
+        answer = None
+        for handler in self._handlers.get(message.type, ()):
+            if asyncio.iscoroutinefunction(handler):
+                result = async_to_sync(handler)(messenger, message)
+            else:
+                result = handler(messenger, message)
+            if answer is None:
+                answer = result
+        return answer
+
+    async def aroute(self, messenger: 'Messenger', message: Message
+                     ) -> Optional[Any]:
+        """
+        Async variant of `route`
+        """
+        answer = None
+        for handler in self._handlers.get(message.type, ()):
+            if asyncio.iscoroutinefunction(handler):
+                result = await handler(messenger, message)
+            else:
+                result = await sync_to_async(handler)(messenger, message)
+            if answer is None:
+                answer = result
+        return answer
+
+
+service_router = ServiceRouter()
+
+
+@service_router.register(MessageType.START)
+def welcome_handler(messenger: 'Messenger', message: Message):
+    """
+    The welcome message is the answer to the webhook request,
+    the account is created by the first message
+    """
+    if messenger.welcome_text:
+        return messenger.api.welcome_message(messenger.welcome_text)
+
+
+@service_router.register(MessageType.SUBSCRIBED)
+def subscribed_handler(messenger: 'Messenger', message: Message):
+    if not message.user_id:
+        return
+    account = messenger.get_account(message)
+    if not account.is_active:
+        account.update(is_active=True)
+
+
+@service_router.register(MessageType.UNSUBSCRIBED)
+def unsubscribed_handler(messenger: 'Messenger', message: Message):
+    from .models import Account
+
+    if message.user_id:
+        Account.objects.filter(id=message.user_id).update(is_active=False)
+
+
+def receipt_handler(messenger: 'Messenger', message: Message):
+    receipt_aggregator.add(messenger, message)
+
+
+for _receipt_type in (MessageType.DELIVERED, MessageType.SEEN,
+                      MessageType.FAILED):
+    service_router.register(_receipt_type, receipt_handler)
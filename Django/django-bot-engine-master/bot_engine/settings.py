@@ -30,6 +30,101 @@ DEFAULTS = {
     'BUTTON_PREFIX': 'BTN_',
     'MENU_ITEM_PREFIX': 'MI_BTN_',
     'SAVE_MESSAGES': True,
+    # Handler modules of the installed apps registered at the start
+    'HANDLERS_MODULE': 'bot_handlers',
+    # Message log write-behind buffer, entries over the limit are dropped
+    'MESSAGE_LOG_BATCH_SIZE': 500,
+    # Seconds to wait for the batch
+    'MESSAGE_LOG_INTERVAL': 2,
+    'MESSAGE_LOG_BUFFER': 20000,
+    # Delivery receipts are folded into the message log status
+    # by one UPDATE per status and batch
+    'RECEIPTS_BATCH_SIZE': 1000,
+    # Seconds to gather the receipts
+    'RECEIPTS_INTERVAL': 5,
+    'RECEIPTS_BUFFER': 100000,
+    # Seconds to drop the redelivered updates, 0 disables the check
+    'DEDUP_TTL': 600,
+    'DEDUP_MAX_SIZE': 100000,
+    # Django cache alias sharing the seen updates between the processes
+    'DEDUP_CACHE': None,
+    # Seconds before the abandoned conversation state is started anew
+    'STATE_TTL': 86400,
+    # Django cache alias of the conversation states, the process memory
+    # is used if not set
+    'STATE_CACHE': None,
+    'STATE_CACHE_TTL': 3600,
+    # Seconds to keep a routed messenger in the process cache
+    'MESSENGER_CACHE_TTL': 300,
+    # Seconds to keep the compiled menu graph in the process
+    'MENU_GRAPH_TTL': 300,
+    # Reject the webhooks without valid signature (Viber) or secret token
+    # (Telegram)
+    'VERIFY_WEBHOOKS': True,
+    # Reject the Telegram webhooks without the secret token header even
+    # for the messengers whose webhook was not enabled again after
+    # the upgrade, those are accepted with a warning by default
+    'TELEGRAM_REQUIRE_SECRET': False,
+    # Webhook body decoder: 'orjson', 'simdjson', 'json' or None for
+    # the fastest installed one
+    'JSON_DECODER': None,
+    # Webhook updates processing: 'sync', 'thread' or 'process'
+    'DISPATCH_MODE': 'sync',
+    'DISPATCH_WORKERS': 4,
+    # Max queued updates of all accounts and of one account
+    'DISPATCH_QUEUE_SIZE': 5000,
+    'DISPATCH_ACCOUNT_QUEUE_SIZE': 100,
+    # Point the webhooks to the native async view (requires ASGI and httpx)
+    'WEBHOOK_ASYNC': False,
+    # Outgoing HTTP connections to the messenger APIs
+    'HTTP_TIMEOUT': 30,
+    'HTTP_CONNECT_TIMEOUT': 10,
+    # Keep-alive connections per host and number of the pooled hosts
+    'HTTP_POOL_SIZE': 100,
+    'HTTP_POOL_HOSTS': 10,
+    'HTTP_KEEPALIVE': 60,
+    # Use HTTP/2 for the async client when "h2" is installed
+    'HTTP2': True,
+    # Telegram Bot API server, e.g. 'http://localhost:8081/bot{token}/{method}'
+    # and 'http://localhost:8081/file/bot{token}/{path}'
+    'TELEGRAM_API_URL': None,
+    'TELEGRAM_FILE_URL': None,
+    # Seconds of one getUpdates request of the "poll_telegram" command
+    'POLLING_TIMEOUT': 30,
+    # Stage timings and counters of the dispatch pipeline
+    'METRICS_ENABLED': False,
+    'METRICS_EXPORTERS': ['bot_engine.metrics.PrometheusExporter'],
+    # Seconds between the reports of the logging exporter
+    'METRICS_LOG_INTERVAL': 60,
+    # Bearer token of the metrics scraper, the staff users are allowed too
+    'METRICS_TOKEN': None,
+    # Media files store, the directory of the default storage
+    'MEDIA_DIR': 'bot_engine',
+    'MEDIA_CHUNK_SIZE': 64 * 1024,
+    # Max size of the stored file, 20 MB is the download limit of Telegram
+    'MEDIA_MAX_SIZE': 20 * 1024 * 1024,
+    # Broadcasts
+    'BROADCAST_CHUNK_SIZE': 1000,
+    'BROADCAST_WORKERS': 8,
+    # Seconds without a checkpoint after which the running broadcast
+    # is considered stopped (e.g. by a restart) and can be resumed
+    'BROADCAST_STALE_TIMEOUT': 600,
+    # Outgoing messages rate limits: (messages per second, burst)
+    # Process-wide limit of all bots
+    'GLOBAL_RATE_LIMIT': None,
+    # Overrides of the connectors limits by API type,
+    # e.g. {'telegram': {'bot': (30, 30), 'chat': (1, 3)}}
+    'RATE_LIMITS': {},
+    # Fetch the account profiles in the background batches
+    'DEFER_PROFILE_ENRICHMENT': True,
+    'ENRICHMENT_BATCH_SIZE': 50,
+    # Seconds to wait for the batch
+    'ENRICHMENT_INTERVAL': 1,
+    # Seconds before the failed profile fetch is repeated
+    'ENRICHMENT_RETRY_DELAY': 600,
+    # Retries of the calls rejected by the API rate limit
+    'SEND_RETRIES': 3,
+    'SEND_BACKOFF': 1,
 
     # REST Framework examples
     # Base API policies
@@ -51,6 +146,7 @@ DEFAULTS = {
 IMPORT_STRINGS = [
     # Bot API
     'DEFAULT_BOT',
+    'METRICS_EXPORTERS',
     # REST Framework examples
     'DEFAULT_RENDERER_CLASSES',
     'DEFAULT_SCHEMA_CLASS',
@@ -0,0 +1,31 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .menu_graph import menu_graph
+from .models import Button, Menu, Messenger
+from .routing import messenger_registry
+
+
+@receiver(post_save, sender=Messenger)
+@receiver(post_delete, sender=Messenger)
+def invalidate_messenger(sender, instance: Messenger, **kwargs):
+    messenger_registry.discard(instance)
+
+
+@receiver(post_save, sender=Menu)
+@receiver(post_delete, sender=Menu)
+def invalidate_messenger_menu(sender, instance: Menu, **kwargs):
+    # Cached messengers hold their root menu object
+    messenger_registry.clear()
+
+
+@receiver(post_save, sender=Menu)
+@receiver(post_delete, sender=Menu)
+@receiver(post_save, sender=Button)
+@receiver(post_delete, sender=Button)
+@receiver(m2m_changed, sender=Menu.buttons.through)
+def invalidate_menu_graph(sender, **kwargs):
+    menu_graph.invalidate()
+    # Other threads could rebuild the graph before the commit
+    transaction.on_commit(menu_graph.invalidate)
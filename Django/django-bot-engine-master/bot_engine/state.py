@@ -0,0 +1,252 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+from django.core.cache import caches
+from django.db import connections
+from django.db.models import F, Func, JSONField, Value
+from django.db.models.functions import Cast
+
+from .errors import StateConflict
+from .settings import bot_api_settings
+
+
+__all__ = ('ConversationState', 'JsonbSet', 'state_cache')
+
+log = logging.getLogger(__name__)
+
+EXPIRES_KEY = '_expires'
+
+
+class JsonbSet(Func):
+    """
+    jsonb_set() of PostgreSQL, replaces one key of the JSON document
+    """
+    function = 'jsonb_set'
+    template = '%(function)s(%(expressions)s, true)'
+    arity = 3
+
+    def __init__(self, expression, key: str, value: Any):
+        path = '{"%s"}' % key.replace('\\', '\\\\').replace('"', '\\"')
+        super().__init__(expression, Value(path),
+                         Cast(Value(json.dumps(value)), JSONField()),
+                         output_field=JSONField())
+
+
+class StateCache:
+    """
+    Hot tier of the conversation states: (version, data) by account id.
+    It is the cache of `STATE_CACHE` alias if set, so the processes share
+    the states, otherwise the process memory.
+    """
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+
+    @staticmethod
+    def _key(account_id: str) -> str:
+        return f'bot_engine:state:{account_id}'
+
+    def get(self, account_id: str) -> Optional[Tuple[int, dict]]:
+        alias = bot_api_settings.STATE_CACHE
+        if alias:
+            return caches[alias].get(self._key(account_id))
+
+        with self._lock:
+            item = self._items.get(account_id)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._items[account_id]
+                return None
+            self._items.move_to_end(account_id)
+            return value
+
+    def set(self, account_id: str, version: int, data: dict):
+        # The cached state does not outlive the conversation
+        ttl = bot_api_settings.STATE_CACHE_TTL
+        if bot_api_settings.STATE_TTL:
+            ttl = min(ttl, bot_api_settings.STATE_TTL)
+        alias = bot_api_settings.STATE_CACHE
+        if alias:
+            caches[alias].set(self._key(account_id), (version, data), ttl)
+            return
+
+        with self._lock:
+            self._items[account_id] = (time.monotonic() + ttl, (version, data))
+            self._items.move_to_end(account_id)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def delete(self, account_id: str):
+        alias = bot_api_settings.STATE_CACHE
+        if alias:
+            caches[alias].delete(self._key(account_id))
+            return
+
+        with self._lock:
+            self._items.pop(account_id, None)
+
+
+state_cache = StateCache()
+
+
+class ConversationState:
+    """
+    Session-style state of the conversation with the account,
+    stored in `Account.context`.
+    The state is read through the hot tier, the changes are written
+    to the database and to the tier at the end of the dispatch
+    (or at once outside of it). The write is checked against
+    `Account.context_version`, the changed keys are written by jsonb_set
+    on PostgreSQL, on the conflict they are merged into the state written
+    by the other worker once (the cleared state is not merged).
+    The state not changed during `STATE_TTL` seconds
+    is started anew.
+    """
+
+    def __init__(self, account: 'Account'):
+        self.account = account
+        self._version = None
+        self._data = None
+        self._dirty = set()
+        self._replaced = False
+
+    def _load(self) -> dict:
+        if self._data is not None:
+            return self._data
+
+        account = self.account
+        cached = state_cache.get(account.id)
+        if cached is not None and cached[0] >= account.context_version:
+            version, data = cached
+        else:
+            # The context is loaded with the account row
+            version, data = account.context_version, account.context or {}
+            state_cache.set(account.id, version, data)
+
+        self._version, self._data = version, dict(data)
+        expires = self._data.get(EXPIRES_KEY)
+        if expires is not None and expires < time.time():
+            self._data.clear()
+            self._replaced = True
+        return self._data
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self._load().get(key, default)
+
+    def __getitem__(self, key: str) -> Any:
+        return self._load()[key]
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._load()
+
+    def __setitem__(self, key: str, value: Any):
+        self.update({key: value})
+
+    def __delitem__(self, key: str):
+        del self._load()[key]
+        # The key removal rewrites the document
+        self._replaced = True
+        self.save()
+
+    def update(self, values: dict = None, **kwargs):
+        data = self._load()
+        values = dict(values or (), **kwargs)
+        data.update(values)
+        self._dirty.update(values)
+        self.save()
+
+    def clear(self):
+        self._load().clear()
+        self._replaced = True
+        self.save()
+
+    @property
+    def version(self) -> int:
+        self._load()
+        return self._version
+
+    def save(self):
+        """
+        Put the state to the hot tier and write it to the database,
+        the write is postponed inside the `DeferredUpdates` block
+        :raise StateConflict: the state was changed by another worker
+        """
+        from .models import _deferred_updates
+
+        if not (self._dirty or self._replaced):
+            return
+        if bot_api_settings.STATE_TTL:
+            self._data[EXPIRES_KEY] = time.time() + bot_api_settings.STATE_TTL
+            self._dirty.add(EXPIRES_KEY)
+
+        pending = _deferred_updates.get()
+        if pending is None:
+            self.flush()
+        else:
+            pending.setdefault(id(self), (self, None))
+
+    def flush(self):
+        """
+        Write the changes to the database
+        :raise StateConflict: the changes can not be merged
+        """
+        if not (self._dirty or self._replaced):
+            return
+
+        if not self._write():
+            if self._replaced or not self._merge() or not self._write():
+                state_cache.delete(self.account.id)
+                self._data = None
+                raise StateConflict(f'Conversation state is changed; '
+                                    f'Account={self.account.id};')
+
+        account = self.account
+        version = self._version + 1
+        self._version = version
+        self._dirty.clear()
+        self._replaced = False
+        account.context = dict(self._data)
+        account.context_version = version
+        state_cache.set(account.id, version, account.context)
+
+    def _write(self) -> bool:
+        from .models import Account
+
+        vendor = connections[Account.objects.db].vendor
+        if self._replaced or vendor != 'postgresql':
+            context = dict(self._data)
+        else:
+            context = F('context')
+            for key in self._dirty:
+                context = JsonbSet(context, key, self._data[key])
+
+        return bool(Account.objects.filter(
+            id=self.account.id, context_version=self._version,
+        ).update(context=context, context_version=self._version + 1))
+
+    def _merge(self) -> bool:
+        """
+        Put the changed keys over the state written by the other worker
+        """
+        from .models import Account
+
+        row = (Account.objects.filter(id=self.account.id)
+               .values_list('context', 'context_version').first())
+        if row is None:
+            return False
+        context, version = row
+        data = dict(context or {})
+        for key in self._dirty:
+            data[key] = self._data[key]
+        log.debug(f'Conversation state is merged; Account={self.account.id}; '
+                  f'Keys={sorted(self._dirty)};')
+        self._data, self._version = data, version
+        return True
@@ -0,0 +1,59 @@
+import asyncio
+from unittest import mock
+
+from django.test import TestCase
+
+from ..dedup import deduplicator
+from ..message_log import message_log
+from ..models import Messenger
+from ..types import Message, MessageType
+
+
+class DeduplicatorTests(TestCase):
+
+    def setUp(self):
+        deduplicator.clear()
+        self.addCleanup(deduplicator.clear)
+        patcher = mock.patch.object(message_log, 'log_incoming')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.messenger = Messenger.objects.create(
+            title='Bot', api_type='telegram', token='1:token')
+        self.calls = []
+
+    def fail_once(self, message: Message):
+        self.calls.append(message.id)
+        if len(self.calls) == 1:
+            raise RuntimeError('Handler error')
+
+    async def afail_once(self, message: Message):
+        self.fail_once(message)
+
+    def test_duplicate_is_dropped(self):
+        self.messenger._handle_message = self.calls.append
+        message = Message(MessageType.TEXT, 1, '7', text='Hi')
+
+        self.messenger.handle_message(message)
+        self.messenger.handle_message(message)
+        self.assertEqual(self.calls, [message])
+
+    def test_failed_update_is_forgotten(self):
+        self.messenger._handle_message = self.fail_once
+        message = Message(MessageType.TEXT, 2, '7', text='Hi')
+
+        with self.assertRaises(RuntimeError):
+            self.messenger.handle_message(message)
+        self.messenger.handle_message(message)
+        self.messenger.handle_message(message)
+        self.assertEqual(self.calls, [2, 2])
+
+    def test_failed_update_is_forgotten_async(self):
+        self.messenger._ahandle_message = self.afail_once
+        message = Message(MessageType.TEXT, 3, '7', text='Hi')
+
+        with self.assertRaises(RuntimeError):
+            asyncio.run(self.messenger.ahandle_message(message))
+        asyncio.run(self.messenger.ahandle_message(message))
+        asyncio.run(self.messenger.ahandle_message(message))
+        self.assertEqual(self.calls, [3, 3])
@@ -0,0 +1,69 @@
+import threading
+import time
+
+from django.test import SimpleTestCase
+
+from ..dispatcher import KeyedExecutor
+
+
+class KeyedExecutorTests(SimpleTestCase):
+
+    def setUp(self):
+        self.executor = KeyedExecutor(4, 100, 10, name='test-keyed')
+        self.executor.start()
+        self.addCleanup(self.executor.shutdown)
+
+    def test_key_order(self):
+        done = {key: [] for key in range(4)}
+
+        def task(key, num):
+            time.sleep(0.001)
+            done[key].append(num)
+
+        for num in range(10):
+            for key in done:
+                self.assertTrue(self.executor.submit(key, task, key, num))
+        self.executor.shutdown()
+
+        for key, nums in done.items():
+            self.assertEqual(nums, list(range(10)))
+
+    def test_keys_in_parallel(self):
+        release = threading.Event()
+        other = threading.Event()
+        self.executor.submit('busy', release.wait, 5)
+        self.executor.submit('busy', release.wait, 5)
+        self.executor.submit('other', other.set)
+
+        self.assertTrue(other.wait(5))
+        release.set()
+
+    def test_key_queue_bound(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        self.executor.submit('key', release.wait, 5)
+        # The first task is taken by a worker, 10 more are queued
+        while self.executor.stats()['depth']:
+            time.sleep(0.001)
+        for _ in range(10):
+            self.assertTrue(self.executor.submit('key', release.wait, 5))
+
+        self.assertFalse(self.executor.submit('key', release.wait, 5))
+        self.assertTrue(self.executor.submit('other', release.wait, 5))
+        self.assertEqual(self.executor.stats()['rejected'], 1)
+
+    def test_pending_bound(self):
+        executor = KeyedExecutor(1, 2, 10, name='test-bound')
+        release = threading.Event()
+        executor.submit('key', release.wait, 5)
+        executor.submit('key', release.wait, 5)
+
+        started = time.monotonic()
+        self.assertFalse(executor.submit('other', release.wait, timeout=0.05))
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+
+        executor.start()
+        release.set()
+        self.assertTrue(executor.submit('other', release.wait, timeout=5))
+        executor.shutdown()
+        self.assertEqual(executor.stats()['completed'], 3)
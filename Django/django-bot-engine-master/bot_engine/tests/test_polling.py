@@ -0,0 +1,127 @@
+import threading
+import time
+
+from django.test import SimpleTestCase, TransactionTestCase
+
+from ..dispatcher import DispatchMode, DispatchPool
+from ..errors import MessengerException
+from ..management.commands.poll_telegram import Command, _Batch
+from ..models import Messenger
+from ..types import Message, MessageType
+
+
+class FakeApi:
+    """
+    The first getUpdates call returns the updates, the next one stops
+    the polling
+    """
+
+    def __init__(self, command: Command, updates: list):
+        self.command = command
+        self.updates = updates
+        self.offsets = []
+
+    def get_updates(self, offset: int, timeout: int) -> list:
+        self.offsets.append(offset)
+        if len(self.offsets) > 1:
+            self.command.stop.set()
+            return []
+        return self.updates
+
+    @staticmethod
+    def parse_update(update: dict) -> Message:
+        return Message(MessageType.TEXT, update['update_id'], '7', text='Hi')
+
+
+class BatchTests(SimpleTestCase):
+
+    def test_wait(self):
+        batch = _Batch()
+        batch.wait()
+
+        batch.add()
+        batch.add()
+        waiter = threading.Thread(target=batch.wait)
+        waiter.start()
+        batch.done()
+        waiter.join(0.05)
+        self.assertTrue(waiter.is_alive())
+
+        batch.done()
+        waiter.join(5)
+        self.assertFalse(waiter.is_alive())
+
+
+class PollTests(TransactionTestCase):
+    # The offset is read by the dispatch threads
+
+    def setUp(self):
+        self.messenger = Messenger.objects.create(
+            title='Bot', api_type='telegram', token='1:token',
+            update_offset=5)
+        self.command = Command()
+        self.command.pool = DispatchPool(DispatchMode.THREAD, 2)
+        self.command.stop = threading.Event()
+        self.addCleanup(self.command.pool.shutdown)
+        self.handled = []
+
+    def handle_message(self, message: Message):
+        time.sleep(0.05)
+        self.handled.append(message.id)
+
+    def poll(self, updates: list) -> FakeApi:
+        api = FakeApi(self.command, updates)
+        self.messenger._api = api
+        self.messenger.handle_message = self.handle_message
+        self.command.poll(self.messenger)
+        return api
+
+    def offset(self) -> int:
+        return Messenger.objects.get(id=self.messenger.id).update_offset
+
+    def test_offset_is_committed_after_dispatch(self):
+        saved = []
+        handle_message = self.handle_message
+
+        def handle(message: Message):
+            handle_message(message)
+            saved.append(self.offset())
+        self.handle_message = handle
+
+        api = self.poll([{'update_id': num} for num in (5, 6, 7)])
+
+        self.assertEqual(self.handled, [5, 6, 7])
+        # The updates are received again if the process stops
+        # before the dispatch
+        self.assertEqual(saved, [5, 5, 5])
+        self.assertEqual(api.offsets, [5, 8])
+        self.assertEqual(self.offset(), 8)
+
+    def test_unparsed_update_is_skipped(self):
+        api = FakeApi(self.command, [{'update_id': 5}, {'update_id': 6}])
+        api.parse_update = self.parse_first
+        self.messenger._api = api
+        self.messenger.handle_message = self.handle_message
+        self.command.poll(self.messenger)
+
+        self.assertEqual(self.handled, [5])
+        self.assertEqual(self.offset(), 7)
+
+    @staticmethod
+    def parse_first(update: dict) -> Message:
+        if update['update_id'] != 5:
+            raise MessengerException('Unsupported update')
+        return FakeApi.parse_update(update)
+
+    def test_offset_is_kept_when_stopped(self):
+        # The full queue holds the polling until it is stopped
+        def stop_and_reject(*args, **kwargs):
+            self.command.stop.set()
+            return False
+        self.command.pool.submit = stop_and_reject
+        api = FakeApi(self.command, [{'update_id': 5}])
+        self.messenger._api = api
+        self.command.poll(self.messenger)
+
+        self.assertEqual(api.offsets, [5])
+        self.assertEqual(self.offset(), 5)
@@ -0,0 +1,77 @@
+from unittest import mock
+
+from django.test import TestCase
+
+from ..models import MessageLog, Messenger
+from ..receipts import ReceiptAggregator
+from ..types import Message, MessageType
+
+
+class ReceiptAggregatorTests(TestCase):
+
+    def setUp(self):
+        # The receipts are written by `flush` in the test thread
+        patcher = mock.patch.object(ReceiptAggregator, '_start')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.aggregator = ReceiptAggregator(batch_size=2, max_size=10)
+        self.messenger = Messenger.objects.create(
+            title='Bot', api_type='telegram', token='1:token')
+
+    def receipt(self, message_type: MessageType, message_id: str) -> bool:
+        return self.aggregator.add(
+            self.messenger, Message(message_type, message_id, '7'))
+
+    def sent(self, *message_ids: str, status: str = MessageLog.SENT):
+        MessageLog.objects.bulk_create([
+            MessageLog(messenger=self.messenger, account_id='7',
+                       direction=MessageLog.OUTGOING,
+                       message_type=MessageType.TEXT.value,
+                       message_id=message_id, status=status)
+            for message_id in message_ids])
+
+    def statuses(self) -> dict:
+        return dict(MessageLog.objects.values_list('message_id', 'status'))
+
+    def test_receipts_are_folded(self):
+        self.assertTrue(self.receipt(MessageType.DELIVERED, '1'))
+        self.assertTrue(self.receipt(MessageType.SEEN, '1'))
+        self.assertFalse(self.receipt(MessageType.DELIVERED, '1'))
+        self.assertFalse(self.receipt(MessageType.FAILED, '1'))
+        self.assertFalse(self.receipt(MessageType.TEXT, '1'))
+
+        self.assertEqual(dict(self.aggregator._take()),
+                         {(self.messenger.id, '1'): MessageType.SEEN})
+
+    def test_status_is_not_downgraded(self):
+        self.sent('1', '2', '3', '4', '5')
+        self.sent('6', status=MessageLog.SEEN)
+        self.receipt(MessageType.DELIVERED, '1')
+        self.receipt(MessageType.DELIVERED, '2')
+        self.receipt(MessageType.SEEN, '2')
+        self.receipt(MessageType.SEEN, '3')
+        self.receipt(MessageType.FAILED, '4')
+        self.receipt(MessageType.DELIVERED, '6')
+        self.aggregator.flush()
+
+        self.assertEqual(self.statuses(), {
+            '1': MessageLog.DELIVERED, '2': MessageLog.SEEN,
+            '3': MessageLog.SEEN, '4': MessageLog.FAILED,
+            '5': MessageLog.SENT, '6': MessageLog.SEEN})
+
+        self.sent('7', status=MessageLog.DELIVERED)
+        self.receipt(MessageType.SEEN, '7')
+        self.receipt(MessageType.FAILED, '1')
+        self.aggregator.flush()
+        self.assertEqual(self.statuses()['7'], MessageLog.SEEN)
+        self.assertEqual(self.statuses()['1'], MessageLog.DELIVERED)
+
+    def test_oldest_receipts_are_dropped(self):
+        for num in range(12):
+            self.receipt(MessageType.DELIVERED, str(num))
+
+        self.assertEqual(self.aggregator.dropped, 2)
+        self.assertEqual([message_id for _, message_id
+                          in self.aggregator._take()],
+                         [str(num) for num in range(2, 12)])
@@ -0,0 +1,88 @@
+from django.test import TestCase
+
+from ..errors import StateConflict
+from ..models import Account, DeferredUpdates, Messenger
+from ..state import state_cache
+
+
+class ConversationStateTests(TestCase):
+
+    def setUp(self):
+        self.messenger = Messenger.objects.create(
+            title='Bot', api_type='telegram', token='1:token')
+        Account.objects.create(id='7', messenger=self.messenger)
+        state_cache.delete('7')
+        self.addCleanup(state_cache.delete, '7')
+
+    @staticmethod
+    def account() -> Account:
+        return Account.objects.get(id='7')
+
+    @staticmethod
+    def context() -> dict:
+        return {key: value for key, value in Account.objects.get(id='7')
+                .context.items() if not key.startswith('_')}
+
+    def test_version_is_incremented(self):
+        account = self.account()
+        version = account.state.version
+        account.state['step'] = 1
+        account.state.update(name='A')
+
+        self.assertEqual(account.state.version, version + 2)
+        self.assertEqual(self.account().context_version, version + 2)
+        self.assertEqual(self.context(), {'step': 1, 'name': 'A'})
+
+    def test_deferred_write(self):
+        account = self.account()
+        version = account.state.version
+        with DeferredUpdates():
+            account.state['step'] = 1
+            account.state['name'] = 'A'
+            self.assertEqual(self.context(), {})
+
+        self.assertEqual(self.account().context_version, version + 1)
+        self.assertEqual(self.context(), {'step': 1, 'name': 'A'})
+
+    def test_conflict_is_merged(self):
+        first, second = self.account(), self.account()
+        first.state.get('step')
+        second.state.get('step')
+
+        first.state.update(step=1, name='A')
+        second.state['step'] = 2
+
+        self.assertEqual(self.context(), {'step': 2, 'name': 'A'})
+        self.assertEqual(second.state['name'], 'A')
+        self.assertEqual(second.state.version,
+                         self.account().context_version)
+
+    def test_cleared_state_conflict(self):
+        first, second = self.account(), self.account()
+        first.state.get('step')
+        second.state.get('step')
+
+        first.state['step'] = 1
+        with self.assertRaises(StateConflict):
+            second.state.clear()
+        self.assertEqual(self.context(), {'step': 1})
+
+        # The update is dispatched again with the account loaded anew
+        self.account().state.clear()
+        self.assertEqual(self.context(), {})
+
+    def test_deferred_conflict_is_raised(self):
+        first, second = self.account(), self.account()
+        first.state.get('step')
+        second.state.get('step')
+
+        first.state['step'] = 1
+        with self.assertRaises(StateConflict):
+            with DeferredUpdates():
+                second.state.clear()
+                second.update(is_active=False)
+
+        # The other pending updates are written
+        account = self.account()
+        self.assertFalse(account.is_active)
+        self.assertEqual(self.context(), {'step': 1})
@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from .errors import RetryAfter
+from .metrics import metrics
+from .settings import bot_api_settings
+
+
+__all__ = ('Priority', 'TokenBucket', 'OutboundScheduler')
+
+log = logging.getLogger(__name__)
+
+# One lock for all buckets, tokens of several buckets are taken atomically
+_lock = threading.Lock()
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    BROADCAST = 1
+
+
+class TokenBucket:
+    """
+    Token bucket with `rate` tokens per second and `burst` capacity.
+    Broadcast traffic can not take the last `reserve` tokens,
+    they are left for the interactive replies.
+    """
+
+    def __init__(self, rate: float, burst: float = None,
+                 reserve: float = 0):
+        self.rate = rate
+        self.capacity = max(burst or rate, 1)
+        self.reserve = min(reserve, self.capacity - 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_till = 0
+
+    def wait_time(self, now: float, priority: Priority) -> float:
+        """
+        Seconds to wait for the token. Must be called under the lock.
+        """
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        need = 1 + (self.reserve if priority == Priority.BROADCAST else 0)
+        wait = max(0, (need - self.tokens) / self.rate)
+        return max(wait, self.paused_till - now)
+
+    def pause(self, seconds: float):
+        """
+        Stop giving tokens, the API asked to retry after `seconds`.
+        """
+        with _lock:
+            self.paused_till = max(self.paused_till,
+                                   time.monotonic() + seconds)
+
+
+class OutboundScheduler:
+    """
+    Paces the outgoing API calls of one connector with the global,
+    per-bot and per-chat token buckets, retries the calls rejected with
+    `RetryAfter` with exponential backoff.
+    The schedulers are shared by the connectors of the same bot,
+    see `for_bot`.
+    """
+    _global_bucket: Optional[TokenBucket] = None
+    # (connector class, token) -> scheduler
+    _schedulers: Dict[Tuple[type, str], 'OutboundScheduler'] = {}
+    max_chats = 10000
+
+    def __init__(self, limits: Dict[str, Tuple[float, float]],
+                 name: str = ''):
+        """
+        :param limits: {'bot': (rate, burst), 'chat': (rate, burst)}
+        :param name: connector name of the metrics
+        """
+        self.name = name
+        self._bot_bucket = self._bucket(limits.get('bot'))
+        self._chat_limit = limits.get('chat')
+        self._chat_buckets: Dict[str, TokenBucket] = OrderedDict()
+
+    @classmethod
+    def for_bot(cls, connector_class: type, token: str,
+                limits: Dict[str, Tuple[float, float]],
+                name: str = '') -> 'OutboundScheduler':
+        """
+        Scheduler of the bot, the connectors rebuilt for the same bot
+        keep its buckets
+        """
+        key = (connector_class, token)
+        with _lock:
+            scheduler = cls._schedulers.get(key)
+            if scheduler is None:
+                scheduler = cls._schedulers[key] = cls(limits, name)
+            return scheduler
+
+    @classmethod
+    def global_bucket(cls) -> Optional[TokenBucket]:
+        if cls._global_bucket is None and bot_api_settings.GLOBAL_RATE_LIMIT:
+            cls._global_bucket = cls._bucket(
+                bot_api_settings.GLOBAL_RATE_LIMIT)
+        return cls._global_bucket
+
+    @staticmethod
+    def _bucket(limit: Optional[Tuple[float, float]]) -> Optional[TokenBucket]:
+        if not limit:
+            return None
+        rate, burst = limit
+        # 20% of the burst is reserved for the interactive replies
+        return TokenBucket(rate, burst, reserve=int(burst * 0.2))
+
+    def _chat_bucket(self, chat_id: str) -> Optional[TokenBucket]:
+        if not self._chat_limit or chat_id is None:
+            return None
+
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            rate, burst = self._chat_limit
+            bucket = self._chat_buckets[chat_id] = TokenBucket(rate, burst)
+            if len(self._chat_buckets) > self.max_chats:
+                self._chat_buckets.popitem(last=False)
+        else:
+            self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    def _take(self, chat_id: str, priority: Priority) -> float:
+        """
+        Take the tokens of all buckets or return the time to wait.
+        """
+        with _lock:
+            buckets = [bucket for bucket in (self.global_bucket(),
+                                             self._bot_bucket,
+                                             self._chat_bucket(chat_id))
+                       if bucket is not None]
+            now = time.monotonic()
+            wait = max([bucket.wait_time(now, priority) for bucket in buckets],
+                       default=0)
+            if wait == 0:
+                for bucket in buckets:
+                    bucket.tokens -= 1
+            return wait
+
+    def acquire(self, chat_id: str, priority: Priority = Priority.INTERACTIVE):
+        while True:
+            wait = self._take(chat_id, priority)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def aacquire(self, chat_id: str,
+                       priority: Priority = Priority.INTERACTIVE):
+        while True:
+            wait = self._take(chat_id, priority)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    def _backoff(self, err: RetryAfter, attempt: int) -> float:
+        if attempt >= bot_api_settings.SEND_RETRIES:
+            raise err
+        delay = max(err.retry_after or 0,
+                    bot_api_settings.SEND_BACKOFF * 2 ** attempt)
+        if self._bot_bucket is not None:
+            self._bot_bucket.pause(delay)
+        log.warning(f'API rate limit exceeded, retry after {delay}s; '
+                    f'Error={err};')
+        return delay
+
+    def call(self, chat_id: str, func: Callable[[], Any],
+             priority: Priority = None) -> Any:
+        """
+        Call `func` when the rate limits allow.
+        :param chat_id: receiver id
+        :param func: API call
+        :param priority: interactive replies go ahead of broadcasts
+        :return: result of the call
+        """
+        if priority is None:
+            priority = Priority.INTERACTIVE
+        attempt = 0
+        while True:
+            self.acquire(chat_id, priority)
+            try:
+                result = func()
+            except RetryAfter as err:
+                metrics.inc('bot_engine_api_calls_total', api=self.name,
+                            result='retry')
+                time.sleep(self._backoff(err, attempt))
+                attempt += 1
+            except Exception:
+                metrics.inc('bot_engine_api_calls_total', api=self.name,
+                            result='error')
+                raise
+            else:
+                metrics.inc('bot_engine_api_calls_total', api=self.name,
+                            result='ok')
+                return result
+
+    async def acall(self, chat_id: str, func: Callable[[], Awaitable],
+                    priority: Priority = None) -> Any:
+        """
+        Async variant of `call`
+        """
+        if priority is None:
+            priority = Priority.INTERACTIVE
+        attempt = 0
+        while True:
+            await self.aacquire(chat_id, priority)
+            try:
+                result = await func()
+            except RetryAfter as err:
+                metrics.inc('bot_engine_api_calls_total', api=self.name,
+                            result='retry')
+                await asyncio.sleep(self._backoff(err, attempt))
+                attempt += 1
+            except Exception:
+                metrics.inc('bot_engine_api_calls_total', api=self.name,
+                            result='error')
+                raise
+            else:
+                metrics.inc('bot_engine_api_calls_total', api=self.name,
+                            result='ok')
+                return result
@@ -1,5 +1,6 @@
 from __future__ import annotations
 from enum import Enum
+from types import MappingProxyType
 
 from django.utils.translation import gettext_lazy as _
 
@@ -47,53 +48,128 @@ class MessageType(Enum):
         return tuple((x.value, _(x.value.capitalize())) for x in cls)
 
 
+# Category membership, checked for every update
+SERVICE_TYPES = frozenset(MessageType.service_types())
+COMMON_TYPES = frozenset(MessageType.common_types())
+TEXT_TYPES = frozenset((MessageType.TEXT, MessageType.URL))
+BUTTON_TYPES = frozenset((MessageType.BUTTON, MessageType.KEYBOARD))
+RECEIPT_TYPES = frozenset((MessageType.DELIVERED, MessageType.SEEN,
+                           MessageType.FAILED))
+
+_EMPTY = MappingProxyType({})
+
+
+class _ValueOrFactory:
+    """
+    The slot value on the instance and the factory classmethod
+    on the class, so `Message.text('hi')` and `message.text` both work
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+
+    def __set_name__(self, owner, name):
+        self.slot = owner.__dict__[f'_{name}']
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self.factory.__get__(owner, owner)
+        return self.slot.__get__(instance, owner)
+
+
 class Message:
+    """
+    Immutable message passed between the connectors, the dispatcher
+    and the handlers. Use `replace` to get a changed copy.
+    """
+    __slots__ = ('type', 'id', 'user_id', 'timestamp', '_text', 'buttons',
+                 'user_name', 'context', 'error', 'kwargs')
+    _fields = ('type', 'id', 'user_id', 'timestamp', 'text', 'buttons',
+               'user_name', 'context', 'error')
+
     def __init__(self, message_type: MessageType,
                  message_id: str = None,
                  user_id: str = None,
                  timestamp: int = None,
                  text: str = None,
                  buttons: list = None,
+                 user_name: str = None,
+                 context: str = None,
+                 error: str = None,
                  **kwargs):
-        self.type = message_type
-        self.id = message_id
-        self.user_id = user_id
-        self.timestamp = timestamp
-        self.text = text
-        self.buttons = buttons
-
         # TODO: add messenger id and type. For what ?
+        _set = object.__setattr__
+        _set(self, 'type', message_type)
+        _set(self, 'id', message_id)
+        _set(self, 'user_id', user_id)
+        _set(self, 'timestamp', timestamp)
+        _set(self, '_text', text)
+        _set(self, 'buttons', buttons)
+        _set(self, 'user_name', user_name)
+        _set(self, 'context', context)
+        _set(self, 'error', error)
+        # Extra fields of the message type (media url, size, etc.)
+        _set(self, 'kwargs', MappingProxyType(kwargs) if kwargs else _EMPTY)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{self.__class__.__name__} is immutable, '
+                             f'use replace().')
+
+    def __delattr__(self, name):
+        raise AttributeError(f'{self.__class__.__name__} is immutable.')
+
+    def __reduce__(self):
+        return self.__class__._restore, tuple(
+            getattr(self, name) for name in self._fields) + (dict(self.kwargs), )
 
-        self.user_name = kwargs.get('user_name')
-        self.context = kwargs.get('context')
-        self.error = kwargs.get('error')
-
-        self.kwargs = kwargs
+    @classmethod
+    def _restore(cls, *args) -> Message:
+        *fields, kwargs = args
+        return cls(*fields, **kwargs)
 
     def __str__(self):
         return f'Message(token={self.id}, type={self.type}, account={self.user_id})'
 
+    def __repr__(self):
+        return f'<{self}>'
+
+    def replace(self, **changes) -> Message:
+        """
+        Copy of the message with the changed fields,
+        `type` and `id` are changed by `message_type` and `message_id`
+        """
+        fields = {'message_type': self.type, 'message_id': self.id}
+        fields.update((name, getattr(self, name))
+                      for name in self._fields[2:])
+        fields.update(self.kwargs)
+        fields.update(changes)
+        return self.__class__(**fields)
+
     @property
     def is_common(self) -> bool:
-        return self.type in MessageType.common_types()
+        return self.type in COMMON_TYPES
 
     @property
     def is_service(self) -> bool:
-        return self.type in MessageType.service_types()
+        return self.type in SERVICE_TYPES
 
     @property
     def is_text(self) -> bool:
-        return self.type in [MessageType.TEXT, MessageType.URL]
+        return self.type in TEXT_TYPES
 
     @property
     def is_button(self) -> bool:
-        return self.type in [MessageType.BUTTON, MessageType.KEYBOARD]
+        return self.type in BUTTON_TYPES
+
+    @property
+    def is_receipt(self) -> bool:
+        return self.type in RECEIPT_TYPES
 
     ##############################################
     # Class methods returning a new typed object #
     ##############################################
 
-    @classmethod
+    @_ValueOrFactory
     def text(cls, text: str):
         return cls(MessageType.TEXT, text=text)
 
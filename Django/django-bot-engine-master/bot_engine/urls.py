@@ -1,6 +1,8 @@
 from django.urls import path
 
-from .views import MessengerCallback, MessengerSwitch
+from .views import (
+    MessengerCallback, MessengerSwitch, messenger_callback, metrics_view
+)
 
 
 app_name = 'bot_engine'
@@ -10,5 +12,7 @@ urlpatterns = [
          {'switch_on': True}, name='enable'),
     path('<int:id>/disable/', MessengerSwitch.as_view(),
          {'switch_on': False}, name='disable'),
+    path('metrics/', metrics_view, name='metrics'),
     path('<str:hash>/', MessengerCallback.as_view(), name='webhook'),
+    path('<str:hash>/async/', messenger_callback, name='async_webhook'),
 ]
@@ -1,19 +1,41 @@
+import hmac
 import logging
 
+from asgiref.sync import sync_to_async
+from django.http import (
+    Http404, HttpRequest, HttpResponse, HttpResponseForbidden, JsonResponse
+)
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework import permissions
-from rest_framework.exceptions import NotFound
+from rest_framework.exceptions import NotFound, PermissionDenied, Throttled
 from rest_framework.response import Response
 from rest_framework.request import Request
 from rest_framework.views import APIView
 
+from .dispatcher import dispatch_pool
+from .metrics import PrometheusExporter, metrics
 from .models import Messenger
+from .routing import messenger_registry
+from .settings import bot_api_settings
 
 
 log = logging.getLogger(__name__)
 
 
+def verify_request(messenger: Messenger, request: Request) -> bool:
+    """
+    Check the webhook signature before the body is parsed,
+    the connector of the routed messenger holds the token
+    """
+    if not bot_api_settings.VERIFY_WEBHOOKS:
+        return True
+    if messenger.api.verify_request(request):
+        return True
+    log.warning(f'Webhook signature is invalid; Messenger={messenger!r};')
+    return False
+
+
 class MessengerSwitch(APIView):
     """
     View for activate and deactivate webhooks
@@ -32,6 +54,7 @@ class MessengerSwitch(APIView):
             messenger.enable_webhook()
         else:
             messenger.disable_webhook()
+        messenger_registry.discard(messenger)
 
         return Response()
 
@@ -55,15 +78,92 @@ class MessengerCallback(APIView):
 
     @staticmethod
     def post(request: Request, **kwargs) -> Response:
-        log.debug(f'Bot Api POST; Message={request.data};')
+        # The body is decoded by the connector, `request.data` is not used
         im_hash = kwargs.get('hash', '')
+        log.debug(f'Bot Api POST; Hash={im_hash};')
 
         try:
-            messenger = Messenger.objects.get(hash=im_hash)
-            answer = messenger.dispatch(request)
+            messenger = messenger_registry.get(im_hash)
         except Messenger.DoesNotExist as err:
-            log.exception(f'Messenger not found; Hash={hash}; Error={err};')
+            log.exception(f'Messenger not found; Hash={im_hash}; Error={err};')
             raise NotFound('Handler not found.')
 
+        if not verify_request(messenger, request):
+            raise PermissionDenied('Invalid signature.')
+
+        if not dispatch_pool.is_enabled:
+            answer = messenger.dispatch(request)
+        else:
+            with metrics.stage('parse', messenger.id) as timer:
+                message = messenger.api.parse_message(request)
+                timer.message_type = message.type
+            # The service messages are cheap and the welcome message
+            # is the answer to the webhook request
+            if message.is_service:
+                answer = messenger.handle_message(message)
+            elif dispatch_pool.submit(messenger, message):
+                answer = None
+            else:
+                raise Throttled()
+
         log.debug(f'Bot Api POST; Answer={answer};')
         return Response(answer)
+
+
+async def messenger_callback(request: HttpRequest, **kwargs) -> HttpResponse:
+    """
+    Native async messengers callbacks, requires ASGI server
+    """
+    if request.method != 'POST':
+        return HttpResponse(status=405)
+
+    im_hash = kwargs.get('hash', '')
+    messenger = messenger_registry.peek(im_hash)
+    if messenger is None:
+        try:
+            messenger = await sync_to_async(messenger_registry.get)(im_hash)
+        except Messenger.DoesNotExist as err:
+            log.exception(f'Messenger not found; Hash={im_hash}; Error={err};')
+            return JsonResponse({'detail': 'Handler not found.'}, status=404)
+
+    request = Request(request)
+    if not verify_request(messenger, request):
+        return JsonResponse({'detail': 'Invalid signature.'}, status=403)
+
+    answer = await messenger.adispatch(request)
+
+    log.debug(f'Bot Api async POST; Answer={answer};')
+    if answer is None:
+        return HttpResponse()
+    return JsonResponse(answer)
+
+
+# The decorator would wrap the coroutine function into a synchronous one
+messenger_callback.csrf_exempt = True
+
+
+def metrics_allowed(request: HttpRequest) -> bool:
+    """
+    The metrics are given to the staff users and to the scraper
+    with `Authorization: Bearer <METRICS_TOKEN>`
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_active and user.is_staff:
+        return True
+    token = bot_api_settings.METRICS_TOKEN
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    return bool(token) and hmac.compare_digest(
+        header.encode(), f'Bearer {token}'.encode())
+
+
+def metrics_view(request: HttpRequest) -> HttpResponse:
+    """
+    Dispatch metrics in Prometheus text format
+    """
+    exporter = metrics.exporter(PrometheusExporter)
+    if not metrics.enabled or exporter is None:
+        raise Http404('Metrics are disabled.')
+    if not metrics_allowed(request):
+        return HttpResponseForbidden('Metrics are not allowed.')
+    return HttpResponse(exporter.render(),
+                        content_type='text/plain; version=0.0.4')
@@ -11,8 +11,12 @@ setup(
     license='Apache 2.0',
     author='Aleksey Terentyev',
     author_email='terentjew.alexey@gmail.com',
-    packages=['bot_engine', 'bot_engine.messengers'],
+    packages=['bot_engine', 'bot_engine.management',
+              'bot_engine.management.commands', 'bot_engine.messengers'],
+    python_requires='>=3.7',
     install_requires=[
+        'Django>=3.1,<4.0',
+        'asgiref>=3.2.10',
         'djangorestframework>=3.11,<4.0',
         'urllib3',
         'PySocks>=1.7',
@@ -20,19 +24,20 @@ setup(
         'viberbot>=1.0.11',
         'pyTelegramBotAPI'
     ],
+    extras_require={
+        'async': ['httpx>=0.26'],
+    },
     classifiers=[
         'Development Status :: 2 - Pre-Alpha',
         'Framework :: Django',
-        'Framework :: Django :: 2.0',
-        'Framework :: Django :: 2.1',
-        'Framework :: Django :: 2.2',
-        'Framework :: Django :: 3.0',
+        'Framework :: Django :: 3.1',
+        'Framework :: Django :: 3.2',
         'Intended Audience :: Developers',
         'License :: OSI Approved :: Apache Software License',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.6',
         'Programming Language :: Python :: 3.7',
         'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
         'Environment :: Other Environment',
         'Operating System :: OS Independent',
         'Topic :: Communications',